@@ -0,0 +1,125 @@
+"""
+多 LoRA adapter 推理：底模只加载一次，swift 训练输出的 checkpoint（adapter_config.json + adapter_model.safetensors）
+按名字挂载/卸载，每个 batch 推理前切换到指定 adapter，不用 merge_lora 也不用重复加载整模型。
+
+LoRA 层注入在底模的模块里，eval.py 的 model 仍是底模本身（generate_batch 依赖 model.model.rope_deltas），
+这里只持有 PeftModel 用于管理 adapter。
+output_dir（swift --output_dir）下的 checkpoint 由 sync() 自动挂载 / 热更新 / 卸载，名字为相对 output_dir 的路径；
+只认 adapter_model.safetensors，不加载需要 torch.load 的 .bin
+"""
+import contextlib
+import os
+import re
+import threading
+from peft import PeftModel
+
+# 不使用任何 adapter（原始底模）
+BASE = "base"
+
+
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+
+
+def discover(output_dir):
+    """扫描 swift --output_dir 下的 checkpoint，返回 {"v2-20251029-141114/checkpoint-424": 路径}，按名字排序"""
+    found = {}
+    for root, dirs, files in os.walk(output_dir):
+        if re.fullmatch(r"checkpoint-\d+", os.path.basename(root)):
+            if "adapter_config.json" in files and ADAPTER_WEIGHTS in files:
+                found[os.path.relpath(root, output_dir)] = root
+            dirs[:] = []
+    return dict(sorted(found.items()))
+
+
+class AdapterRegistry:
+    def __init__(self, model, output_dir=None):
+        self.model = model
+        self.output_dir = output_dir
+        self.peft_model = None
+        self.paths = {}
+        self.default = None
+        # 由 sync() 从 output_dir 挂载的 adapter -> 权重文件 mtime，用于判断是否需要热更新
+        self.versions = {}
+        # 切换 adapter 与推理必须互斥，加载/卸载也要等当前 batch 结束
+        self.lock = threading.RLock()
+
+    def load(self, name, path):
+        """挂载 adapter，同名时先卸载再重新加载（热更新）"""
+        with self.lock:
+            if name in self.paths:
+                self.unload(name)
+            if self.peft_model is None:
+                self.peft_model = PeftModel.from_pretrained(self.model, path, adapter_name=name)
+                self.peft_model.eval()
+            else:
+                self.peft_model.load_adapter(path, adapter_name=name)
+            self.paths[name] = path
+            if self.default is None:
+                self.default = name
+
+    def unload(self, name):
+        with self.lock:
+            if name not in self.paths:
+                raise KeyError(f"adapter 未加载: {name}")
+            del self.paths[name]
+            self.versions.pop(name, None)
+            if self.default == name:
+                self.default = next(iter(self.paths), None)
+            # peft 不允许删除当前激活的 adapter，先切到其他 adapter
+            if self.peft_model.active_adapter == name and self.paths:
+                self.peft_model.set_adapter(next(iter(self.paths)))
+            self.peft_model.delete_adapter(name)
+
+    def load_discovered(self, name):
+        """按名字挂载 output_dir 下的 checkpoint（不接受任意路径），同名时热更新"""
+        if self.output_dir is None:
+            raise ValueError("未配置 adapter 目录")
+        found = discover(self.output_dir)
+        if name not in found:
+            raise KeyError(f"{self.output_dir} 下没有 checkpoint: {name}")
+        with self.lock:
+            self.load(name, found[name])
+            self.versions[name] = os.path.getmtime(os.path.join(found[name], ADAPTER_WEIGHTS))
+
+    def sync(self):
+        """
+        与 output_dir 同步：新 checkpoint 挂载，权重有更新的重新加载，磁盘上已删除的（如 save_total_limit 轮转）卸载。
+        返回 {"loaded": [...], "unloaded": [...]}
+        """
+        if self.output_dir is None:
+            raise ValueError("未配置 adapter 目录")
+        found = discover(self.output_dir)
+        loaded, unloaded = [], []
+        with self.lock:
+            for name, path in found.items():
+                mtime = os.path.getmtime(os.path.join(path, ADAPTER_WEIGHTS))
+                if self.versions.get(name) != mtime:
+                    self.load(name, path)
+                    self.versions[name] = mtime
+                    loaded.append(name)
+            for name in [x for x in self.versions if x not in found]:
+                del self.versions[name]
+                if name in self.paths:
+                    self.unload(name)
+                    unloaded.append(name)
+        return {"loaded": loaded, "unloaded": unloaded}
+
+    def names(self):
+        return list(self.paths)
+
+    @contextlib.contextmanager
+    def use(self, name=None):
+        """在 with 块内以 name 对应的 adapter 推理；name 为空用默认 adapter，为 BASE 用原始底模"""
+        name = name or self.default
+        with self.lock:
+            if name is None or name == BASE:
+                if self.peft_model is None:
+                    yield
+                else:
+                    with self.peft_model.disable_adapter():
+                        yield
+                return
+            if name not in self.paths:
+                raise KeyError(f"adapter 未加载: {name}")
+            self.peft_model.set_adapter(name)
+            yield
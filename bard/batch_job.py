@@ -0,0 +1,190 @@
+"""
+离线批量推理，可被抢占后续跑。
+
+requests.jsonl 每行一个请求 {"id": "...", "image_path": "..."}（没有 id 时用 image_path），流式读取，
+每读满 CHUNK 条按视觉 token 数排序分桶成 batch。结果逐条追加到 output JSONL，
+每 FSYNC_EVERY 个 batch fsync 一次并原子写 checkpoint（最后完成的 id 与计数）。
+重启时跳过 output 中已有的 id（截掉被中断时写了一半的末行），只处理剩下的请求。
+失败的请求连同错误信息写入 retry 文件，不计入已完成，下次运行会重新尝试
+"""
+import collections
+import copy
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import eval as ev
+from run_data import geometry
+from run_data.hole_format import compact_prompts
+from run_data.jsonstream import iter_records
+
+# ---------- 参数区 ----------
+REQUESTS_PATH = "../requests.jsonl"
+OUTPUT_PATH = "/root/autodl-tmp/qwen3_swift/batch_output.jsonl"
+RETRY_PATH = "/root/autodl-tmp/qwen3_swift/batch_retry.jsonl"
+BATCH_SIZE = 8
+# 每次读入并排序分桶的请求数
+CHUNK = 1024
+# 每隔多少个 batch fsync 并写 checkpoint
+FSYNC_EVERY = 10
+# 预处理线程数 / 提前准备的 batch 数
+PREP_WORKERS = 2
+PREFETCH = 2
+# 使用的 LoRA adapter 名（eval.ADAPTERS 中的键），None 为默认 adapter / 合并后的模型
+ADAPTER = None
+# ----------------------------
+
+
+def load_done(output_path):
+    """已完成的 id 集合。进程被杀时最后一行可能只写了一半，截掉"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["id"])
+            except ValueError:
+                break
+            valid += len(line)
+    if valid != os.path.getsize(output_path):
+        print(f"{output_path} 末尾有未写完的记录，截断到 {valid} 字节")
+        os.truncate(output_path, valid)
+    return done
+
+
+class BatchJob:
+    def __init__(self, requests_path, output_path, retry_path, prompts, adapter=None):
+        self.requests_path = requests_path
+        self.output_path = output_path
+        self.retry_path = retry_path
+        self.prompts = prompts
+        self.adapter = adapter
+        self.done = load_done(output_path)
+        self.skipped = len(self.done)
+        self.completed = 0
+        self.failed = 0
+        self.last_id = None
+        self.local = threading.local()
+
+    def fail(self, request, error):
+        self.retry.write(json.dumps({**request, "error": error}, ensure_ascii=False) + "\n")
+        self.failed += 1
+
+    def write(self, request, resp):
+        image_path = request["image_path"]
+        width, height = geometry.image_size(image_path)
+        holes = ev.page_holes(ev.parse_output(resp), width, height)
+        record = {"id": request["id"], "image_path": image_path, "width": width, "height": height, "holes": holes, "raw": resp}
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.done.add(request["id"])
+        self.completed += 1
+        self.last_id = request["id"]
+
+    def checkpoint(self):
+        for f in (self.out, self.retry):
+            f.flush()
+            os.fsync(f.fileno())
+        state = {
+            "last_id": self.last_id,
+            "done": len(self.done),
+            "failed": self.failed,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        tmp = self.output_path + ".ckpt.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.output_path + ".ckpt")
+
+    def chunks(self):
+        """流式读取请求，跳过已完成的，按 CHUNK 条一组排序分桶后 yield batch"""
+        pending = []
+        for n, record in enumerate(iter_records(self.requests_path)):
+            request = {"id": str(record.get("id", record.get("image_path"))), "image_path": record.get("image_path")}
+            if request["id"] in self.done:
+                continue
+            if not request["image_path"]:
+                self.fail({**request, "line": n + 1}, "缺少 image_path")
+                continue
+            try:
+                pending.append((ev.image_token_num(request["image_path"]), request))
+            except Exception as e:
+                self.fail(request, f"{type(e).__name__}: {e}")
+                continue
+            if len(pending) >= CHUNK:
+                yield from self.bucket(pending)
+                pending = []
+        yield from self.bucket(pending)
+
+    @staticmethod
+    def bucket(pending):
+        pending = [x[1] for x in sorted(pending, key=lambda x: x[0])]
+        for i in range(0, len(pending), BATCH_SIZE):
+            yield pending[i:i + BATCH_SIZE]
+
+    def prepare(self, batch):
+        if not hasattr(self.local, "processor"):
+            self.local.processor = copy.deepcopy(ev.processor)
+        return ev.prepare_batch([x["image_path"] for x in batch], self.prompts, self.local.processor)
+
+    def generate(self, batch, inputs_future):
+        """整批推理；整批失败时逐张重试，只把真正出错的图记入 retry"""
+        try:
+            return list(zip(batch, ev.generate_batch(inputs_future.result(), adapter=self.adapter)))
+        except Exception:
+            if len(batch) == 1:
+                raise
+        results = []
+        for request in batch:
+            try:
+                results.append((request, ev.run_batch([request["image_path"]], self.prompts, adapter=self.adapter)[0]))
+            except Exception as e:
+                self.fail(request, f"{type(e).__name__}: {e}")
+        return results
+
+    def run(self):
+        t0 = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as self.out, \
+                open(self.retry_path, "w", encoding="utf-8") as self.retry, \
+                ThreadPoolExecutor(PREP_WORKERS) as executor:
+            ahead = collections.deque()
+            batches = iter(self.chunks())
+            n_batches = 0
+            while True:
+                while len(ahead) < PREFETCH:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    ahead.append((batch, executor.submit(self.prepare, batch)))
+                if not ahead:
+                    break
+                batch, inputs_future = ahead.popleft()
+                try:
+                    results = self.generate(batch, inputs_future)
+                except Exception as e:
+                    traceback.print_exc()
+                    self.fail(batch[0], f"{type(e).__name__}: {e}")
+                    results = []
+                for request, resp in results:
+                    try:
+                        self.write(request, resp)
+                    except Exception as e:
+                        self.fail(request, f"{type(e).__name__}: {e}")
+                n_batches += 1
+                if n_batches % FSYNC_EVERY == 0:
+                    self.checkpoint()
+                    print(f"已完成 {self.completed}，失败 {self.failed}，{self.completed / (time.perf_counter() - t0):.2f} 张/s")
+            self.checkpoint()
+        print(f"本次完成 {self.completed}，此前已完成 {self.skipped}，失败 {self.failed}（见 {self.retry_path}），耗时 {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    BatchJob(REQUESTS_PATH, OUTPUT_PATH, RETRY_PATH, compact_prompts if ev.COMPACT else ev.prompts, ADAPTER).run()
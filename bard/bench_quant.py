@@ -0,0 +1,156 @@
+"""
+量化模型与 bf16 对比：模型内存占用、逐张推理延迟、两者相对标注（GT）的精度及其差值，以及两者输出的一致程度。
+
+待测模型为 eval.py 按 QUANT_PATH / DEVICE 加载的模型；bf16 参考模型从 eval.model_path 加载到同一设备，
+加载前释放 eval 中对量化模型的所有引用（model / adapters / draft_model），确认已回收后再加载，内存数据不互相叠加。
+测试样本与标注取自 benchmark.py 的 DATASET（dataprocess.py 生成的留出集 JSONL）。
+参考输出缓存在 REF_PATH（连同 model_path / DEVICE / 线程数 / 图片列表），对比不同量化配置时不必重跑 bf16；
+这些与本次不一致时重新测，延迟始终在同一批图片上对比
+"""
+import gc
+import json
+import os
+import sys
+import time
+import weakref
+import numpy as np
+import psutil
+import torch
+from transformers import Qwen3VLForConditionalGeneration
+
+import eval as ev
+from adapters import AdapterRegistry
+from benchmark import DATASET, IMAGE_ROOT, load_samples, is_compact
+from quantize import kernels, model_bytes
+from run_data import tracing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_data"))
+from hole_format import HoleStreamParser
+from metrics import DetectionMetrics
+
+# ---------- 参数区 ----------
+# 只取留出集前 N 张（CPU 上逐张推理较慢），None 为全部
+N_IMAGES = 20
+REF_PATH = "/root/autodl-tmp/qwen3_swift/bf16_reference.json"
+# 两边的框同类别且 IoU 不低于该值视为同一个孔
+IOU = 0.5
+# ----------------------------
+
+
+def infer(samples):
+    """逐张推理，返回 {图片: 输出文本}、每张耗时、生成 token 总数（按 generated_ids 长度计）"""
+    ev.run(samples[0]["image_path"], samples[0]["prompt"])
+    outputs, costs = {}, []
+    tokens_before = tracing.counter("generated_tokens")
+    for sample in samples:
+        t0 = time.perf_counter()
+        outputs[sample["image_path"]] = ev.run(sample["image_path"], sample["prompt"])[0]
+        costs.append(time.perf_counter() - t0)
+    return {"outputs": outputs, "costs": costs, "tokens": tracing.counter("generated_tokens") - tokens_before}
+
+
+def measure(samples):
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    result = infer(samples)
+    result["model_gb"] = model_bytes(ev.model) / (1 << 30)
+    result["kernels"] = kernels(ev.model)
+    result["rss_gb"] = psutil.Process().memory_info().rss / (1 << 30)
+    if torch.cuda.is_available():
+        result["gpu_peak_gb"] = torch.cuda.max_memory_allocated() / (1 << 30)
+    return result
+
+
+def release_model():
+    """释放 eval 中对当前模型的全部引用，模型仍未被回收时报错（否则 bf16 的内存数据会包含量化模型）"""
+    alive = weakref.ref(ev.model)
+    ev.model = None
+    ev.adapters = None
+    ev.draft_model = None
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    if alive() is not None:
+        raise RuntimeError("量化模型仍被引用，无法在同一进程内测 bf16，请先单独生成 REF_PATH")
+
+
+def accuracy(samples, outputs):
+    """outputs 相对标注的精度（overall）"""
+    metrics = DetectionMetrics([IOU])
+    for sample in samples:
+        compact = is_compact(sample["target"])
+        gt = HoleStreamParser(compact=compact).feed(sample["target"]).holes
+        metrics.add(gt, HoleStreamParser(compact=compact).feed(outputs[sample["image_path"]]).holes)
+    overall = metrics.summary()["overall"]
+    return {
+        "n_pred": overall["n_pred"],
+        "map": overall["iou"][str(IOU)]["map"] or 0.0,
+        "recall": overall["iou"][str(IOU)]["recall"] or 0.0,
+        "precision": overall["iou"][str(IOU)]["precision"],
+        "size_match": overall["size_match"] or 0.0,
+    }
+
+
+def summary(name, result, acc):
+    costs = np.array(result["costs"])
+    print(f"{name}:")
+    print(f"  模型权重 {result['model_gb']:.2f} GB，进程 RSS {result['rss_gb']:.2f} GB" + (
+        f"，峰值显存 {result['gpu_peak_gb']:.2f} GB" if "gpu_peak_gb" in result else ""))
+    if result.get("kernels"):
+        print(f"  量化 Linear 计算方式: {result['kernels']}")
+    print(f"  每张 平均 {costs.mean():.1f}s  p50 {np.percentile(costs, 50):.1f}s  p95 {np.percentile(costs, 95):.1f}s，"
+          f"{result['tokens'] / costs.sum():.1f} token/s")
+    print(f"  相对标注（IoU>={IOU}）: mAP {acc['map']:.3f}  召回 {acc['recall']:.1%}  精确 {acc['precision']:.1%}  "
+          f"尺寸一致 {acc['size_match']:.1%}")
+
+
+def reference_meta(image_paths):
+    """决定 REF_PATH 能否复用的信息：参考模型、设备、CPU 线程数与（有序的）图片列表"""
+    return {"model_path": ev.model_path, "device": ev.DEVICE, "threads": torch.get_num_threads(), "images": image_paths}
+
+
+def main():
+    samples = load_samples(DATASET, IMAGE_ROOT or os.path.dirname(os.path.abspath(DATASET)), N_IMAGES)
+    image_paths = [x["image_path"] for x in samples]
+    cand = measure(samples)
+
+    meta = reference_meta(image_paths)
+    ref = None
+    if os.path.exists(REF_PATH):
+        with open(REF_PATH, "r", encoding="utf-8") as f:
+            ref = json.load(f)
+        if ref.get("meta") != meta:
+            print(f"{REF_PATH} 与本次的模型/设备/线程数/图片不一致，重新测 bf16")
+            ref = None
+    if ref is None:
+        release_model()
+        ev.model = Qwen3VLForConditionalGeneration.from_pretrained(ev.model_path, dtype=torch.bfloat16, device_map=ev.DEVICE)
+        ev.adapters = AdapterRegistry(ev.model)
+        ref = dict(measure(samples), meta=meta)
+        with open(REF_PATH, "w", encoding="utf-8") as f:
+            json.dump(ref, f, ensure_ascii=False)
+
+    ref_acc = accuracy(samples, ref["outputs"])
+    cand_acc = accuracy(samples, cand["outputs"])
+    summary("bf16", ref, ref_acc)
+    summary(f"量化 {ev.QUANT_PATH}", cand, cand_acc)
+    ref_costs, cand_costs = np.array(ref["costs"]), np.array(cand["costs"])
+    print(f"量化相对 bf16 的延迟（同 {len(samples)} 张）: 平均 {ref_costs.mean() / cand_costs.mean():.2f}x，"
+          f"p50 {np.percentile(ref_costs, 50) / np.percentile(cand_costs, 50):.2f}x（>1 为量化更快）")
+    print(f"量化相对 bf16 的精度变化（{len(samples)} 张，IoU>={IOU}）:")
+    for k in ("map", "recall", "precision", "size_match"):
+        print(f"  {k:<11} {cand_acc[k] - ref_acc[k]:+.4f}")
+
+    # 两者输出的一致程度（以 bf16 输出为参考）
+    agreement = DetectionMetrics([IOU])
+    identical = 0
+    for image_path in image_paths:
+        agreement.add(ev.parse_output(ref["outputs"][image_path]), ev.parse_output(cand["outputs"][image_path]))
+        identical += ref["outputs"][image_path] == cand["outputs"][image_path]
+    overall = agreement.summary()["overall"]
+    print(f"与 bf16 输出对比: 完全一致 {identical} 张，bf16 {overall['n_gt']} 个孔，量化 {overall['n_pred']} 个，"
+          f"召回 {overall['iou'][str(IOU)]['recall'] or 0:.1%}，精确 {overall['iou'][str(IOU)]['precision']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
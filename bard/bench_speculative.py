@@ -0,0 +1,107 @@
+import os
+import time
+import torch
+from transformers.generation import candidate_generator
+
+import eval as ev
+from run_data import tracing
+
+# ---------- 参数区 ----------
+# 测试集沿用 eval.py 的 test_img_path
+# 对比的投机解码方式
+MODES = ["prompt_lookup"]
+# ----------------------------
+
+
+class DraftCounter:
+    """
+    统计草稿 token 数（包装 candidate generator 的 get_candidates）与主模型前向次数。
+    get_candidates 是 transformers 的内部接口，版本变化导致没有被调用时 check() 直接报错，不输出错误的接受率
+    """
+    GENERATORS = ("PromptLookupCandidateGenerator", "AssistedCandidateGenerator")
+
+    def __init__(self):
+        self.drafted = 0
+        self.calls = 0
+        self.forwards = 0
+        self._patched = []
+
+    def __enter__(self):
+        for name in self.GENERATORS:
+            cls = getattr(candidate_generator, name, None)
+            if cls is None or not hasattr(cls, "get_candidates"):
+                raise RuntimeError(f"当前 transformers 版本没有 {name}.get_candidates，无法统计草稿 token")
+            origin = cls.get_candidates
+            def get_candidates(gen, input_ids, *args, _origin=origin, **kwargs):
+                candidate_ids, candidate_logits = _origin(gen, input_ids, *args, **kwargs)
+                self.calls += 1
+                self.drafted += candidate_ids.shape[1] - input_ids.shape[1]
+                return candidate_ids, candidate_logits
+            cls.get_candidates = get_candidates
+            self._patched.append((cls, origin))
+        self._hook = ev.model.register_forward_pre_hook(self._count)
+        return self
+
+    def _count(self, module, args):
+        self.forwards += 1
+
+    def check(self, mode):
+        if self.calls == 0:
+            raise RuntimeError(f"{mode}: 包装的 get_candidates 未被调用（transformers 内部实现已变化），接受率无法统计")
+
+    def __exit__(self, *exc):
+        for cls, origin in self._patched:
+            cls.get_candidates = origin
+        self._hook.remove()
+
+
+def timed_run(image_path, gen_kwargs):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    resp = ev.run(image_path, ev.prompts, gen_kwargs)[0]
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return resp, time.perf_counter() - t0
+
+
+def main():
+    image_paths = sorted(os.path.join(ev.test_img_path, x) for x in os.listdir(ev.test_img_path))
+    # 预热
+    ev.run(image_paths[0], ev.prompts, {"do_sample": False})
+    greedy = {}
+    greedy_time = 0.0
+    for image_path in image_paths:
+        greedy[image_path], cost = timed_run(image_path, {"do_sample": False})
+        greedy_time += cost
+    print(f"greedy: {len(image_paths)} 张，耗时 {greedy_time:.1f}s")
+
+    for mode in MODES:
+        ev.SPECULATIVE = mode
+        gen_kwargs = ev.generate_kwargs()
+        spec_time = 0.0
+        mismatch = []
+        # 生成 token 数取 generate_one 按 generated_ids 长度累加的计数器
+        tokens_before = tracing.counter("generated_tokens")
+        with DraftCounter() as counter:
+            for image_path in image_paths:
+                resp, cost = timed_run(image_path, gen_kwargs)
+                spec_time += cost
+                if resp != greedy[image_path]:
+                    mismatch.append(image_path)
+        counter.check(mode)
+        tokens = tracing.counter("generated_tokens") - tokens_before
+        # 每张图 1 次 prefill，其余前向均为校验；每次校验额外产出 1 个 token
+        verify = counter.forwards - len(image_paths)
+        accepted = max(tokens - verify, 0)
+        print(f"{mode}:")
+        print(f"  耗时 {spec_time:.1f}s，端到端加速 {greedy_time / spec_time:.2f}x")
+        print(f"  草稿 token {counter.drafted}，接受 {accepted}，接受率 {accepted / max(counter.drafted, 1):.1%}")
+        print(f"  每次前向平均产出 {tokens / max(verify, 1):.2f} token")
+        print(f"  与 greedy 输出不一致: {len(mismatch)} 张")
+        for image_path in mismatch:
+            print(f"    {image_path}")
+
+
+if __name__ == "__main__":
+    main()
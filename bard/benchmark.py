@@ -0,0 +1,255 @@
+"""
+检测精度 + 吞吐基准：在留出集（测试集导出经 dataprocess.py 构建出的 view.jsonl，swift 格式）上跑 eval.py 加载的 checkpoint，
+统计按类别的 precision / recall / AP（多个 IoU 阈值）、尺寸字符串完全一致率、JSON 解析失败率、
+images/s、tokens/s 与 p50/p95/p99 延迟，写入 JSON 文件；指定 BASELINE 时打印与上一次结果的差异。
+
+BENCH_STUB=1 时不加载真实权重：用 BENCH_TINY_SOURCE（HF 仓库名或本地目录，只读取 config / tokenizer / processor）
+的配置缩小成随机初始化的微型 Qwen3-VL，存到 BENCH_TINY_DIR 后经 ModelBackend 走 eval.py 的
+prepare_batch / generate_batch / 解析全流程，供 CI 在 CPU 上验证推理代码（输出是随机 token，精度指标无意义）；
+未设置 BENCH_DATASET 时在 BENCH_TINY_DIR 下生成几张合成图当数据集，不依赖真实数据（见 .github/workflows/bench-stub.yml）
+"""
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_data"))
+from hole_format import HoleStreamParser, compact_prompts, to_compact
+from jsonstream import iter_records
+from metrics import DetectionMetrics
+
+# ---------- 参数区 ----------
+# 测试集构建目录（eval.py 的 test_img_path 即其 train_data）下的 view.jsonl；
+# 构建训练集时 dataprocess.py 的 reference_dirs 填同一目录检查泄漏
+DATASET = os.environ.get("BENCH_DATASET", "/root/autodl-tmp/qwen3_swift/test_img/view.jsonl")
+# 图片相对路径的根目录，默认为 DATASET 所在目录
+IMAGE_ROOT = os.environ.get("BENCH_IMAGE_ROOT")
+OUT_PATH = os.environ.get("BENCH_OUT", "bench_result.json")
+# 上一次的结果文件，用于对比
+BASELINE = os.environ.get("BENCH_BASELINE")
+STUB = os.environ.get("BENCH_STUB") == "1"
+TINY_SOURCE = os.environ.get("BENCH_TINY_SOURCE", "Qwen/Qwen3-VL-4B-Instruct")
+TINY_DIR = os.environ.get("BENCH_TINY_DIR", "/tmp/bench_tiny_qwen3vl")
+# 微型模型每张图最多生成的 token 数与视觉 token 上限（CPU 上控制耗时）
+TINY_MAX_NEW_TOKENS = 64
+TINY_MAX_IMAGE_TOKENS = 256
+BATCH_SIZE = 8
+IOU_THRESHOLDS = [0.5, 0.75]
+# 只取前 N 条，None 为全部
+LIMIT = None
+# ----------------------------
+
+
+def is_compact(text):
+    """紧凑格式输出是 JSON 对象，原格式是 JSON 列表"""
+    m = re.search(r"[\[{]", text)
+    return bool(m) and m.group() == "{"
+
+
+def load_samples(path, image_root, limit=None):
+    samples = []
+    for record in iter_records(path):
+        image = record["images"][0]
+        image = image["path"] if isinstance(image, dict) else image
+        user = next(x["content"] for x in record["messages"] if x["role"] == "user")
+        target = record["messages"][-1]["content"]
+        samples.append({"image_path": os.path.join(image_root, image), "prompt": user, "target": target})
+        if limit and len(samples) >= limit:
+            break
+    return samples
+
+
+class ModelBackend:
+    """eval.py 的 prepare_batch / generate_batch（import 时加载模型）"""
+    def __init__(self, max_new_tokens=1500):
+        import eval as ev
+        self.ev = ev
+        self.name = ev.QUANT_PATH or ev.BASE_MODEL_PATH or ev.model_path
+        self.max_new_tokens = max_new_tokens
+
+    def image_token_num(self, image_path):
+        return self.ev.image_token_num(image_path)
+
+    def generate(self, image_paths, prompt):
+        return self.ev.generate_batch(self.ev.prepare_batch(image_paths, prompt), self.max_new_tokens)
+
+    def count_tokens(self, text):
+        return len(self.ev.processor.tokenizer(text)["input_ids"])
+
+
+def tiny_model(out_dir, source=TINY_SOURCE):
+    """
+    按 source 的配置（层数、宽度缩到最小，token id / rope 类型等保持不变）随机初始化微型 Qwen3-VL，
+    连同 processor 与 generation_config 存到 out_dir，已存在时直接复用
+    """
+    if os.path.exists(os.path.join(out_dir, "config.json")):
+        return out_dir
+    import torch
+    from transformers import AutoConfig, AutoProcessor, GenerationConfig, Qwen3VLForConditionalGeneration
+    torch.manual_seed(0)
+    config = AutoConfig.from_pretrained(source)
+    text, vision = config.text_config, config.vision_config
+    text.update(dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                     num_attention_heads=4, num_key_value_heads=2, head_dim=16))
+    # mrope 三段之和须为 head_dim / 2
+    for attr in ("rope_scaling", "rope_parameters"):
+        rope = getattr(text, attr, None)
+        if isinstance(rope, dict) and "mrope_section" in rope:
+            setattr(text, attr, {**rope, "mrope_section": [4, 2, 2]})
+    vision.update(dict(depth=2, hidden_size=32, intermediate_size=64, num_heads=2,
+                       out_hidden_size=text.hidden_size, deepstack_visual_indexes=[0, 1]))
+    model = Qwen3VLForConditionalGeneration(config).to(torch.float32).eval()
+    model.generation_config = GenerationConfig.from_pretrained(source)
+    model.save_pretrained(out_dir)
+    processor = AutoProcessor.from_pretrained(source)
+    ip = processor.image_processor
+    factor = ip.patch_size * ip.merge_size
+    ip.size = {"shortest_edge": 4 * factor * factor, "longest_edge": TINY_MAX_IMAGE_TOKENS * factor * factor}
+    if hasattr(ip, "max_pixels"):
+        ip.min_pixels, ip.max_pixels = ip.size["shortest_edge"], ip.size["longest_edge"]
+    processor.save_pretrained(out_dir)
+    return out_dir
+
+
+def stub_dataset(out_dir, n=4):
+    """CI 用的合成数据集：白底图上画几个圆 / 矩形，标注为紧凑格式，返回 view.jsonl 路径"""
+    from PIL import Image, ImageDraw
+    os.makedirs(os.path.join(out_dir, "train_data"), exist_ok=True)
+    path = os.path.join(out_dir, "view.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            img = Image.new("RGB", (640, 480), "white")
+            draw = ImageDraw.Draw(img)
+            draw.ellipse([100 + 20 * i, 100, 180 + 20 * i, 180], outline="black", width=3)
+            draw.rectangle([360, 200 + 20 * i, 480, 280 + 20 * i], outline="black", width=3)
+            img.save(os.path.join(out_dir, "train_data", f"stub_{i}.png"))
+            holes = [
+                {"category": "圆孔", "bbox_2d": [(100 + 20 * i) * 1000 // 640, 208, (180 + 20 * i) * 1000 // 640, 375], "size": "18mm"},
+                {"category": "矩形孔", "bbox_2d": [562, (200 + 20 * i) * 1000 // 480, 750, (280 + 20 * i) * 1000 // 480], "size": "20*14mm"},
+            ]
+            record = {
+                "messages": [{"role": "user", "content": compact_prompts}, {"role": "assistant", "content": to_compact(holes)}],
+                "images": [f"train_data/stub_{i}.png"],
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return path
+
+
+def stub_backend():
+    """随机初始化的微型模型 + eval.py 的完整推理路径"""
+    os.environ["EVAL_MODEL_PATH"] = tiny_model(TINY_DIR)
+    backend = ModelBackend(TINY_MAX_NEW_TOKENS)
+    # 不写 processor 缓存（即使设置了 PROC_CACHE_DIR）
+    backend.ev.PROC_CACHE_DIR = None
+    return backend
+
+
+def batches(samples, backend, batch_size):
+    """同一提示词的样本按视觉 token 数排序后切 batch"""
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample["prompt"], []).append(sample)
+    for prompt, group in groups.items():
+        group = sorted(group, key=lambda x: backend.image_token_num(x["image_path"]))
+        for i in range(0, len(group), batch_size):
+            yield prompt, group[i:i + batch_size]
+
+
+def percentiles(values):
+    values = np.asarray(values) if len(values) else np.zeros(1)
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def run(samples, backend, dataset=DATASET):
+    metrics = DetectionMetrics(IOU_THRESHOLDS)
+    latency = []
+    tokens = 0
+    parse_failures = 0
+    aborted = {}
+    t0 = time.perf_counter()
+    for prompt, batch in batches(samples, backend, BATCH_SIZE):
+        t1 = time.perf_counter()
+        resps = backend.generate([x["image_path"] for x in batch], prompt)
+        # 同一 batch 的图片同时出结果，延迟都记为 batch 耗时
+        latency += [time.perf_counter() - t1] * len(batch)
+        for sample, resp in zip(batch, resps):
+            compact = is_compact(sample["target"])
+            gt = HoleStreamParser(compact=compact).feed(sample["target"]).holes
+            parser = HoleStreamParser(compact=compact).feed(resp)
+            if not parser.done or parser.aborted == "malformed":
+                parse_failures += 1
+            if parser.aborted:
+                aborted[parser.aborted] = aborted.get(parser.aborted, 0) + 1
+            metrics.add(gt, parser.holes)
+            tokens += backend.count_tokens(resp)
+    total = time.perf_counter() - t0
+    return {
+        "model": backend.name,
+        "dataset": dataset,
+        "n_images": len(samples),
+        "batch_size": BATCH_SIZE,
+        "accuracy": metrics.summary(),
+        "parse": {
+            "failure_rate": parse_failures / max(len(samples), 1),
+            "aborted": aborted,
+        },
+        "speed": {
+            "seconds": total,
+            "images_per_s": len(samples) / total,
+            "tokens_per_s": tokens / total,
+            "latency_s": percentiles(latency),
+        },
+    }
+
+
+def headline(result):
+    """用于对比的关键指标"""
+    overall = result["accuracy"]["overall"]
+    values = {f"mAP@{thr}": v["map"] for thr, v in overall["iou"].items()}
+    values.update({f"recall@{thr}": v["recall"] for thr, v in overall["iou"].items()})
+    values["size_match"] = overall["size_match"]
+    values["parse_failure_rate"] = result["parse"]["failure_rate"]
+    values["images_per_s"] = result["speed"]["images_per_s"]
+    values["tokens_per_s"] = result["speed"]["tokens_per_s"]
+    values["latency_p95_s"] = result["speed"]["latency_s"]["p95"]
+    return values
+
+
+def fmt(v):
+    return "-" if v is None else f"{v:.3f}"
+
+
+def report(result, baseline=None):
+    print(f"{result['model']}  {result['n_images']} 张")
+    for category, v in result["accuracy"]["per_class"].items():
+        line = "  ".join(f"@{thr} P {fmt(x['precision'])} R {fmt(x['recall'])} AP {fmt(x['ap'])}" for thr, x in v["iou"].items())
+        print(f"  {category:<4} gt {v['n_gt']:>4} pred {v['n_pred']:>4}  {line}")
+    old = headline(baseline) if baseline else {}
+    for k, v in headline(result).items():
+        delta = ""
+        if old.get(k) is not None and v is not None:
+            delta = f"  ({v - old[k]:+.4f})"
+        print(f"  {k:<20} {v if v is None else round(v, 4)}{delta}")
+
+
+def main():
+    dataset = DATASET
+    if STUB and "BENCH_DATASET" not in os.environ:
+        dataset = stub_dataset(os.path.join(TINY_DIR, "data"))
+    samples = load_samples(dataset, IMAGE_ROOT or os.path.dirname(os.path.abspath(dataset)), LIMIT)
+    backend = stub_backend() if STUB else ModelBackend()
+    result = run(samples, backend, dataset)
+    with open(OUT_PATH, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    baseline = None
+    if BASELINE:
+        with open(BASELINE, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    print(f"结果已写入 {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+训练过程中在后台增量上传 checkpoint，替代训练结束后一次性 gsutil cp（被抢占 / 失败时所有 checkpoint 都会丢）。
+
+python ckpt_upload.py watch    与 swift sft 并行运行：轮询 OUTPUT_DIR 下的 checkpoint-N（swift 会建 vX-时间戳 子目录），
+                               写完（trainer_state.json 已存在，且更新的 checkpoint 已出现或文件在 SETTLE_S 秒内不再变化）
+                               即上传，大文件分块并行；远端已有且大小 / MD5 一致的文件跳过。
+                               每个 checkpoint 上传完后写 UPLOADED 标记，按 SAVE_TOTAL_LIMIT 删除远端同一 run 的旧 checkpoint。
+                               出现 STOP_FILE（训练结束）后把所有 checkpoint 与其余输出（日志、args.json 等）同步一遍再退出
+python ckpt_upload.py restore  找到远端最新一次 run 中带 UPLOADED 标记的最新 checkpoint，下载回 OUTPUT_DIR 对应位置并打印本地路径，
+                               供 --resume_from_checkpoint 使用；没有时不输出
+
+远端为 storage.py 支持的 gs:// / s3:// / 本地目录（测试用）
+"""
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from run_data import storage
+
+# ---------- 参数区 ----------
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/app/output")
+REMOTE = os.environ.get("GCS_OUTPUT_PATH", "gs://im-drawing-462011-outputs")
+# 与 swift sft 的 --save_total_limit 一致，远端每个 run 只保留最新的 N 个（外加 best checkpoint），0 为不删除
+SAVE_TOTAL_LIMIT = int(os.environ.get("SAVE_TOTAL_LIMIT", "2"))
+# 训练结束后由 train.sh 创建
+STOP_FILE = os.environ.get("CKPT_UPLOAD_STOP", os.path.join(OUTPUT_DIR, ".training_done"))
+POLL_S = 30
+SETTLE_S = 60
+# 同时上传的文件数 / 单个文件的并行块数
+FILE_WORKERS = 4
+CHUNK_WORKERS = 8
+# ----------------------------
+
+MARKER = "UPLOADED"
+CKPT_RE = re.compile(r"^checkpoint-(\d+)$")
+# swift 的 run 目录名 vX-YYYYMMDD-HHMMSS 中的时间戳
+RUN_RE = re.compile(r"-(\d{8}-\d{6})$")
+
+
+def remote_url(rel):
+    return REMOTE.rstrip("/") + "/" + rel.replace(os.sep, "/")
+
+
+def remote_stat(url):
+    """远端对象不存在时返回 None"""
+    try:
+        return storage.backend(url, FILE_WORKERS * CHUNK_WORKERS).stat(url)
+    except Exception:
+        return None
+
+
+def find_checkpoints(root):
+    """root 下所有 checkpoint-N 目录 -> [(相对路径, step)]，按 step 排序"""
+    found = []
+    for dirpath, dirnames, _ in os.walk(root):
+        for name in list(dirnames):
+            m = CKPT_RE.match(name)
+            if m:
+                found.append((os.path.relpath(os.path.join(dirpath, name), root), int(m.group(1))))
+                # checkpoint 内部不再往下找
+                dirnames.remove(name)
+    return sorted(found, key=lambda x: x[1])
+
+
+def snapshot(path):
+    """目录下所有文件的 (相对路径, 大小, mtime)，用于判断是否还在写"""
+    files = []
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            full = os.path.join(dirpath, name)
+            st = os.stat(full)
+            files.append((os.path.relpath(full, path), st.st_size, st.st_mtime_ns))
+    return sorted(files)
+
+
+class Uploader:
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=FILE_WORKERS)
+        # 本地文件 (路径, 大小, mtime) -> md5，避免反复计算
+        self.md5_cache = {}
+        self.uploaded = set()
+        self.pending = {}
+
+    def md5(self, path):
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in self.md5_cache:
+            self.md5_cache[key] = storage.file_md5(path)
+        return self.md5_cache[key]
+
+    def put(self, local_path, rel):
+        """上传单个文件，远端大小与 MD5 一致时跳过，返回 (上传字节数, {"size", "md5"})"""
+        url = remote_url(rel)
+        md5 = self.md5(local_path)
+        size = os.path.getsize(local_path)
+        remote = remote_stat(url)
+        if remote and remote["size"] == size and remote["md5"] == md5:
+            return 0, {"size": size, "md5": md5}
+        storage.backend(url, FILE_WORKERS * CHUNK_WORKERS).put(local_path, url, md5, CHUNK_WORKERS)
+        return size, {"size": size, "md5": md5}
+
+    def sync_dir(self, local_dir, rel_dir, exclude=()):
+        """并行上传目录下的文件，返回 (上传字节数, {相对路径: {"size", "md5"}})"""
+        files = [x[0] for x in snapshot(local_dir) if not x[0].startswith(exclude)]
+        futures = {
+            name: self.pool.submit(self.put, os.path.join(local_dir, name), os.path.join(rel_dir, name))
+            for name in files
+        }
+        sent, manifest = 0, {}
+        for name, fut in futures.items():
+            n, manifest[name] = fut.result()
+            sent += n
+        return sent, manifest
+
+    def upload_checkpoint(self, rel, step):
+        local = os.path.join(OUTPUT_DIR, rel)
+        t0 = time.perf_counter()
+        try:
+            sent, files = self.sync_dir(local, rel)
+        except FileNotFoundError:
+            if not os.path.exists(local):
+                # 上传过程中被 save_total_limit 轮转删除
+                print(f"[upload] {rel} 已被删除，跳过")
+                self.uploaded.add(rel)
+                return
+            raise
+        marker = {"step": step, "files": files, "uploaded_at": time.time()}
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump(marker, f, ensure_ascii=False)
+        try:
+            url = remote_url(os.path.join(rel, MARKER))
+            storage.backend(url).put(f.name, url, storage.file_md5(f.name))
+        finally:
+            os.remove(f.name)
+        self.uploaded.add(rel)
+        elapsed = time.perf_counter() - t0
+        print(f"[upload] {rel}: {len(files)} 个文件，上传 {sent / (1 << 30):.2f} GB，{elapsed:.0f}s")
+        self.prune(os.path.dirname(rel))
+
+    def prune(self, run_rel):
+        """远端同一 run 只保留最新 SAVE_TOTAL_LIMIT 个已完成的 checkpoint，best checkpoint 不删"""
+        if SAVE_TOTAL_LIMIT <= 0:
+            return
+        run_url = remote_url(run_rel) + "/" if run_rel else REMOTE.rstrip("/") + "/"
+        steps = {}
+        for url, rel in storage.backend(run_url).list(run_url):
+            parts = rel.split("/")
+            if len(parts) >= 2 and CKPT_RE.match(parts[0]):
+                steps.setdefault(parts[0], {"urls": [], "done": False})
+                steps[parts[0]]["urls"].append(url)
+                steps[parts[0]]["done"] |= parts[-1] == MARKER and len(parts) == 2
+        done = sorted((x for x in steps if steps[x]["done"]), key=lambda x: int(CKPT_RE.match(x).group(1)))
+        keep = set(done[-SAVE_TOTAL_LIMIT:]) | {self.best_checkpoint(run_rel)}
+        for name in done[:-SAVE_TOTAL_LIMIT]:
+            if name in keep:
+                continue
+            # 先删标记，中途失败也不会被当成完整 checkpoint 恢复
+            urls = sorted(steps[name]["urls"], key=lambda u: not u.endswith("/" + MARKER))
+            for url in urls:
+                storage.backend(url).delete(url)
+            print(f"[upload] 删除远端旧 checkpoint {os.path.join(run_rel, name)}")
+
+    @staticmethod
+    def best_checkpoint(run_rel):
+        """本地最新 trainer_state.json 中记录的 best_model_checkpoint（目录名）"""
+        ckpts = find_checkpoints(os.path.join(OUTPUT_DIR, run_rel))
+        for rel, _ in reversed(ckpts):
+            path = os.path.join(OUTPUT_DIR, run_rel, rel, "trainer_state.json")
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        best = json.load(f).get("best_model_checkpoint")
+                    return os.path.basename(best.rstrip("/")) if best else None
+                except (OSError, ValueError):
+                    continue
+        return None
+
+    def is_complete(self, rel, newer_exists, final):
+        """trainer_state.json 最后写；之后出现了更新的 checkpoint、训练已结束、或文件 SETTLE_S 内不再变化即视为写完"""
+        local = os.path.join(OUTPUT_DIR, rel)
+        if not os.path.exists(os.path.join(local, "trainer_state.json")):
+            return False
+        if newer_exists or final:
+            return True
+        snap = snapshot(local)
+        last = self.pending.get(rel)
+        if last is None or last[0] != snap:
+            self.pending[rel] = (snap, time.monotonic())
+            return False
+        return time.monotonic() - last[1] >= SETTLE_S
+
+    def scan(self, final=False):
+        ckpts = find_checkpoints(OUTPUT_DIR)
+        for i, (rel, step) in enumerate(ckpts):
+            if rel in self.uploaded:
+                continue
+            newer = any(s > step and os.path.dirname(r) == os.path.dirname(rel) for r, s in ckpts[i + 1:])
+            try:
+                if not self.is_complete(rel, newer, final):
+                    continue
+                if remote_stat(remote_url(os.path.join(rel, MARKER))):
+                    # 之前已上传（如恢复训练时下载回来的 checkpoint）
+                    self.uploaded.add(rel)
+                    continue
+                self.upload_checkpoint(rel, step)
+            except FileNotFoundError:
+                # 扫描过程中被轮转删除
+                self.pending.pop(rel, None)
+            except Exception:
+                # 网络等错误下一轮重试，不影响训练
+                traceback.print_exc()
+
+    def final_sync(self):
+        """训练结束：补传所有 checkpoint，再同步 checkpoint 以外的输出"""
+        self.scan(final=True)
+        exclude = tuple(rel + os.sep for rel, _ in find_checkpoints(OUTPUT_DIR)) + (os.path.basename(STOP_FILE),)
+        sent, files = self.sync_dir(OUTPUT_DIR, "", exclude)
+        print(f"[upload] 其余输出 {len(files)} 个文件，上传 {sent / (1 << 20):.1f} MB")
+
+
+def watch():
+    print(f"[upload] 监视 {OUTPUT_DIR} -> {REMOTE}")
+    uploader = Uploader()
+    while not os.path.exists(STOP_FILE):
+        uploader.scan()
+        for _ in range(POLL_S):
+            if os.path.exists(STOP_FILE):
+                break
+            time.sleep(1)
+    uploader.final_sync()
+
+
+def marker_time(url):
+    """UPLOADED 标记中记录的上传时间"""
+    buf = io.BytesIO()
+    storage.backend(url).read(url, 0, buf)
+    return json.loads(buf.getvalue().decode("utf-8"))["uploaded_at"]
+
+
+def latest_uploaded():
+    """
+    远端最新一次 run 中带标记、step 最大的 checkpoint 的相对路径，没有时为 None。
+    run 按目录名中的时间戳排序（不同 run 的 step 不可比，新 run 的 step 可能更小）；
+    有 run 的目录名不带时间戳时，按各 run 最新标记中的上传时间排序
+    """
+    root = REMOTE.rstrip("/") + "/"
+    # run 相对路径 -> (step, checkpoint 相对路径, 标记 url)
+    runs = {}
+    for url, rel in storage.backend(root).list(root):
+        parts = rel.split("/")
+        if parts[-1] != MARKER or len(parts) < 2 or not CKPT_RE.match(parts[-2]):
+            continue
+        run = "/".join(parts[:-2])
+        step = int(CKPT_RE.match(parts[-2]).group(1))
+        if run not in runs or step > runs[run][0]:
+            runs[run] = (step, "/".join(parts[:-1]), url)
+    if not runs:
+        return None
+    stamps = {run: RUN_RE.search(run.rsplit("/", 1)[-1]) for run in runs}
+    if all(stamps.values()):
+        latest = max(runs, key=lambda run: stamps[run].group(1))
+    else:
+        latest = max(runs, key=lambda run: marker_time(runs[run][2]))
+    return runs[latest][1]
+
+
+def restore():
+    rel = latest_uploaded()
+    if rel is None:
+        return None
+    local = os.path.join(OUTPUT_DIR, rel)
+    # stdout 只留给最终路径，下载进度打到 stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        records = storage.fetch_all([remote_url(rel) + "/"], local, FILE_WORKERS * CHUNK_WORKERS,
+                                    manifest_path=os.path.join(OUTPUT_DIR, ".restore_manifest.jsonl"))
+    failed = [x["url"] for x in records if x["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"恢复 {rel} 失败: {failed[:5]}")
+    return local
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "watch"
+    if mode == "restore":
+        path = restore()
+        if path:
+            sys.stderr.write(f"[upload] 从 {path} 恢复训练\n")
+            print(path)
+    else:
+        watch()
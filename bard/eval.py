@@ -1,21 +1,68 @@
-from transformers import Qwen3VLForConditionalGeneration,Qwen2_5_VLForConditionalGeneration, AutoProcessor
+from transformers import Qwen3VLForConditionalGeneration,Qwen2_5_VLForConditionalGeneration, AutoProcessor, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
 import numpy as np
 import math
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 from typing import Dict, List, Tuple
 import random
 import re
 from typing import List
 import os
+import copy
+import json
+import queue
+import threading
+import time
+import torch
+from run_data.hole_format import compact_prompts, HoleStreamParser
+from run_data import geometry, tracing
+from proc_cache import ProcessorCache
+from adapters import AdapterRegistry
+from quantize import load_quantized
+from model_cache import ModelFetch, load_model
 
 
-def extract_json_blocks(text: str) -> List[str]:
+class HoleStreamer(BaseStreamer):
     """
-    提取所有 ```json ... ``` 代码块中的内容。
-    返回 List[str]，每个元素就是一个 JSON 字符串（可能跨行）。
+    generate 的 streamer：把新生成的 token 增量解码后喂给 HoleStreamParser，
+    配合 ParserStoppingCriteria 在 JSON 结束 / 结尾 ``` / 复读时立即停止生成
     """
-    pattern = re.compile(r'```json\s*([\s\S]*?)```', re.MULTILINE)
-    return eval([m.group(1).strip() for m in pattern.finditer(text)][0])
+    def __init__(self, tokenizer, compact=False, skip_prompt=True):
+        self.tokenizer = tokenizer
+        self.parser = HoleStreamParser(compact=compact)
+        self.skip_prompt = skip_prompt
+        self.token_cache = []
+        self.text_len = 0
+        # 第一个生成 token 到达的时间，用于区分 prefill / decode 耗时
+        self.first_token_time = None
+
+    def put(self, value):
+        if self.skip_prompt:
+            self.skip_prompt = False
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.token_cache.extend(value.reshape(-1).tolist())
+        text = self.tokenizer.decode(self.token_cache, skip_special_tokens=True)
+        # 多字节字符未解码完整时先不输出
+        if text.endswith("\ufffd"):
+            return
+        self.parser.feed(text[self.text_len:])
+        if text.endswith("\n"):
+            self.token_cache = []
+            self.text_len = 0
+        else:
+            self.text_len = len(text)
+
+    def end(self):
+        pass
+
+class ParserStoppingCriteria(StoppingCriteria):
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.streamer.parser.done, dtype=torch.bool, device=input_ids.device)
 
 def draw_bboxes_pil(
         img_path: str,
@@ -47,12 +94,9 @@ mode:str = "qwen2"):
             color_map[label] = tuple(random.randint(0, 255) for _ in range(3))
     for label, boxes in bboxes_dict.items():
         color = color_map[label]
+        if mode == "qwen3":
+            boxes = geometry.from_norm1000(boxes, img_w, img_h).tolist()
         for (x1, y1, x2, y2) in boxes:
-            if mode == "qwen3":
-                x1 = round(x1 / 1000 * img_w)
-                y1 = round(y1 / 1000 * img_h)
-                x2 = round(x2 / 1000 * img_w)
-                y2 = round(y2 / 1000 * img_h)
             draw.rectangle([x1, y1, x2, y2], outline=color, width=box_width)
             left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
             text_w = right - left
@@ -63,12 +107,41 @@ mode:str = "qwen2"):
     img.save(save_path)
     print(f"saved -> {save_path}")
 
-model_path = "/root/autodl-tmp/qwen3_swift/output/v2-20251029-141114/checkpoint-424-merged"
+# 本地路径，或 gs:// / s3:// 上的模型目录（由 model_cache.py 拉取到 MODEL_CACHE_DIR 后加载）
+model_path = os.environ.get("EVAL_MODEL_PATH", "/root/autodl-tmp/qwen3_swift/output/v2-20251029-141114/checkpoint-424-merged")
+# 不合并 LoRA：BASE_MODEL_PATH 不为空时只加载一次底模，ADAPTERS 里的 checkpoint 作为可切换的 adapter 挂载，
+# 推理时按名字选择（默认第一个）；为空时按原方式加载合并后的 model_path
+BASE_MODEL_PATH = None
+ADAPTERS = {
+    # "v2-424": "/root/autodl-tmp/qwen3_swift/output/v2-20251029-141114/checkpoint-424",
+}
+# swift 的 --output_dir（需配合 BASE_MODEL_PATH），不为空时启动时挂载其下所有 checkpoint，
+# server.py 的 POST /adapters/reload 可随时重新扫描热加载（名字如 "v2-20251029-141114/checkpoint-424"）
+ADAPTER_DIR = None
+# 推理设备："auto" 为 GPU（device_map="auto"），"cpu" 为纯 CPU
+DEVICE = "auto"
+# quantize.py 导出的 weight-only 量化目录（合并后的模型），不为空时代替 model_path 加载，不支持 ADAPTERS
+QUANT_PATH = None
+# 单卡时用 model_cache.load_model 边下载边按分片加载（冷启动更快），默认 False 为 from_pretrained（等分片全部下完）
+LAZY_LOAD = False
 
-model = Qwen3VLForConditionalGeneration.from_pretrained(
-    model_path, dtype="auto", device_map="auto"
-)
-processor = AutoProcessor.from_pretrained(model_path)
+if QUANT_PATH:
+    model = load_quantized(QUANT_PATH, device="cpu" if DEVICE == "cpu" or not torch.cuda.is_available() else "cuda")
+    processor = AutoProcessor.from_pretrained(QUANT_PATH)
+else:
+    model_fetch = ModelFetch(BASE_MODEL_PATH or model_path)
+    if LAZY_LOAD and not (DEVICE == "auto" and torch.cuda.device_count() > 1):
+        model = load_model(model_fetch, device="cpu" if DEVICE == "cpu" or not torch.cuda.is_available() else "cuda")
+    else:
+        # 多卡按 device_map 切分，等分片全部到齐后交给 from_pretrained
+        model = Qwen3VLForConditionalGeneration.from_pretrained(model_fetch.wait(), dtype="auto", device_map=DEVICE)
+    processor = AutoProcessor.from_pretrained(model_fetch.path)
+draft_model = None
+adapters = AdapterRegistry(model, ADAPTER_DIR)
+for name, path in ADAPTERS.items():
+    adapters.load(name, path)
+if ADAPTER_DIR:
+    adapters.sync()
 
 
 
@@ -115,28 +188,109 @@ prompts = """<image>
   - 无置信度阈值要求，但不得重复框。
 
 请按以上指令执行检测并直接返回 JSON，勿附加解释。"""
-def run(img_path,prompts):
+def load_draft_model():
+    """按需加载投机解码用的小 draft 模型（需与主模型共用 tokenizer）"""
+    global draft_model
+    if draft_model is None:
+        draft_model = Qwen3VLForConditionalGeneration.from_pretrained(
+            DRAFT_MODEL_PATH, dtype="auto", device_map="auto"
+        )
+    return draft_model
+
+def generate_kwargs():
+    """
+    逐张推理（generate_one）的 generate 参数。一律 greedy（do_sample=False，忽略 generation_config 里的采样设置），
+    与 batch 推理（_generate_batch 逐步 argmax）一致，输出不随 BATCH_SIZE 变化。
+    SPECULATIVE：prompt_lookup 用已有文本（prompt + 已生成部分）做 n-gram 草稿，draft 用小模型出草稿，
+    主模型一次前向校验多个 token，greedy 下与普通解码逐 token 一致
+    """
+    if SPECULATIVE == "prompt_lookup":
+        return {"do_sample": False, "prompt_lookup_num_tokens": PROMPT_LOOKUP_NUM_TOKENS}
+    if SPECULATIVE == "draft":
+        return {"do_sample": False, "assistant_model": load_draft_model()}
+    return {"do_sample": False}
+
+proc_cache = None
+proc_cache_lock = threading.Lock()
+
+def get_proc_cache():
+    """PROC_CACHE_DIR 不为空时返回 processor 输出缓存（首次调用时创建）"""
+    global proc_cache
+    if not PROC_CACHE_DIR:
+        return None
+    with proc_cache_lock:
+        if proc_cache is None:
+            proc_cache = ProcessorCache(PROC_CACHE_DIR, processor, int(PROC_CACHE_MAX_GB * (1 << 30)))
+    return proc_cache
+
+def load_images(img_paths):
+    """图片路径 / PIL 图片 -> RGB PIL 图片（与 processor 内部读图一致：按 EXIF 方向旋正）"""
+    with tracing.span("image_load", n=len(img_paths)):
+        return [
+            x.convert("RGB") if isinstance(x, Image.Image) else ImageOps.exif_transpose(Image.open(x)).convert("RGB")
+            for x in img_paths
+        ]
+
+def cuda_sync():
+    """span 的 sync 参数：GPU 上计时前等 kernel 执行完"""
+    return torch.cuda.synchronize if model.device.type == "cuda" else None
+
+def run(img_path,prompts,gen_kwargs=None,adapter=None):
+    cache = get_proc_cache()
+    if cache is not None and isinstance(img_path, str):
+        with tracing.span("processor_cache", n=1):
+            inputs = cache.batch([img_path], prompts, processor)
+        return generate_one(inputs, gen_kwargs, adapter)
+    image = load_images([img_path])[0]
     messages = [
         {
             "role": "user",
             "content": [
                 {
                     "type": "image",
-                    "image": img_path,
+                    "image": image,
                 },
                 {"type": "text", "text": prompts},
             ],
         }
     ]
-    inputs = processor.apply_chat_template(
-        messages,
-        tokenize=True,
-        add_generation_prompt=True,
-        return_dict=True,
-        return_tensors="pt"
-    )
+    with tracing.span("processor", n=1):
+        inputs = processor.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt"
+        )
+    return generate_one(inputs, gen_kwargs, adapter)
+
+def generate_one(inputs, gen_kwargs=None, adapter=None):
     inputs = inputs.to(model.device)
-    generated_ids = model.generate(**inputs, max_new_tokens=1500)
+    if gen_kwargs is None:
+        gen_kwargs = generate_kwargs()
+    streamer = None
+    t0 = time.perf_counter()
+    with adapters.use(adapter):
+        if STREAM:
+            streamer = HoleStreamer(processor.tokenizer, compact=COMPACT)
+            generated_ids = model.generate(
+                **inputs,
+                max_new_tokens=1500,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([ParserStoppingCriteria(streamer)]),
+                **gen_kwargs,
+            )
+        else:
+            generated_ids = model.generate(**inputs, max_new_tokens=1500, **gen_kwargs)
+    total = time.perf_counter() - t0
+    n_tokens = generated_ids.shape[1] - inputs.input_ids.shape[1]
+    tracing.count("generated_tokens", n_tokens)
+    if streamer is not None and streamer.first_token_time is not None:
+        prefill = streamer.first_token_time - t0
+        tracing.observe("prefill", prefill, prompt_tokens=inputs.input_ids.shape[1])
+        tracing.observe("decode", total - prefill, tokens=n_tokens, tokens_per_s=n_tokens / max(total - prefill, 1e-9))
+    else:
+        tracing.observe("generate", total, tokens=n_tokens, tokens_per_s=n_tokens / max(total, 1e-9))
     generated_ids_trimmed = [
         out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
     ]
@@ -145,23 +299,453 @@ def run(img_path,prompts):
     )
     return output_text
 
+def image_token_num(img_path):
+    """
+    按 processor 的 smart_resize 规则估算图片的视觉 token 数（image_grid_thw 的 h*w/merge^2），
+    只读 PNG 头不解码像素，用于分桶
+    """
+    ip = processor.image_processor
+    size = getattr(ip, "size", None) or {}
+    min_pixels = size.get("shortest_edge", getattr(ip, "min_pixels", 56 * 56))
+    max_pixels = size.get("longest_edge", getattr(ip, "max_pixels", 28 * 28 * 1280))
+    factor = getattr(ip, "patch_size", 16) * getattr(ip, "merge_size", 2)
+    width, height = geometry.image_size(img_path)
+    h_bar, w_bar = geometry.smart_resize(height, width, factor, min_pixels, max_pixels)
+    return (h_bar // factor) * (w_bar // factor)
+
+def bucket_images(img_paths, batch_size):
+    """
+    按视觉 token 数排序后切成 batch，同一 batch 内图片尺寸接近，padding 最少
+    """
+    sized = sorted(img_paths, key=image_token_num)
+    return [sized[i:i + batch_size] for i in range(0, len(sized), batch_size)]
+
+def prepare_batch(img_paths, prompts, proc=None):
+    """
+    CPU 侧预处理：读图 + chat template + tokenize，返回 padding 好的 inputs（仍在 CPU 上）。
+    多线程调用时每个线程传入自己的 proc 副本（fast tokenizer 不能并发修改 padding 状态）
+    """
+    proc = proc or processor
+    cache = get_proc_cache()
+    if cache is not None and all(isinstance(x, str) for x in img_paths):
+        with tracing.span("processor_cache", n=len(img_paths)):
+            return cache.batch(img_paths, prompts, proc)
+    messages = [
+        [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "image": image},
+                    {"type": "text", "text": prompts},
+                ],
+            }
+        ]
+        for image in load_images(img_paths)
+    ]
+    proc.tokenizer.padding_side = "left"
+    with tracing.span("processor", n=len(img_paths)):
+        return proc.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=True,
+        )
+
+def run_batch(img_paths, prompts, max_new_tokens=1500, adapter=None):
+    """多张图片一次 padding 成一个 batch 推理，返回与 img_paths 同序的输出文本"""
+    return generate_batch(prepare_batch(img_paths, prompts), max_new_tokens, adapter)
+
+def generate_batch(inputs, max_new_tokens=1500, adapter=None):
+    """以 adapter（见 adapters.AdapterRegistry.use）推理一个 batch"""
+    with adapters.use(adapter):
+        return _generate_batch(inputs, max_new_tokens)
+
+@torch.inference_mode()
+def _generate_batch(inputs, max_new_tokens=1500):
+    """
+    GPU 侧 greedy 解码（不按 generation_config 采样，与 generate_kwargs 一致）。某条序列生成 EOS 后即从 batch 中剔除（同时裁剪 KV cache / attention_mask / rope_deltas），
+    剩余序列继续解码，不再为已结束的序列做无效计算。
+    STREAM 打开时每条序列边生成边解析，JSON 结束或复读时同样提前剔除
+    """
+    inputs = inputs.to(model.device)
+    eos_ids = model.generation_config.eos_token_id
+    eos_ids = torch.tensor(eos_ids if isinstance(eos_ids, list) else [eos_ids], device=model.device)
+
+    prompt_len = inputs.input_ids.shape[1]
+    attention_mask = inputs.attention_mask
+    with tracing.span("prefill", sync=cuda_sync(), batch=len(attention_mask), prompt_tokens=prompt_len):
+        # 只取最后一个位置的 logits，不生成 batch x prompt_len x vocab 的整张 logits
+        out = model(**inputs, use_cache=True, cache_position=torch.arange(prompt_len, device=model.device),
+                    logits_to_keep=1)
+        past_key_values = out.past_key_values
+        next_tokens = out.logits[:, -1, :].argmax(dim=-1)
+
+    t0 = time.perf_counter()
+    active = list(range(len(attention_mask)))
+    generated = [[] for _ in active]
+    streamers = [HoleStreamer(processor.tokenizer, compact=COMPACT, skip_prompt=False) for _ in active] if STREAM else None
+    for step in range(max_new_tokens):
+        finished = torch.isin(next_tokens, eos_ids)
+        for k, (row, token) in enumerate(zip(active, next_tokens.tolist())):
+            generated[row].append(token)
+            if streamers is not None:
+                streamers[row].put(torch.tensor([token]))
+                if streamers[row].parser.done:
+                    finished[k] = True
+        if step == max_new_tokens - 1:
+            break
+        if finished.any():
+            keep = (~finished).nonzero(as_tuple=True)[0]
+            if keep.numel() == 0:
+                break
+            active = [active[k] for k in keep.tolist()]
+            past_key_values.batch_select_indices(keep)
+            attention_mask = attention_mask[keep]
+            next_tokens = next_tokens[keep]
+            if getattr(model.model, "rope_deltas", None) is not None:
+                model.model.rope_deltas = model.model.rope_deltas[keep]
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=1)
+        out = model(
+            input_ids=next_tokens[:, None],
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            cache_position=torch.tensor([prompt_len + step], device=model.device),
+            logits_to_keep=1,
+        )
+        past_key_values = out.past_key_values
+        next_tokens = out.logits[:, -1, :].argmax(dim=-1)
+    # 每步 next_tokens.tolist() 已同步，decode 不需要额外 synchronize
+    decode = time.perf_counter() - t0
+    n_tokens = sum(len(x) for x in generated)
+    tracing.count("generated_tokens", n_tokens)
+    tracing.observe("decode", decode, batch=len(generated), tokens=n_tokens, tokens_per_s=n_tokens / max(decode, 1e-9))
+    return processor.batch_decode(
+        generated, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+
+def parse_output(resp):
+    """按 COMPACT 选择格式解析，统一返回 [{"category","bbox_2d","size"}, ...]"""
+    with tracing.span("parse"):
+        parser = HoleStreamParser(compact=COMPACT).feed(resp)
+    if parser.aborted:
+        print(f"输出提前终止: {parser.aborted}，保留已解析的 {len(parser.holes)} 个孔")
+    return parser.holes
+
+def page_holes(holes, width, height):
+    """parse_output 的结果（0-1000 归一化坐标）-> [{"category","bbox","size"}]，bbox 为原图像素坐标，丢弃没有框的条目"""
+    holes = [x for x in holes if x["bbox_2d"]]
+    boxes = geometry.from_norm1000([x["bbox_2d"] for x in holes], width, height).tolist()
+    return [{"category": x["category"], "bbox": box, "size": x["size"]} for x, box in zip(holes, boxes)]
+
+def save_result(image_path, resp, draw_dir):
+    """解析模型输出，画框并保存图片和原始输出文本"""
+    holes = parse_output(resp)
+    save_holes(image_path, holes, resp, draw_dir)
+    return holes
+
+def save_holes(image_path, holes, resp, draw_dir, mode="qwen3"):
+    """画框并保存图片和原始输出文本，mode 同 draw_bboxes_pil（qwen3 为 0-1000 归一化坐标，否则为像素坐标）"""
+    bbox = {}
+    for item in holes:
+        if item["category"] in bbox:
+            bbox[item["category"]].append(item["bbox_2d"])
+        else:
+            bbox[item["category"]] = [item["bbox_2d"]] if item["bbox_2d"] else []
+    with tracing.span("draw_save"):
+        draw_bboxes_pil(image_path,bbox ,os.path.join(draw_dir,os.path.basename(image_path)),mode=mode)
+        with open(os.path.join(draw_dir,os.path.basename(image_path).replace(".png",".txt")),"w",encoding = "utf-8") as f:
+            f.write(resp)
+
+def make_tiles(width, height, tile_size, overlap):
+    """
+    把 width x height 的整图切成互相重叠的 tile，返回 [(x0, y0, x1, y1), ...]。
+    步长 tile_size - overlap，最后一块贴齐图片边缘；图片不超过 tile_size 时只有一块
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - overlap
+        pos = list(range(0, length - tile_size, stride))
+        return pos + [length - tile_size]
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+def nms_per_class(holes, iou_threshold):
+    """
+    按类别做 NMS 去掉 tile 重叠区的重复框。模型输出没有置信度，面积大的框优先保留
+    （被 tile 边缘截断的框通常偏小）
+    """
+    kept = []
+    for category in dict.fromkeys(x["category"] for x in holes):
+        items = [x for x in holes if x["category"] == category]
+        kept += [items[i] for i in geometry.nms([x["bbox_2d"] for x in items], iou_threshold)]
+    return kept
+
+def merge_truncated(complete, partial, cover=0.5):
+    """
+    partial 为贴着 tile 内部接缝、被截断的框。同类完整框已覆盖其面积 cover 以上的丢弃（完整的孔在相邻 tile 里）；
+    其余同类且互相重叠的截断框是同一个孔跨接缝的几段（孔比 tile 重叠区宽时没有任何 tile 能看到完整的孔），
+    取并集外接框，尺寸取面积最大的一段
+    """
+    merged = []
+    for category in dict.fromkeys(x["category"] for x in partial):
+        items = [x for x in partial if x["category"] == category]
+        full = [x["bbox_2d"] for x in complete if x["category"] == category]
+        if full:
+            covered = geometry.coverage([x["bbox_2d"] for x in items], full).max(axis=1) >= cover
+            items = [x for x, c in zip(items, covered) if not c]
+        if not items:
+            continue
+        boxes = geometry.as_boxes([x["bbox_2d"] for x in items])
+        parent = list(range(len(items)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for i, j in zip(*np.nonzero(np.triu(geometry.intersection(boxes, boxes) > 0, 1))):
+            parent[find(i)] = find(j)
+        pieces = {}
+        for i in range(len(items)):
+            pieces.setdefault(find(i), []).append(i)
+        for idx in pieces.values():
+            box = [int(boxes[idx, 0].min()), int(boxes[idx, 1].min()), int(boxes[idx, 2].max()), int(boxes[idx, 3].max())]
+            largest = max(idx, key=lambda i: geometry.area(boxes[i])[0])
+            merged.append({"category": category, "bbox_2d": box, "size": items[largest]["size"]})
+    return merged
+
+def run_tiled(img_path, prompts):
+    """
+    分块推理：整图按固定 token 预算切成重叠 tile（tile 内不再缩放），tile 分批推理，
+    0-1000 归一化坐标映射回整图像素坐标。贴着内部接缝的截断框先放一边：完整出现在其他 tile 的丢弃，
+    其余跨接缝的几段合并成一个框（merge_truncated），再与完整框一起按类别 NMS 合并。
+    返回的 bbox_2d 为整图像素坐标。显存和单批耗时只与 TILE_TOKENS / TILE_BATCH 有关，与图纸大小无关
+    """
+    tile_size = int(math.sqrt(TILE_TOKENS)) * 32
+    overlap = int(tile_size * TILE_OVERLAP)
+    img = Image.open(img_path).convert("RGB")
+    width, height = img.size
+    tiles = make_tiles(width, height, tile_size, overlap)
+    holes, truncated = [], []
+    for i in range(0, len(tiles), TILE_BATCH):
+        chunk = tiles[i:i + TILE_BATCH]
+        resps = run_batch([img.crop(t) for t in chunk], prompts)
+        for (x0, y0, x1, y1), resp in zip(chunk, resps):
+            tile_holes = [x for x in parse_output(resp) if x["bbox_2d"]]
+            boxes = geometry.from_norm1000([x["bbox_2d"] for x in tile_holes], x1 - x0, y1 - y0)
+            boxes = geometry.shift(boxes, x0, y0).astype(np.int64)
+            # 贴着非整图边界的 tile 边缘的框视为被截断
+            margin = 2
+            inner = np.array([x0 + margin if x0 > 0 else 0, y0 + margin if y0 > 0 else 0,
+                              x1 - margin if x1 < width else width, y1 - margin if y1 < height else height])
+            for hole, box, complete in zip(tile_holes, boxes.tolist(), geometry.inside(boxes, inner)):
+                (holes if complete else truncated).append({"category": hole["category"], "bbox_2d": box, "size": hole["size"]})
+    return nms_per_class(holes + merge_truncated(holes, truncated), NMS_IOU)
+
+def error_text(e):
+    return f"{type(e).__name__}: {e}"
+
+def run_each(img_paths, prompts, failed):
+    """整批推理失败后逐张重试，返回 [(图片, 输出)]，仍失败的图记入 failed {图片: 错误}"""
+    results = []
+    for image_path in img_paths:
+        try:
+            results.append((image_path, run_batch([image_path], prompts)[0]))
+        except Exception as e:
+            failed[image_path] = error_text(e)
+    return results
+
+def run_pipeline(image_paths, prompts, draw_dir, batch_size, prep_workers=4, write_workers=4, queue_size=4):
+    """
+    三段流水线：预处理线程池 -> GPU 解码（当前线程）-> 解析/画图/写盘线程池，段间用有界队列衔接，
+    GPU 只做 generate，不等 PIL 编码和磁盘。整批预处理 / 推理失败时逐张重试，只有真正出错的图失败。
+    返回 (result, failed, stalls)：failed 为 {图片: 错误}，stalls 为各段阻塞时间（秒）：
+    wait_in 等上游数据，wait_out 等下游队列空位
+    """
+    stalls = {stage: {"wait_in": 0.0, "wait_out": 0.0} for stage in ("prep", "gpu", "write")}
+    lock = threading.Lock()
+    todo = queue.Queue()
+    for batch in bucket_images(image_paths, batch_size):
+        todo.put(batch)
+    ready = queue.Queue(maxsize=queue_size)
+    done = queue.Queue(maxsize=queue_size)
+    result = {}
+    failed = {}
+
+    def timed_put(q, item, stage):
+        t0 = time.perf_counter()
+        q.put(item)
+        with lock:
+            stalls[stage]["wait_out"] += time.perf_counter() - t0
+
+    def timed_get(q, stage):
+        t0 = time.perf_counter()
+        item = q.get()
+        with lock:
+            stalls[stage]["wait_in"] += time.perf_counter() - t0
+        return item
+
+    def prep_worker():
+        local_processor = copy.deepcopy(processor)
+        while True:
+            try:
+                batch = todo.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                inputs = prepare_batch(batch, prompts, local_processor)
+            except Exception:
+                # 逐张预处理，好的图单独成批继续推理
+                for image_path in batch:
+                    try:
+                        inputs = prepare_batch([image_path], prompts, local_processor)
+                    except Exception as e:
+                        with lock:
+                            failed[image_path] = error_text(e)
+                        continue
+                    timed_put(ready, ([image_path], inputs), "prep")
+                continue
+            timed_put(ready, (batch, inputs), "prep")
+        ready.put(None)
+
+    def write_worker():
+        while True:
+            item = timed_get(done, "write")
+            if item is None:
+                break
+            image_path, resp = item
+            try:
+                holes = save_result(image_path, resp, draw_dir)
+            except Exception as e:
+                with lock:
+                    failed[image_path] = error_text(e)
+                continue
+            with lock:
+                result[image_path] = holes
+
+    preps = [threading.Thread(target=prep_worker, daemon=True) for _ in range(prep_workers)]
+    writers = [threading.Thread(target=write_worker, daemon=True) for _ in range(write_workers)]
+    for t in preps + writers:
+        t.start()
+    finished_preps = 0
+    while finished_preps < prep_workers:
+        item = timed_get(ready, "gpu")
+        if item is None:
+            finished_preps += 1
+            continue
+        batch, inputs = item
+        try:
+            outputs = list(zip(batch, generate_batch(inputs)))
+        except Exception as e:
+            if len(batch) == 1:
+                with lock:
+                    failed[batch[0]] = error_text(e)
+                continue
+            # GPU 线程只有这里用全局 processor，逐张重试不与预处理线程冲突
+            local_failed = {}
+            outputs = run_each(batch, prompts, local_failed)
+            with lock:
+                failed.update(local_failed)
+        for image_path, resp in outputs:
+            timed_put(done, (image_path, resp), "gpu")
+    for _ in writers:
+        done.put(None)
+    for t in preps + writers:
+        t.join()
+    return result, failed, stalls
+
+# ---------- 参数区 ----------
 test_img_path = "/root/autodl-tmp/qwen3_swift/test_img/train_data"
 train_img_path = "/root/autodl-tmp/qwen3_swift/train_data"
+draw_dir = "/root/autodl-tmp/qwen3_swift/test_img_draw"
+# 每个 batch 的图片数，1 为逐张推理
+BATCH_SIZE = 8
+# 是否使用 预处理/GPU/写盘 三段流水线
+PIPELINE = True
+# 是否使用紧凑输出格式（需与训练数据 dataprocess.py 的 compact 保持一致）
+COMPACT = False
+# 是否边生成边解析，JSON 结束 / 复读时提前停止生成
+STREAM = True
+# 投机解码：None / "prompt_lookup" / "draft"，仅逐张推理时生效（batch 固定为 1）
+SPECULATIVE = None
+PROMPT_LOOKUP_NUM_TOKENS = 10
+DRAFT_MODEL_PATH = "/root/autodl-tmp/models/Qwen3-VL-2B-Instruct"
+# 大图分块推理：每块视觉 token 预算、块间重叠比例、每批块数、合并重复框的 IoU 阈值
+TILED = False
+TILE_TOKENS = 1024
+TILE_OVERLAP = 0.2
+TILE_BATCH = 8
+NMS_IOU = 0.5
+# processor 输出缓存目录（None 为不缓存）与容量上限，评测多个 checkpoint 时复用预处理结果（分块推理不走缓存）。
+# import eval 的 server / batch_job / bench_quant 默认不缓存，可用环境变量 PROC_CACHE_DIR 开启；
+# 直接运行 eval.py 评测时未设置则用 EVAL_PROC_CACHE_DIR
+PROC_CACHE_DIR = os.environ.get("PROC_CACHE_DIR")
+EVAL_PROC_CACHE_DIR = "/root/autodl-tmp/qwen3_swift/proc_cache"
+PROC_CACHE_MAX_GB = 20
+# 分阶段耗时 trace（JSONL，None 为只在内存中汇总）与 Prometheus 指标端口（None 为不开启）
+TRACE_PATH = None
+METRICS_PORT = None
+# 指标端口监听地址，默认只对本机开放，Prometheus 在其他机器上抓取时改为 "0.0.0.0"
+METRICS_HOST = "127.0.0.1"
+# ----------------------------
 
-result = {}
-for image_path in [ os.path.join(test_img_path,x) for x in os.listdir(test_img_path)]:
-    try:
-        resp = run(image_path,prompts)
-        resp = resp[0]
-        result[image_path] = extract_json_blocks(resp)
-        bbox = {}
-        for item in result[image_path]:
-            if item["category"] in bbox:
-                bbox[item["category"]].append(item["bbox_2d"])
-            else:
-                bbox[item["category"]] = [item["bbox_2d"]] if item["bbox_2d"] else []
-        draw_bboxes_pil(image_path,bbox ,os.path.join("/root/autodl-tmp/qwen3_swift/test_img_draw",os.path.basename(image_path)),mode="qwen3")
-        with open(os.path.join("/root/autodl-tmp/qwen3_swift/test_img_draw",os.path.basename(image_path).replace(".png",".txt")),"w",encoding = "utf-8") as f:
-            f.write(resp)
-    except Exception as e:
-        print(e)
\ No newline at end of file
+if __name__ == "__main__":
+    PROC_CACHE_DIR = PROC_CACHE_DIR or EVAL_PROC_CACHE_DIR
+    if TRACE_PATH:
+        os.environ["TRACE_PATH"] = TRACE_PATH
+    if METRICS_PORT:
+        tracing.serve_metrics(METRICS_PORT, METRICS_HOST)
+    if COMPACT:
+        prompts = compact_prompts
+    result = {}
+    # {图片: 错误}
+    failed = {}
+    image_paths = [os.path.join(test_img_path,x) for x in os.listdir(test_img_path)]
+    if TILED:
+        for image_path in image_paths:
+            try:
+                holes = run_tiled(image_path, prompts)
+                save_holes(image_path, holes, json.dumps(holes, ensure_ascii=False, indent=2), draw_dir, mode="qwen2")
+                result[image_path] = holes
+            except Exception as e:
+                failed[image_path] = error_text(e)
+    # 投机解码只支持 batch=1，走逐张推理
+    elif PIPELINE and not SPECULATIVE:
+        t0 = time.perf_counter()
+        result, failed, stalls = run_pipeline(image_paths, prompts, draw_dir, BATCH_SIZE)
+        print(f"共 {len(image_paths)} 张，成功 {len(result)}，失败 {len(failed)}，耗时 {time.perf_counter() - t0:.1f}s")
+        for stage, v in stalls.items():
+            print(f"  {stage:<5} 等待上游 {v['wait_in']:.1f}s  等待下游 {v['wait_out']:.1f}s")
+    elif BATCH_SIZE > 1 and not SPECULATIVE:
+        for batch in bucket_images(image_paths, BATCH_SIZE):
+            try:
+                outputs = list(zip(batch, run_batch(batch, prompts)))
+            except Exception:
+                outputs = run_each(batch, prompts, failed)
+            for image_path, resp in outputs:
+                try:
+                    result[image_path] = save_result(image_path, resp, draw_dir)
+                except Exception as e:
+                    failed[image_path] = error_text(e)
+    else:
+        for image_path in image_paths:
+            try:
+                resp = run(image_path,prompts)
+                resp = resp[0]
+                result[image_path] = save_result(image_path, resp, draw_dir)
+            except Exception as e:
+                failed[image_path] = error_text(e)
+    if failed:
+        print(f"失败 {len(failed)} 张:")
+        for image_path, error in failed.items():
+            print(f"  {image_path}: {error}")
+    if proc_cache is not None:
+        print(f"processor 缓存命中 {proc_cache.hits}，未命中 {proc_cache.misses}")
+    print("各阶段耗时:")
+    tracing.summary()
@@ -1,21 +1,17 @@
 import json
+from run_data.jsonstream import iter_json_array
 
 labels = ["view.json","view_ex.json"]
 
+# 逐条读取、逐行写出，不把整个 view.json 读进内存
 for i in labels:
     iname = i.replace("json","jsonl")
-    with open(i,"r",encoding = "utf8") as f:
-        view = json.load(f)
-    result = []
-    for i in view:
-        result.append(
-            {
+    with open(iname, "w", encoding="utf-8") as f:
+        for i in iter_json_array(i):
+            item = {
                 "messages":[{"role":"user","content":i["messages"][0]["content"]},
                             {"role":"assistant","content":i["messages"][1]["content"]}
                            ],
                 "images":i["images"]
             }
-        )
-    with open(iname, "w", encoding="utf-8") as f:
-        for item in result:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
\ No newline at end of file
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
@@ -0,0 +1,201 @@
+"""
+模型冷启动：从 gs:// / s3:// 并行拉取权重到本地 SSD 缓存，边下载边加载，替代把模型打进镜像或经 gcsfuse 读取。
+
+- 远端可以是 HF cache 目录（models--Qwen--xxx，按 refs/<revision> 找 snapshots/<commit>），也可以是普通模型目录
+- 缓存目录 <MODEL_CACHE_DIR>/<模型名>/<revision>，revision 为 commit（HF cache）或索引文件的 ETag（普通目录），
+  全部下完后写 .complete，之后启动直接复用
+- config / tokenizer / processor 等小文件先下完，safetensors 分片并行下载（storage.py：断点续传、MD5 校验）
+- load_model 先在 meta 上建模型，哪个分片先到就先 mmap 加载哪个，不等全部分片；
+  dtype 默认取 config 中的 dtype（同 from_pretrained(dtype="auto")）。eval.py 中需 LAZY_LOAD=True 才使用，默认仍为 from_pretrained
+- 本地路径不复制，只解析 HF cache 的 snapshots/ 目录；file:// 与远端一样拷进缓存
+
+python model_cache.py 拉取 MODEL_SOURCE 并打印本地模型目录（train.sh 使用）
+"""
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from run_data import storage
+
+# ---------- 参数区 ----------
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "/tmp/model_cache")
+# 同时下载的文件数
+WORKERS = 16
+# ----------------------------
+
+COMPLETE = ".complete"
+WEIGHT_SUFFIX = ".safetensors"
+
+
+def is_remote(source):
+    """file:// 也按远端处理（如把 gcsfuse 挂载目录拷到本地 SSD），普通本地路径直接使用"""
+    return urlparse(source).scheme in ("gs", "s3", "file")
+
+
+def resolve(path, revision=None):
+    """本地模型目录原样返回；HF cache 目录（含 snapshots/）按 refs/<revision>（默认 main）取对应快照"""
+    snapshots = os.path.join(path, "snapshots")
+    if not os.path.isdir(snapshots):
+        return path
+    revision = revision or "main"
+    ref = os.path.join(path, "refs", revision)
+    if os.path.exists(ref):
+        with open(ref, "r", encoding="utf-8") as f:
+            revision = f.read().strip()
+    candidate = os.path.join(snapshots, revision)
+    if os.path.exists(os.path.join(candidate, "config.json")):
+        return candidate
+    # 没有 refs 时取最新的带 config.json 的快照
+    found = [
+        os.path.join(snapshots, x) for x in os.listdir(snapshots)
+        if os.path.exists(os.path.join(snapshots, x, "config.json"))
+    ]
+    if not found:
+        raise FileNotFoundError(f"{snapshots} 下没有有效的模型快照")
+    return max(found, key=os.path.getmtime)
+
+
+def read_remote(url):
+    buf = io.BytesIO()
+    storage.backend(url).read(url, 0, buf)
+    return buf.getvalue()
+
+
+def remote_snapshot(source, revision=None):
+    """远端模型 -> ([(url, 相对路径)], revision)"""
+    source = source.rstrip("/")
+    files = list(storage.backend(source).list(source + "/"))
+    commits = sorted({rel.split("/")[1] for _, rel in files if rel.startswith("snapshots/") and rel.count("/") >= 2})
+    if not commits:
+        # 普通模型目录：以索引文件（单分片时为 config.json）的 ETag 作为 revision
+        if revision is None:
+            rels = {rel for _, rel in files}
+            key = "model.safetensors.index.json" if "model.safetensors.index.json" in rels else "config.json"
+            revision = storage.backend(source).stat(f"{source}/{key}")["etag"].strip('"')
+        return files, revision
+    commit = revision if revision in commits else None
+    if commit is None:
+        try:
+            commit = read_remote(f"{source}/refs/{revision or 'main'}").decode("utf-8").strip()
+        except Exception:
+            commit = commits[-1]
+            print(f"[model_cache] {source} 没有 refs/{revision or 'main'}，使用快照 {commit}", file=sys.stderr)
+    prefix = f"snapshots/{commit}/"
+    return [(url, rel[len(prefix):]) for url, rel in files if rel.startswith(prefix)], commit
+
+
+class ModelFetch:
+    """
+    ModelFetch(source).path 为本地模型目录，构造返回时小文件已就绪；
+    shards() 按下载完成的先后产出本地 safetensors 路径，wait() 等全部下完
+    """
+    def __init__(self, source, revision=None, cache_dir=MODEL_CACHE_DIR, workers=WORKERS):
+        self.source = source
+        self.futures = []
+        if not is_remote(source):
+            self.path = resolve(source, revision)
+            self.weights = sorted(x for x in os.listdir(self.path) if x.endswith(WEIGHT_SUFFIX))
+            return
+        t0 = time.perf_counter()
+        files, self.revision = remote_snapshot(source, revision)
+        self.path = os.path.join(cache_dir, os.path.basename(source.rstrip("/")), self.revision)
+        self.weights = sorted(rel for _, rel in files if rel.endswith(WEIGHT_SUFFIX))
+        if os.path.exists(os.path.join(self.path, COMPLETE)):
+            return
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        small = [(url, rel) for url, rel in files if not rel.endswith(WEIGHT_SUFFIX)]
+        for fut in [self.pool.submit(storage.download_retry, url, os.path.join(self.path, rel), max_connections=workers)
+                    for url, rel in small]:
+            fut.result()
+        self.futures = [
+            self.pool.submit(self._download, url, rel, workers)
+            for url, rel in files if rel.endswith(WEIGHT_SUFFIX)
+        ]
+        print(f"[model_cache] {source}@{self.revision} -> {self.path}，"
+              f"{len(small)} 个小文件 {time.perf_counter() - t0:.1f}s，开始下载 {len(self.futures)} 个分片", file=sys.stderr)
+
+    def _download(self, url, rel, workers):
+        storage.download_retry(url, os.path.join(self.path, rel), max_connections=workers)
+        return rel
+
+    def shards(self):
+        """本地 safetensors 路径，按下载完成顺序"""
+        if not self.futures:
+            for rel in self.weights:
+                yield os.path.join(self.path, rel)
+            return
+        for fut in as_completed(self.futures):
+            yield os.path.join(self.path, fut.result())
+
+    def wait(self):
+        """等全部分片下完并写 .complete，返回本地模型目录"""
+        if self.futures:
+            for fut in self.futures:
+                fut.result()
+            with open(os.path.join(self.path, COMPLETE), "w", encoding="utf-8") as f:
+                f.write(self.source + "\n")
+            self.futures = []
+            self.pool.shutdown()
+        return self.path
+
+
+def load_model(source, device="cuda", dtype=None, revision=None):
+    """
+    source 为 ModelFetch 或模型路径 / URL，返回 eval 可直接使用的 Qwen3VLForConditionalGeneration。
+    分片按到达顺序以 mmap 方式直接加载到 device，权重名按模型的 _checkpoint_conversion_mapping 转换
+    """
+    import torch
+    from accelerate import init_empty_weights
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, GenerationConfig, Qwen3VLForConditionalGeneration
+
+    fetch = source if isinstance(source, ModelFetch) else ModelFetch(source, revision)
+    t0 = time.perf_counter()
+    config = AutoConfig.from_pretrained(fetch.path)
+    if dtype is None:
+        dtype = getattr(config, "dtype", None) or getattr(config, "torch_dtype", None) or torch.bfloat16
+        dtype = getattr(torch, dtype) if isinstance(dtype, str) else dtype
+    with init_empty_weights():
+        model = Qwen3VLForConditionalGeneration._from_config(config, dtype=dtype)
+    names = set(model.state_dict())
+    mapping = getattr(model, "_checkpoint_conversion_mapping", {}) or {}
+
+    def rename(key):
+        if key in names:
+            return key
+        for pattern, replacement in mapping.items():
+            new_key, n = re.subn(pattern, replacement, key)
+            if n:
+                return new_key
+        return key
+
+    unexpected = []
+    for path in fetch.shards():
+        state = load_file(path, device=str(device))
+        state = {rename(k): v.to(dtype) if v.is_floating_point() else v for k, v in state.items()}
+        unexpected += model.load_state_dict(state, strict=False, assign=True).unexpected_keys
+        del state
+    model.tie_weights()
+    missing = [k for k, v in model.state_dict().items() if v.device.type == "meta"]
+    if missing or unexpected:
+        raise ValueError(f"权重与模型不匹配，缺少 {missing[:5]}，多余 {unexpected[:5]}")
+    if os.path.exists(os.path.join(fetch.path, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(fetch.path)
+    fetch.wait()
+    print(f"[model_cache] 模型加载完成 {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return model.to(device).eval()
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    # gs:// / s3:// 上的模型（HF cache 目录或普通模型目录），或本地路径
+    source = os.environ.get("MODEL_SOURCE", "gs://im-drawing-462011-models/models--Qwen--Qwen3-VL-4B-Instruct")
+    # HF cache 的 refs 名或 commit，None 为 main
+    revision = os.environ.get("MODEL_REVISION") or None
+    # ----------------------------
+    # stdout 只输出本地模型目录，供 train.sh 读取
+    print(ModelFetch(source, revision).wait())
@@ -0,0 +1,149 @@
+"""
+processor 输出（pixel_values / image_grid_thw / 提示词 input_ids 等）的磁盘缓存。
+
+key = 图片内容哈希 + 提示词 + processor 配置（min/max pixels、patch/merge size、IMAGE_MAX_TOKEN_NUM 等），
+与 checkpoint 路径无关，同一测试集评测多个 checkpoint 时第二次起跳过读图/resize/patchify。
+每条缓存是一个目录，每个字段一个 .npy，读取时 mmap；按最近访问时间做 LRU 淘汰，总大小不超过 max_bytes
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+import numpy as np
+import torch
+from transformers import BatchFeature
+
+# 按样本做 padding 的文本字段，其余字段（视觉）按第 0 维拼接
+SEQ_KEYS = ("input_ids", "attention_mask", "mm_token_type_ids")
+
+
+def processor_signature(processor):
+    """影响 processor 输出的配置"""
+    ip = processor.image_processor
+    config = {k: v for k, v in ip.to_dict().items() if not k.startswith("_")}
+    tokenizer = processor.tokenizer
+    return {
+        "image_processor": config,
+        "vocab_size": len(tokenizer),
+        "chat_template": hashlib.sha256((processor.chat_template or "").encode("utf-8")).hexdigest(),
+        "IMAGE_MAX_TOKEN_NUM": os.environ.get("IMAGE_MAX_TOKEN_NUM"),
+    }
+
+
+class ProcessorCache:
+    def __init__(self, cache_dir, processor, max_bytes=20 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.signature = json.dumps(processor_signature(processor), sort_keys=True, default=str)
+        self.pad_token_id = processor.tokenizer.pad_token_id
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(self._entry_bytes(os.path.join(cache_dir, x)) for x in os.listdir(cache_dir))
+
+    @staticmethod
+    def _entry_bytes(path):
+        if not os.path.isdir(path):
+            return 0
+        return sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+
+    def key(self, img_path, prompts):
+        h = hashlib.sha256()
+        with open(img_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        h.update(prompts.encode("utf-8"))
+        h.update(self.signature.encode("utf-8"))
+        return h.hexdigest()
+
+    def load(self, key):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            names = os.listdir(path)
+            item = {x[:-4]: np.load(os.path.join(path, x), mmap_mode="r") for x in names if x.endswith(".npy")}
+            # 更新访问时间，用于 LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return item
+
+    def save(self, key, item):
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        for name, value in item.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), value)
+        size = self._entry_bytes(tmp)
+        try:
+            os.rename(tmp, os.path.join(self.cache_dir, key))
+        except OSError:
+            # 其他线程已写入同一条
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self.lock:
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """删除最久未访问的条目，直到总大小降到 max_bytes 的 90%"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not name.startswith(".") and os.path.isdir(path):
+                entries.append((os.path.getmtime(path), path))
+        for _, path in sorted(entries):
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            size = self._entry_bytes(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self.total_bytes -= size
+
+    def get(self, img_path, prompts, proc):
+        """单张图的 processor 输出（numpy，mmap），未命中时计算并写入缓存"""
+        key = self.key(img_path, prompts)
+        item = self.load(key)
+        with self.lock:
+            if item is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if item is not None:
+            return item
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "image": img_path},
+                    {"type": "text", "text": prompts},
+                ],
+            }
+        ]
+        inputs = proc.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt",
+        )
+        item = {k: (v[0] if k in SEQ_KEYS else v).numpy() for k, v in inputs.items()}
+        self.save(key, item)
+        return item
+
+    def batch(self, img_paths, prompts, proc):
+        """多张图左 padding 拼成一个 batch，与 processor 直接处理整个 batch 的结果一致"""
+        items = [self.get(x, prompts, proc) for x in img_paths]
+        max_len = max(len(x["input_ids"]) for x in items)
+        batch = {}
+        for k in items[0]:
+            if k in SEQ_KEYS:
+                pad = self.pad_token_id if k == "input_ids" else 0
+                value = torch.full((len(items), max_len), pad, dtype=torch.long)
+                for row, x in enumerate(items):
+                    value[row, max_len - len(x[k]):] = torch.tensor(x[k])
+            else:
+                value = torch.cat([torch.tensor(np.asarray(x[k])) for x in items])
+            batch[k] = value
+        return BatchFeature(batch)
@@ -0,0 +1,227 @@
+"""
+合并后 Qwen3-VL checkpoint 的 weight-only 量化导出（int8 / int4）与加载，用于 CPU 推理。
+
+语言模型各 nn.Linear 的权重按输出通道、每 group_size 个输入通道一组（int8 默认整行一组）做对称量化，scale 存 bf16，
+int4 把两个值打包进一个 uint8。CPU 上加载后换成 torch 自带的 weight-only kernel（int8: _weight_int8pack_mm，
+int4: _weight_int4pack_mm_for_cpu），不再每次 forward 反量化整块权重；kernel 不可用时逐层反量化后做 matmul。激活本身不量化。
+视觉塔、embedding、lm_head 保持原精度（见 SKIP）。
+导出目录：model.safetensors + quant_config.json + 原 config / generation_config / processor 文件
+"""
+import json
+import os
+import re
+import torch
+import torch.nn.functional as F
+from torch import nn
+from accelerate import init_empty_weights
+from safetensors.torch import load_file, save_file
+from transformers import AutoConfig, AutoProcessor, GenerationConfig, Qwen3VLForConditionalGeneration
+
+QUANT_CONFIG = "quant_config.json"
+WEIGHTS = "model.safetensors"
+# 不量化的模块（正则，匹配模块名）
+SKIP = (r"(^|\.)visual\.", r"(^|\.)lm_head$")
+# _convert_weight_to_int4pack_for_cpu 的 inner_k_tiles
+INT4_INNER_K_TILES = 8
+
+
+def quantize_weight(weight, bits, group_size):
+    """
+    (out, in) 权重 -> (qweight, scales)。
+    int8: qweight 为 (out, in) int8；int4: (out, in/2) uint8，低 4 位为偶数列。scales 为 (out, in/group_size)，
+    group_size 为 None 时整行一组（按输出通道）
+    """
+    out_features, in_features = weight.shape
+    group_size = group_size or in_features
+    qmax = 2 ** (bits - 1) - 1
+    w = weight.float().reshape(out_features, in_features // group_size, group_size)
+    scales = w.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / qmax
+    q = torch.round(w / scales).clamp(-qmax, qmax).to(torch.int8).reshape(out_features, in_features)
+    if bits == 4:
+        q = (q + 8).to(torch.uint8)
+        q = q[:, 0::2] | (q[:, 1::2] << 4)
+    return q.contiguous(), scales.squeeze(-1).to(torch.bfloat16)
+
+
+def unpack_int4(qweight):
+    """(out, in/2) uint8 -> (out, in)，取值 0~15（未减 8）"""
+    return torch.stack([qweight & 0x0F, qweight >> 4], dim=-1).reshape(qweight.shape[0], -1)
+
+
+def dequantize_weight(qweight, scales, bits, group_size, dtype):
+    if bits == 4:
+        q = unpack_int4(qweight).to(torch.int8) - 8
+    else:
+        q = qweight
+    out_features, in_features = q.shape
+    w = q.reshape(out_features, in_features // group_size, group_size).to(dtype) * scales.to(dtype)[..., None]
+    return w.reshape(out_features, in_features)
+
+
+class WeightOnlyLinear(nn.Module):
+    """权重量化存储的 Linear；pack() 之后用 weight-only kernel 计算，否则 forward 时反量化"""
+    def __init__(self, in_features, out_features, bias, bits, group_size, device="meta"):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size or in_features
+        # pack() 选中的 kernel（"int8" / "int4"，None 为反量化）及其激活 dtype
+        self.kernel = None
+        self.kernel_dtype = None
+        packed = in_features // 2 if bits == 4 else in_features
+        dtype = torch.uint8 if bits == 4 else torch.int8
+        self.register_buffer("qweight", torch.empty(out_features, packed, dtype=dtype, device=device))
+        self.register_buffer("scales", torch.empty(out_features, in_features // self.group_size, dtype=torch.bfloat16, device=device))
+        self.bias = nn.Parameter(torch.empty(out_features, device=device), requires_grad=False) if bias else None
+
+    def pack(self, dtype):
+        """
+        CPU 上把权重转成 torch weight-only kernel 的格式：int8 需按输出通道量化（group_size 为整行），
+        int4 转成 _convert_weight_to_int4pack_for_cpu 的打包格式后释放 qweight。
+        kernel 的打包格式随 torch 版本变化，用随机输入与反量化结果比对一次，不可用或对不上时保留反量化路径
+        """
+        if self.qweight.device.type != "cpu":
+            return
+        try:
+            if self.bits == 8 and self.group_size == self.in_features and hasattr(torch, "_weight_int8pack_mm"):
+                self.register_buffer("channel_scales", self.scales[:, 0].to(dtype).contiguous(), persistent=False)
+                self.kernel = "int8"
+            elif self.bits == 4 and hasattr(torch, "_weight_int4pack_mm_for_cpu"):
+                packed = torch._convert_weight_to_int4pack_for_cpu(unpack_int4(self.qweight).to(torch.int32), INT4_INNER_K_TILES)
+                # kernel 按 (q - 8) * scale + zero 反量化，对称量化的 zero 为 0
+                scales = self.scales.t().to(dtype)
+                self.register_buffer("packed", packed, persistent=False)
+                self.register_buffer("scales_and_zeros", torch.stack([scales, torch.zeros_like(scales)], dim=-1).contiguous(), persistent=False)
+                self.kernel = "int4"
+            else:
+                return
+            self.kernel_dtype = dtype
+            x = torch.randn(4, self.in_features, dtype=dtype)
+            ref = F.linear(x, dequantize_weight(self.qweight, self.scales, self.bits, self.group_size, dtype)).float()
+            err = (self._matmul(x).float() - ref).norm() / ref.norm().clamp(min=1e-6)
+            if err > 0.02:
+                raise ValueError(f"kernel 输出与反量化结果不一致（相对误差 {err:.3f}）")
+        except Exception:
+            self.kernel = None
+            self.kernel_dtype = None
+            return
+        if self.kernel == "int4":
+            self.register_buffer("qweight", None)
+
+    def _matmul(self, x):
+        """(n, in) -> (n, out)，不含 bias"""
+        if self.kernel == "int8":
+            return torch._weight_int8pack_mm(x, self.qweight, self.channel_scales)
+        return torch._weight_int4pack_mm_for_cpu(x, self.packed, self.group_size, self.scales_and_zeros)
+
+    def forward(self, x):
+        if self.kernel is None:
+            weight = dequantize_weight(self.qweight, self.scales, self.bits, self.group_size, x.dtype)
+            return F.linear(x, weight, self.bias)
+        out = self._matmul(x.reshape(-1, self.in_features).to(self.kernel_dtype).contiguous()).to(x.dtype)
+        out = out.reshape(*x.shape[:-1], self.out_features)
+        return out if self.bias is None else out + self.bias.to(out.dtype)
+
+
+def quantizable(model, group_size, skip=SKIP):
+    """可量化的 Linear 模块名"""
+    return [
+        name for name, module in model.named_modules()
+        if isinstance(module, nn.Linear)
+        and (group_size is None or module.in_features % group_size == 0)
+        and not any(re.search(p, name) for p in skip)
+    ]
+
+
+def replace_linears(model, names, bits, group_size):
+    for name in names:
+        parent_name, _, child = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        linear = getattr(parent, child)
+        setattr(parent, child, WeightOnlyLinear(linear.in_features, linear.out_features, linear.bias is not None, bits, group_size))
+
+
+def model_bytes(model):
+    """参数 + buffer 实际占用的字节数（共享存储只算一次）"""
+    seen = {}
+    for t in list(model.parameters()) + list(model.buffers()):
+        if t.device.type != "meta":
+            seen[t.data_ptr()] = t.numel() * t.element_size()
+    return sum(seen.values())
+
+
+def export(model_path, out_dir, bits=8, group_size=None, skip=SKIP):
+    if bits not in (4, 8):
+        raise ValueError(f"只支持 int8 / int4: {bits}")
+    model = Qwen3VLForConditionalGeneration.from_pretrained(model_path, dtype=torch.bfloat16, device_map="cpu")
+    names = quantizable(model, group_size, skip)
+    state = {}
+    for name in names:
+        linear = model.get_submodule(name)
+        state[f"{name}.qweight"], state[f"{name}.scales"] = quantize_weight(linear.weight.data, bits, group_size)
+        if linear.bias is not None:
+            state[f"{name}.bias"] = linear.bias.data
+    quantized = {f"{name}.weight" for name in names} | {f"{name}.bias" for name in names}
+    # tie_word_embeddings 时 lm_head 与 embedding 共享存储，只存一份，加载后 tie_weights 恢复
+    seen = set()
+    for k, v in model.state_dict().items():
+        if k in quantized or v.data_ptr() in seen:
+            continue
+        seen.add(v.data_ptr())
+        state[k] = v.contiguous()
+    os.makedirs(out_dir, exist_ok=True)
+    save_file(state, os.path.join(out_dir, WEIGHTS), metadata={"format": "pt"})
+    with open(os.path.join(out_dir, QUANT_CONFIG), "w", encoding="utf-8") as f:
+        json.dump({"bits": bits, "group_size": group_size, "modules": names}, f, indent=2)
+    model.config.save_pretrained(out_dir)
+    model.generation_config.save_pretrained(out_dir)
+    AutoProcessor.from_pretrained(model_path).save_pretrained(out_dir)
+    size = os.path.getsize(os.path.join(out_dir, WEIGHTS))
+    print(f"量化 {len(names)} 个 Linear 为 int{bits}（group {group_size or '按输出通道'}）")
+    print(f"bf16 {model_bytes(model) / (1 << 30):.2f} GB -> int{bits} {size / (1 << 30):.2f} GB: {out_dir}")
+
+
+def load_quantized(path, device="cpu", dtype=torch.bfloat16):
+    """加载 export 导出的目录，返回 eval 可直接使用的 Qwen3VLForConditionalGeneration"""
+    with open(os.path.join(path, QUANT_CONFIG), "r", encoding="utf-8") as f:
+        quant_config = json.load(f)
+    config = AutoConfig.from_pretrained(path)
+    with init_empty_weights():
+        model = Qwen3VLForConditionalGeneration._from_config(config, dtype=dtype)
+    replace_linears(model, quant_config["modules"], quant_config["bits"], quant_config["group_size"])
+    state = load_file(os.path.join(path, WEIGHTS), device=str(device))
+    missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+    model.tie_weights()
+    # tie_weights 之后仍在 meta 上的才是真正缺失的权重
+    state = model.state_dict()
+    missing = [k for k in missing if state[k].device.type == "meta"]
+    if missing or unexpected:
+        raise ValueError(f"量化权重与模型不匹配，缺少 {missing[:5]}，多余 {unexpected[:5]}")
+    model.generation_config = GenerationConfig.from_pretrained(path)
+    model = model.to(device).eval()
+    for module in model.modules():
+        if isinstance(module, WeightOnlyLinear):
+            module.pack(dtype)
+    return model
+
+
+def kernels(model):
+    """各 WeightOnlyLinear 实际使用的计算方式计数，如 {"int8": 252}，"dequant" 为每次反量化"""
+    count = {}
+    for module in model.modules():
+        if isinstance(module, WeightOnlyLinear):
+            count[module.kernel or "dequant"] = count.get(module.kernel or "dequant", 0) + 1
+    return count
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    # export.sh 合并 LoRA 后的目录
+    model_path = "/root/autodl-tmp/qwen3_swift/output/v2-20251029-141114/checkpoint-424-merged"
+    bits = 8
+    # int8 按输出通道量化（None）才能用 _weight_int8pack_mm；int4 kernel 支持 32 / 64 / 128 / 256
+    group_size = None if bits == 8 else 128
+    out_dir = f"{model_path}-int{bits}"
+    # ----------------------------
+    export(model_path, out_dir, bits, group_size)
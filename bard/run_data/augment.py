@@ -0,0 +1,96 @@
+"""
+训练时按需做的旋转 / 翻转增强：图片在加载时变换，bbox_2d 目标在构建样本时变换，
+不再把增强后的图片落盘（替代 train_data_ex）。
+增强后的图片用 "<原图路径>#<变换名>" 表示
+"""
+import json
+import os
+import re
+from PIL import Image
+
+import geometry
+from hole_format import compact_prompts, parse_compact, to_compact
+
+# 变换名 -> PIL transpose（无损，rot90 与 img.rotate(-90, expand=True) 一致）
+TRANSFORMS = {
+    "identity": None,
+    "rot90": Image.Transpose.ROTATE_270,
+    "rot180": Image.Transpose.ROTATE_180,
+    "rot270": Image.Transpose.ROTATE_90,
+    "hflip": Image.Transpose.FLIP_LEFT_RIGHT,
+    "vflip": Image.Transpose.FLIP_TOP_BOTTOM,
+}
+
+
+def augmented_path(path, name):
+    return path if name == "identity" else f"{path}#{name}"
+
+
+def split_augmented_path(path):
+    """"<路径>#<变换名>" -> (路径, 变换名)，普通路径返回 (路径, "identity")"""
+    base, sep, name = path.rpartition("#")
+    if sep and name in TRANSFORMS:
+        return base, name
+    return path, "identity"
+
+
+def transform_image(img, name):
+    if TRANSFORMS[name] is None:
+        return img
+    return img.transpose(TRANSFORMS[name])
+
+
+def load_augmented(path, open_image=None):
+    """按 "<路径>#<变换名>" 读取并变换图片，open_image 为原图读取函数（如从分片读取），默认读磁盘"""
+    base, name = split_augmented_path(path)
+    img = open_image(base) if open_image else Image.open(base).convert("RGB")
+    return transform_image(img, name)
+
+
+def transform_boxes(boxes, width, height, name):
+    """0-1000 归一化坐标随图片 (width, height) 做 name 变换"""
+    if name.startswith("rot"):
+        return geometry.rotate_norm1000(boxes, width, height, int(name[3:]))
+    if name.endswith("flip"):
+        return geometry.flip_norm1000(boxes, width, height, horizontal=name == "hflip")
+    return geometry.as_boxes(boxes).astype(int)
+
+
+def transform_target(content, width, height, name, compact=False):
+    """assistant 输出（原格式 / 紧凑格式）中的 bbox_2d 随图片做 name 变换，其余内容不变"""
+    if compact:
+        holes = parse_compact(content)
+    else:
+        holes = json.loads(re.search(r'```json\s*([\s\S]*?)```', content).group(1))
+    boxed = [x for x in holes if x["bbox_2d"]]
+    boxes = transform_boxes([x["bbox_2d"] for x in boxed], width, height, name).tolist()
+    for hole, box in zip(boxed, boxes):
+        hole["bbox_2d"] = box
+    if compact:
+        return to_compact(holes)
+    return f"```json\n{json.dumps(holes, indent=2, ensure_ascii=False)}\n```"
+
+
+def augment_sample(sample, transforms, root=".", image_size=None):
+    """
+    一条训练样本 -> 每个变换一条样本，图片为 "<路径>#<变换名>"，assistant 的 bbox_2d 已变换。
+    root 为图片相对路径的根目录，用于读取原图尺寸；image_size 可替换尺寸来源（如分片索引）
+    """
+    image = sample["images"][0]
+    image = image["path"] if isinstance(image, dict) else image
+    if image_size is not None:
+        width, height = image_size(image)
+    else:
+        width, height = geometry.image_size(os.path.join(root, image))
+    user, assistant = sample["messages"][0], sample["messages"][-1]
+    compact = user["content"] == compact_prompts
+    result = []
+    for name in transforms:
+        result.append({
+            "messages": [
+                {"role": "user", "content": user["content"]},
+                {"role": "assistant", "content": transform_target(assistant["content"], width, height, name, compact)},
+            ],
+            "images": [augmented_path(image, name)],
+        })
+    return result
@@ -2,6 +2,7 @@ from utils.drawing import *
 import json
 import os
 import re
+import geometry
 
 
 # 训练数据地址
@@ -16,7 +17,7 @@ for i in img_save_path:
 
 def extract_json_blocks(text: str) -> List[str]:
     pattern = re.compile(r'```json\s*([\s\S]*?)```', re.MULTILINE)
-    return eval([m.group(1).strip() for m in pattern.finditer(text)][0])
+    return json.loads([m.group(1).strip() for m in pattern.finditer(text)][0])
 
 for n,dp in enumerate(data_path):
     with open(dp,"r",encoding="utf-8") as f:
@@ -26,11 +27,12 @@ for n,dp in enumerate(data_path):
         image_path = os.path.join(os.path.dirname(dp),i["images"][0])
         resp = i["messages"][-1]["content"]
         result[image_path] = extract_json_blocks(resp)
+        holes = [x for x in result[image_path] if x["bbox_2d"]]
+        # 归一化坐标按图片尺寸一次性转为像素坐标
+        width, height = geometry.image_size(image_path)
+        boxes = geometry.from_norm1000([x["bbox_2d"] for x in holes], width, height).tolist()
         bbox = {}
-        for item in result[image_path]:
-            if item["category"] in bbox:
-                bbox[item["category"]].append(item["bbox_2d"])
-            else:
-                bbox[item["category"]] = [item["bbox_2d"]] if item["bbox_2d"] else []
-        draw_bboxes_pil(image_path,bbox ,os.path.join(img_save_path[n],os.path.basename(image_path)),mode="qwen3")
+        for item, box in zip(holes, boxes):
+            bbox.setdefault(item["category"], []).append(box)
+        draw_bboxes_pil(image_path,bbox ,os.path.join(img_save_path[n],os.path.basename(image_path)),mode="qwen2")
 
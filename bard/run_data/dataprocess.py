@@ -1,13 +1,24 @@
 import os
-from utils import labelstudio_trans,draw_box_pil,smart_resize,convert_to_qwen25vl_format,convert_to_qwen3vl_format
+from utils import labelstudio_trans,draw_box_pil,convert_to_qwen25vl_format
 import json
-import copy
+import tempfile
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from PIL import Image, ImageDraw
 import re
+from hole_format import compact_prompts, to_compact
+import geometry
+import tracing
+import dedup
+from jsonstream import iter_records, JsonArrayWriter
 
 
 
 
+# 展开图 resize 使用的 smart_resize 参数
+RESIZE = dict(factor=32,min_pixels=2*2*32*32,max_pixels=32 * 32 * 4 * 2560)
+# 构建逻辑变化时加 1，使 manifest 中的缓存全部失效
+BUILD_VERSION = 1
 
 prompts = """<image>
 任务：
@@ -58,101 +69,157 @@ def extract_text(s):
     tokens = pattern.findall(s.lower())
     return "".join(tokens)  # ['123', '*', '456', 'm', '789']
 
-def rotate_box_90_cw(path,box,mode = "qwen2"):
+def rotated(task):
+    """任务中是否有带 rotation 的矩形（labelstudio_trans 按轴对齐矩形换算，旋转框的坐标不可信）"""
+    return any((r.get("value", {}).get("rotation") or 0) % 360
+               for ann in task["annotations"][:2] for r in ann.get("result", []))
+
+def convert_task(task,tmp_dir):
+    """
+    单条任务 -> (views, holes)：与原先整份导出的转换一样按 annotations[1]（视图）/ annotations[0]（孔）
+    拆成两份导出交给 labelstudio_trans，只是每次只写这一条任务，不 deepcopy 整个数据集
+    """
+    out = []
+    for name, ann in [("label_views.json",task["annotations"][1]),("label_holes.json",task["annotations"][0])]:
+        path = os.path.join(tmp_dir,name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([dict(task, annotations=[ann])], f, ensure_ascii=False)
+        out.append(labelstudio_trans(path))
+    return out
+
+def prepare_data_stream(dataset_path):
+    """
+    逐条读取 Label Studio 导出（JSON 数组或 JSONL），逐条 yield (key, 展开图标注, 孔标注)，
+    区域换算仍由 labelstudio_trans 完成。没有展开图/孔、孔 size 缺失或带旋转框的任务打印后跳过
+    """
+    skipped = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for task in iter_records(dataset_path):
+            if rotated(task):
+                print(task["data"]["image"],"rotated")
+                skipped += 1
+                continue
+            views, holes = convert_task(task,tmp_dir)
+            common_keys = set(views.keys()) & set(holes.keys())
+            if not common_keys:
+                print(task["data"]["image"],"not_")
+                skipped += 1
+            for i in common_keys:
+                view = [x for x in views[i] if x[3] == "ExpandView"]
+                # 判断是否含有展开图以及孔size是否存在
+                if view and len(holes[i]) == len([x for x in holes[i] if x[4]]):
+                    yield i, view[0], holes[i]
+                else:
+                    print(i,"not_")
+                    skipped += 1
+    print(f"跳过 {skipped} 条任务")
+
+def crop_view(img_name,view,hole,save_dir):
     """
-    图片顺时针旋转90度后bbox坐标
+    单张图：切展开图,resize图片并调整孔坐标，调整两次，1，展开图对应坐标 2 resize后的坐标
     """
-    x1, y1, x2, y2 = box
-    img = Image.open(path)
-    img_w,img_h = img.size
-    if mode == "qwen3":
-        x1 = round(x1 / 1000 * img_w)
-        y1 = round(y1 / 1000 * img_h)
-        x2 = round(x2 / 1000 * img_w)
-        y2 = round(y2 / 1000 * img_h)
-        new_x1 = img_h - y2
-        new_y1 = x1
-        new_x2 = img_h - y1
-        new_y2 = x2
-        new_w = img_h
-        new_h = img_w
-        x1 = round(new_x1 / new_w * 1000)
-        y1 = round(new_y1 / new_h * 1000)
-        x2 = round(new_x2 / new_w * 1000)
-        y2 = round(new_y2 / new_h * 1000)
-        return [x1,y1,x2,y2]
-    return [img_h - y2, x1, img_h - y1, x2]
-
-def prepare_data(dataset_path,save_dir):
-    with open(dataset_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    img_list = []
-    for i in data:
-        img_url = i['data']['image']
-        img_list.append(img_url)
-    label_holes = []
-    label_views = []
-    for ni, i in enumerate(data):
-        anns = i["annotations"]
-        views_result = anns[1]
-        holes_result = anns[0]
-        view_sample = copy.deepcopy(i)
-        view_sample["annotations"] = [views_result]
-        label_views.append(view_sample)
-        hole_sample = copy.deepcopy(i)
-        hole_sample["annotations"] = [holes_result]
-        label_holes.append(hole_sample)
-    with open(os.path.join(save_dir,"label_holes.json"), "w", encoding="utf-8") as f:
-        json.dump(label_holes, f, ensure_ascii=False, indent=4)
-    with open(os.path.join(save_dir,"label_views.json"), "w", encoding="utf-8") as f:
-        json.dump(label_views, f, ensure_ascii=False, indent=4)
-    # 取展开图标注
-    views = labelstudio_trans(os.path.join(save_dir,"label_views.json"))
-    # 取孔标注
-    holes = labelstudio_trans(os.path.join(save_dir,"label_holes.json"))
-    # 公共keys
-    common_keys = set(views.keys()) & set(holes.keys())
-
-    download_url_list = []
-    for i in common_keys:
-        # 判断是否含有展开图以及孔size是否存在
-        if [x for x in views[i] if x[3] == "ExpandView"] and len(holes[i]) == len([x for x in holes[i] if x[4]]):
-            download_url_list.append(i)
-        else:
-            print(i,"not_")
-    return views , holes , download_url_list
-
-def get_feats(download_url_list,views,holes,save_dir):
-    # 切展开图,resize图片并调整孔坐标，调整两次，1，展开图对应坐标 2 resize后的坐标
-    if not os.path.exists(os.path.join(save_dir,"train_data")):
-        os.makedirs(os.path.join(save_dir,"train_data"))
-    result = {}
-    for i in download_url_list:
-        img_name = os.path.basename(i)
-        img_path = os.path.join(save_dir,"images",img_name)
-        view = [ x for x in views[i] if x[3] == "ExpandView"][0]
-        hole = holes[i]
-        save_path = os.path.join(save_dir,"train_data",img_name)
+    img_path = os.path.join(save_dir,"images",img_name)
+    save_path = os.path.join(save_dir,"train_data",img_name)
+    with tracing.span("crop"):
         img = Image.open(img_path).crop(view[0])
-        # 展开图部分宽高
-        orig_width,orig_height = img.size
-        # 图片resize后保存
-        new_height,new_width= smart_resize(orig_height, orig_width,factor=32,min_pixels=2*2*32*32,max_pixels=32 * 32 * 4 * 2560)
-        if (orig_height, orig_width) != (new_height, new_width):
+    # 展开图部分宽高
+    orig_width,orig_height = img.size
+    # 图片resize后保存
+    new_height,new_width= geometry.smart_resize(orig_height, orig_width,**RESIZE)
+    if (orig_height, orig_width) != (new_height, new_width):
+        with tracing.span("resize", pixels=new_width * new_height):
             img = img.resize((new_width,new_height))
+    with tracing.span("save"):
         img.save(save_path, quality=100)
-        # 孔标注结果依次转换
-        feats = []
-        for j in hole:
-            # 判断孔是否在展开图上
-            if j[0][0] >= view[0][0] and j[0][2] <= view[0][2] and j[0][1] >= view[0][1] and j[0][3] <= view[0][3]:
-                bbox = [j[0][0] - view[0][0],j[0][1]- view[0][1],j[0][2]- view[0][0],j[0][3]- view[0][1]]
-                bbox = convert_to_qwen3vl_format(bbox, orig_height, orig_width,factor=32,min_pixels=2*2*32*32,max_pixels=32 * 32 * 4 * 2560)
-                feats.append([bbox,j[3],j[4][0]])
-        result[i] = feats
-    return result
-
-def main(result,save_dir):
+    # 孔标注结果依次转换：过滤展开图外的孔 -> 减去展开图偏移 -> resize 后的 qwen3 坐标
+    mask = geometry.inside([j[0] for j in hole], view[0])
+    hole = [j for j, m in zip(hole, mask) if m]
+    boxes = geometry.crop_offset([j[0] for j in hole], view[0])
+    boxes = geometry.to_qwen3vl(boxes, orig_height, orig_width,**RESIZE)
+    return [[bbox,j[3],j[4][0]] for bbox, j in zip(boxes.tolist(), hole)]
+
+def build_messages(value,compact = False):
+    """
+    孔标注 [[bbox,类别,size],...] -> 训练 qa 对
+    compact=True 时使用紧凑输出格式（单行、类别短码、无空类别占位）
+    """
+    msg = {}
+    for i in value:
+        if i[1].replace("方孔","矩形孔") not in msg:
+            msg[i[1].replace("方孔","矩形孔")] = []
+        msg[i[1].replace("方孔","矩形孔")].append({"bbox_2d":i[0],"size":extract_text(i[2]).strip()})
+    msga = list(msg.keys())
+    for k in [x for x in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"] if x not in msga]:
+        msg[k] = [{}]
+    msg_ = []
+    for i in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"]:
+       msg_ +=  [ {"category":i,"bbox_2d":x.get("bbox_2d",[]),"size":x.get("size","")} for x in msg[i] ]
+    if compact:
+        return [
+            {
+                "content": compact_prompts,
+                "role": "user"
+            },
+            {
+                "content": to_compact(msg_),
+                "role": "assistant"
+            }
+        ]
+    return [
+        {
+            "content": prompts,
+            "role": "user"
+        },
+        {
+            "content": f"```json\n{json.dumps(msg_, indent=2,ensure_ascii=False)}\n```" ,
+            "role": "assistant"
+        }
+    ]
+
+def augment_view(key,value,save_dir,compact = False,materialize_ex = True):
+    """
+    单张图：生成原图 qa 对，并旋转图片生成增强样本，返回 (原图样本, 旋转样本)。
+    materialize_ex=False 时不落盘旋转图片，旋转样本为 None（训练时由 swift_augment.py 按需增强）
+    """
+    img_mark = f"train_data/{os.path.basename(key)}"
+    # 原图片qa对
+    sample = {"messages":build_messages(value,compact),"images":[img_mark]}
+    if not materialize_ex:
+        return sample, None
+    img_ex_mark = f"train_data_ex/{os.path.basename(key)}"
+    img_path = os.path.join(save_dir,"train_data",os.path.basename(key))
+    # 进一步增强 旋转图片
+    with tracing.span("load"):
+        img = Image.open( img_path ).convert('RGB')
+    with tracing.span("rotate"):
+        img_rot = img.rotate(-90, expand=True, fillcolor=(0, 0, 0))
+    with tracing.span("save"):
+        img_rot.save(os.path.join( save_dir,"train_data_ex" ,os.path.basename(key)))
+    # 旋转后图片qa
+    boxes = geometry.rotate_norm1000([x[0] for x in value], img.width, img.height, 90)
+    value_ = [[bbox,x[1],x[2]] for bbox, x in zip(boxes.tolist(), value)]
+    sample_ex = {"messages":build_messages(value_,compact),"images":[img_ex_mark]}
+    return sample, sample_ex
+
+def to_swift(sample):
+    """训练样本 -> swift sft 的 jsonl 行格式"""
+    return {
+        "messages":[{"role":m["role"],"content":m["content"]} for m in sample["messages"]],
+        "images":sample["images"]
+    }
+
+def save_views(trains_in,trains_in_ex,save_dir):
+    """逐条写出 view.json / view_ex.json 以及直接可用于训练的 view.jsonl / view_ex.jsonl，trains_in_ex 为 None 时只写 view"""
+    for name, samples in [("view",trains_in),("view_ex",trains_in_ex)]:
+        if samples is None:
+            continue
+        with JsonArrayWriter(os.path.join(save_dir,f"{name}.json")) as fa, \
+                open(os.path.join(save_dir,f"{name}.jsonl"), "w", encoding="utf-8") as fl:
+            for sample in samples:
+                fa.write(sample)
+                fl.write(json.dumps(to_swift(sample), ensure_ascii=False) + "\n")
+
+def main(result,save_dir,compact = False):
     # 转化为训练数据格式
     trains_in = []
     trains_in_ex = []
@@ -161,93 +228,163 @@ def main(result,save_dir):
     if not os.path.exists(train_data_ex_dir):
         os.makedirs(train_data_ex_dir)
     for key,value in result.items():
-        img_mark = f"train_data/{os.path.basename(key)}"
-        img_ex_mark = f"train_data_ex/{os.path.basename(key)}"
-        img_path = os.path.join(save_dir,"train_data",os.path.basename(key))
-        # 进一步增强 旋转图片
-        img = Image.open( img_path ).convert('RGB')
-        img_rot = img.rotate(-90, expand=True, fillcolor=(0, 0, 0))
-        img_rot.save(os.path.join( train_data_ex_dir ,os.path.basename(key)))
-        # 原图片qa对
-        msg = {}
         for i in value:
             if i[1] not in label_cnt:
                 label_cnt[i[1]] = 0
             else:
                 label_cnt[i[1]] += 1
-            if i[1].replace("方孔","矩形孔") not in msg:
-                msg[i[1].replace("方孔","矩形孔")] = []
-            msg[i[1].replace("方孔","矩形孔")].append({"bbox_2d":i[0],"size":extract_text(i[2]).strip()})
-        msga = list(msg.keys())
-        for k in [x for x in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"] if x not in msga]:
-            msg[k] = [{}]
-        msg_ = []
-        for i in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"]:
-           msg_ +=  [ {"category":i,"bbox_2d":x.get("bbox_2d",[]),"size":x.get("size","")} for x in msg[i] ]
-        messages = [
-              {
-                "content": prompts,
-                "role": "user"
-              },
-              {
-                "content": f"```json\n{json.dumps(msg_, indent=2,ensure_ascii=False)}\n```" ,
-                "role": "assistant"
-              }
-            ]
-        trains_in.append({"messages":messages,"images":[img_mark]})
-
-        # 旋转后图片qa
-        value_ = [[list(rotate_box_90_cw(img_path,x[0],mode="qwen3")),x[1],x[2]] for x in value]
-        msg = {}
-        for i in value_:
-            if i[1].replace("方孔","矩形孔") not in msg:
-                msg[i[1].replace("方孔","矩形孔")] = []
-            msg[i[1].replace("方孔","矩形孔")].append({"bbox_2d":i[0],"size":extract_text(i[2]).strip()})
-        msga = list(msg.keys())
-        for k in [x for x in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"] if x not in msga]:
-            msg[k] = [{}]
-        msg_ = []
-        for i in ["圆孔" ,"腰孔" ,"矩形孔" ,"螺纹孔"]:
-           msg_ +=  [ {"category":i,"bbox_2d":x.get("bbox_2d",[]),"size":x.get("size","")} for x in msg[i] ]
-        messages = [
-            {
-                "content": prompts,
-                "role": "user"
-            },
-            {
-                "content": f"```json\n{json.dumps(msg_, indent=2, ensure_ascii=False)}\n```",
-                "role": "assistant"
-            }
-        ]
-        trains_in_ex.append({"messages":messages,"images":[img_ex_mark]})
-    os.path.join(save_dir,"view.json")
-    with open(os.path.join(save_dir,"view.json"), 'w', encoding='utf-8') as f:
-        json.dump(trains_in, f, ensure_ascii=False, indent=2)
-    with open(os.path.join(save_dir,"view_ex.json"), 'w', encoding='utf-8') as f:
-        json.dump(trains_in_ex, f, ensure_ascii=False, indent=2)
+        with tracing.span("augment_view", image=os.path.basename(key)):
+            sample, sample_ex = augment_view(key,value,save_dir,compact)
+        trains_in.append(sample)
+        trains_in_ex.append(sample_ex)
+    save_views(trains_in,trains_in_ex,save_dir)
 
-if __name__ == "__main__":
-    # # 数据集地址
-    # dataset_path = "/Users/bardanyu/Desktop/code/Simens_sft/dataset/siemens02-1000-2019-all-holes-mainview-expandview-train-20251024.json"
-    # # 结果保存地址
-    # save_dir = "/Users/bardanyu/Desktop/code/Simens_sft/data/holes_qwen3_siemens02_1000"
-    # mode = "dataprocess"
-    # views, holes, download_url_list = prepare_data(dataset_path, save_dir)
-    # feats = get_feats(download_url_list,views,holes,save_dir)
-    # main(feats, save_dir)
+def source_hash(img_path,entry = None):
+    """源图内容哈希；文件大小和修改时间与 manifest 记录一致时直接复用，不重新读文件"""
+    st = os.stat(img_path)
+    stat = [st.st_size, st.st_mtime_ns]
+    if entry and entry.get("src_stat") == stat:
+        return entry["src_hash"], stat
+    h = hashlib.sha256()
+    with open(img_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest(), stat
 
+def build_hash(src_hash,view,hole,compact,materialize_ex):
+    """源图哈希 + 展开图/孔标注 + 构建参数 的哈希，任一变化都需要重建该图"""
+    payload = json.dumps([src_hash, view, hole, RESIZE, compact, materialize_ex, BUILD_VERSION], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # 数据集地址
-    dataset_path = "/dataset/siemens02-1000-2019-all-holes-mainview-expandview-test-20251024.json"
-    # 结果保存地址
-    save_dir = "/data/holes_qwen3_siemens02_1000_test"
+def build_one(task):
+    """进程池任务：单张图 crop + 增强 + 展开图感知哈希，返回 (原图样本, 旋转样本, 哈希)"""
+    key, view, hole, save_dir, compact, materialize_ex = task
+    with tracing.span("build_one", image=os.path.basename(key)):
+        value = crop_view(os.path.basename(key),view,hole,save_dir)
+        sample, sample_ex = augment_view(key,value,save_dir,compact,materialize_ex)
+        with tracing.span("phash"):
+            view_hash = dedup.image_hash(os.path.join(save_dir,"train_data",os.path.basename(key)))
+        return sample, sample_ex, view_hash
 
-    views, holes, download_url_list = prepare_data(dataset_path, save_dir)
-    feats = get_feats(download_url_list,views,holes,save_dir)
-    main(feats, save_dir)
+def view_hashes(manifest,save_dir):
+    """manifest 中各图展开图的感知哈希，旧 manifest 没有记录时补算（写回 entry）"""
+    hashes = {}
+    for key, entry in manifest.items():
+        if "view_hash" not in entry:
+            entry["view_hash"] = dedup.image_hash(os.path.join(save_dir,"train_data",os.path.basename(key)))
+        hashes[key] = entry["view_hash"]
+    return hashes
 
+def dedup_views(manifest,save_dir,max_per_group = 1,reference_dirs = (),drop_leaked = False):
+    """
+    近重复去重（哈希相近且零件号相同，见 dedup.py）：每组近重复的展开图最多保留 max_per_group 张（None 为不去重，只报告）；
+    reference_dirs 为其他构建目录（如训练集构建时传测试集目录），报告与其近重复的图（泄漏），
+    drop_leaked=True 时一并剔除。明细写入 save_dir/dedup.json，返回保留的 key 集合
+    """
+    hashes = view_hashes(manifest,save_dir)
+    dup_groups = dedup.groups(hashes)
+    kept = dedup.select(hashes, dup_groups, max_per_group) if max_per_group else set(hashes)
+    leaks = None
+    if reference_dirs:
+        reference = {}
+        for ref_dir in reference_dirs:
+            with open(os.path.join(ref_dir,"manifest.json"), "r", encoding="utf-8") as f:
+                reference.update(view_hashes(json.load(f),ref_dir))
+        leaks = dedup.leakage(hashes, reference)
+        if drop_leaked:
+            kept -= set(leaks)
+    dedup.report(dup_groups, kept, leaks, len(hashes), os.path.join(save_dir,"dedup.json"))
+    return kept
 
+def collect_built(done,pending,manifest):
+    """已完成的构建任务写进 manifest，失败的打印后跳过"""
+    for fut in done:
+        meta, key = pending.pop(fut)
+        try:
+            sample, sample_ex, view_hash = fut.result()
+        except Exception as e:
+            print(key, e)
+            continue
+        manifest[key] = dict(meta, sample=sample, sample_ex=sample_ex, view_hash=view_hash)
 
+def build(tasks,save_dir,compact = False,workers = None,materialize_ex = True,
+          max_per_group = None,reference_dirs = (),drop_leaked = False):
+    """
+    并行 + 增量构建训练集：tasks 为 prepare_data_stream 产出的 (key, 展开图标注, 孔标注)，边读边提交，
+    进程池中最多积压 4 倍进程数的任务，标注不在内存中攒全量。
+    按 源图/标注/参数 哈希记录在 manifest.json 中，未变化且产物仍在的图直接复用上次结果，最后重写 view.json / view_ex.json。
+    materialize_ex=False 时不生成 train_data_ex / view_ex，增强交给训练时的 swift_augment.py。
+    写 view 前按展开图感知哈希去重 / 检查与 reference_dirs 的泄漏（见 dedup_views），manifest 保留全部图
+    """
+    out_dirs = ["train_data","train_data_ex"] if materialize_ex else ["train_data"]
+    for d in out_dirs:
+        os.makedirs(os.path.join(save_dir,d), exist_ok=True)
+    manifest_path = os.path.join(save_dir,"manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    new_manifest = {}
+    seen = set()
+    reused = 0
+    max_pending = 4 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for key, view, hole in tasks:
+            if key in seen:
+                print(key,"重复")
+                continue
+            seen.add(key)
+            img_name = os.path.basename(key)
+            entry = manifest.get(key)
+            src_hash, src_stat = source_hash(os.path.join(save_dir,"images",img_name),entry)
+            digest = build_hash(src_hash,view,hole,compact,materialize_ex)
+            if entry and entry["hash"] == digest and all(
+                    os.path.exists(os.path.join(save_dir,d,img_name)) for d in out_dirs):
+                new_manifest[key] = entry
+                reused += 1
+                continue
+            meta = {"hash": digest, "src_hash": src_hash, "src_stat": src_stat}
+            pending[pool.submit(build_one, (key, view, hole, save_dir, compact, materialize_ex))] = (meta, key)
+            if len(pending) >= max_pending:
+                collect_built(wait(pending, return_when=FIRST_COMPLETED).done, pending, new_manifest)
+        collect_built(wait(pending).done, pending, new_manifest)
+    print(f"共 {len(seen)} 张，复用 {reused} 张，处理 {len(seen) - reused} 张，成功 {len(new_manifest) - reused} 张")
+    kept = dedup_views(new_manifest,save_dir,max_per_group,reference_dirs,drop_leaked)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    keys = sorted(kept)
+    trains_in_ex = (new_manifest[k]["sample_ex"] for k in keys) if materialize_ex else None
+    save_views((new_manifest[k]["sample"] for k in keys),trains_in_ex,save_dir)
+    return new_manifest
 
+if __name__ == "__main__":
+    # 数据集地址
+    dataset_path = "/dataset/siemens02-1000-2019-all-holes-mainview-expandview-test-20251024.json"
+    # 结果保存地址
+    save_dir = "/data/holes_qwen3_siemens02_1000_test"
+    # 是否使用紧凑输出格式（需与 eval.py 的 COMPACT 保持一致）
+    compact = False
 
+    # 构建进程数，None 为 CPU 核数
+    workers = None
+    # 是否落盘旋转增强（train_data_ex / view_ex）；False 时训练用 swift_augment.py 按需增强
+    materialize_ex = True
+    # 分阶段耗时 trace（JSONL，各构建进程追加写入）；None 为不记录
+    trace_path = os.path.join(save_dir, "trace.jsonl")
+    # 近重复展开图每组最多保留几张（按 key 顺序保留前 N 张，其余剔除），None 为不去重只报告
+    max_per_group = None
+    # 检查泄漏的其他构建目录，与之近重复的图在 dedup.json 中列出。
+    # 构建训练集时填测试集的构建目录（即 eval.py test_img_path / benchmark.py DATASET 所在的留出集目录，
+    # 如 ["/root/autodl-tmp/qwen3_swift/test_img"]），benchmark 评测与泄漏检查用的是同一份留出集
+    reference_dirs = []
+    # 是否从本次构建中剔除泄漏的图
+    drop_leaked = False
 
+    if trace_path:
+        os.environ["TRACE_PATH"] = trace_path
+    build(prepare_data_stream(dataset_path), save_dir, compact, workers, materialize_ex,
+          max_per_group, reference_dirs, drop_leaked)
+    if trace_path and os.path.exists(trace_path):
+        tracing.report(trace_path)
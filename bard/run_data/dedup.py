@@ -0,0 +1,216 @@
+"""
+展开图近重复检测：同一零件的不同版本（_00 / _01 / _02）图纸往往几乎一样，重复训练浪费 GPU，
+训练集与测试集之间的重复会虚高评测结果。
+
+对 crop + resize 后的展开图算 DCT 感知哈希（pHash，HASH_SIZE² 位），汉明距离不超过 radius、宽高比接近
+且文件名中的零件号相同即视为近重复。同一模板画出的相邻零件（如 122/123/128、186/187）哈希距离和同零件的不同版本一样近，
+但孔位标注不同，只看哈希会把它们误判为重复，所以默认（require_same_part=True）要求零件号一致。
+索引用多索引哈希（multi-index hashing）：哈希切成 m 段 SEGMENT_BITS 位，距离 ≤ radius 的两个哈希至少有一段
+距离 ≤ radius // m（抽屉原理），每段按该半径枚举邻近键查倒排表，只比较命中的候选，不做两两比较。
+
+dataprocess.build 在构建时为每张图算哈希（随 manifest 缓存），按 max_per_group 去重并报告与参考集（如训练集）的泄漏；
+也可单独运行本文件对两个图片目录做去重 / 泄漏检查
+"""
+import itertools
+import json
+import os
+import re
+import numpy as np
+from PIL import Image
+
+# 默认 16x16 = 256 位
+HASH_SIZE = 16
+# 256 位哈希的汉明距离阈值。现有训练集（449 张，约 10 万对）中距离 ≤ 40 的有 15 对：
+# 同一零件的两对版本（224/225 为 36，231/_01C 为 28），其余 13 对是不同零件号（16-38，标注的孔位不同）；
+# 不同零件之间 99% 以上大于 94。阈值本身分不开这两类，需配合零件号（见 part_number）
+RADIUS = 40
+# 多索引哈希每段的位数
+SEGMENT_BITS = 16
+# 宽高比相差超过该比例的不视为重复
+MAX_ASPECT_DIFF = 0.1
+
+# 文件名中的零件号，其后可跟版本号：001_A7E0018072440_00_page_001.png、19062980_01_BL1_page_001.png、
+# A7E0019061820_01C_page_001.png、042_A7E0018075730_page_001.png
+PART_RE = re.compile(r"(?:^|_)([A-Z0-9]*\d{8,})(?=_|$)")
+
+_dct_cache = {}
+
+
+def _dct_matrix(n):
+    """正交 DCT-II 矩阵"""
+    if n not in _dct_cache:
+        k = np.arange(n)[:, None]
+        m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+        m[0] /= np.sqrt(2)
+        _dct_cache[n] = m
+    return _dct_cache[n]
+
+
+def phash(img, hash_size=HASH_SIZE):
+    """
+    PIL 图片 -> 感知哈希（hash_size² 位的 int）。
+    灰度缩放到 4*hash_size 见方，二维 DCT 取左上 hash_size 见方的低频系数，大于中位数（不含直流分量）记 1
+    """
+    n = hash_size * 4
+    pixels = np.asarray(img.convert("L").resize((n, n), Image.Resampling.BOX), dtype=np.float64)
+    d = _dct_matrix(n)
+    low = (d @ pixels @ d.T)[:hash_size, :hash_size].ravel()
+    bits = low > np.median(low[1:])
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def image_hash(path, hash_size=HASH_SIZE):
+    """图片文件 -> {"phash": 十六进制字符串, "size": [宽, 高]}，可直接存入 manifest"""
+    with Image.open(path) as img:
+        return {"phash": format(phash(img, hash_size), "x"), "size": list(img.size)}
+
+
+def part_number(key):
+    """图片路径 / URL -> 零件号，解析不出时为 None"""
+    m = PART_RE.search(os.path.splitext(os.path.basename(key))[0])
+    return m.group(1) if m else None
+
+
+def same_part(a, b):
+    """两张图的零件号均能解析且相同"""
+    part = part_number(a)
+    return part is not None and part == part_number(b)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def similar_aspect(size_a, size_b, max_diff=MAX_ASPECT_DIFF):
+    ra, rb = size_a[0] / size_a[1], size_b[0] / size_b[1]
+    return abs(ra - rb) / max(ra, rb) <= max_diff
+
+
+class MultiIndexHash:
+    """多索引哈希：每段一张倒排表，query 返回汉明距离 ≤ radius 的条目"""
+    def __init__(self, bits=HASH_SIZE * HASH_SIZE, radius=RADIUS, segment_bits=SEGMENT_BITS):
+        self.radius = radius
+        n = max(bits // segment_bits, 1)
+        bounds = [bits * i // n for i in range(n + 1)]
+        self.segments = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.segments]
+        self.items = []
+        # 每段内的搜索半径及对应的翻转掩码
+        sub_radius = radius // n
+        self.flips = [
+            [sum(1 << b for b in bits_) for r in range(sub_radius + 1)
+             for bits_ in itertools.combinations(range(mask.bit_length()), r)]
+            for _, mask in self.segments
+        ]
+
+    def add(self, key, h, size=None):
+        idx = len(self.items)
+        self.items.append((key, h, size))
+        for table, (shift, mask) in zip(self.tables, self.segments):
+            table.setdefault((h >> shift) & mask, []).append(idx)
+        return idx
+
+    def query(self, h, size=None):
+        """-> [(key, 距离)]，按距离排序"""
+        candidates = set()
+        for table, (shift, mask), flips in zip(self.tables, self.segments, self.flips):
+            part = (h >> shift) & mask
+            for flip in flips:
+                candidates.update(table.get(part ^ flip, ()))
+        found = []
+        for idx in candidates:
+            key, other, other_size = self.items[idx]
+            dist = hamming(h, other)
+            if dist <= self.radius and (size is None or other_size is None or similar_aspect(size, other_size)):
+                found.append((key, dist))
+        return sorted(found, key=lambda x: x[1])
+
+
+def groups(hashes, radius=RADIUS, hash_size=HASH_SIZE, require_same_part=True):
+    """
+    hashes: {key: {"phash", "size"}} -> 近重复组 [[key, ...], ...]（只含 2 张及以上的组，组内按 key 排序）。
+    近重复关系按传递闭包合并（并查集）；require_same_part 时只合并零件号相同的图
+    """
+    index = MultiIndexHash(hash_size * hash_size, radius)
+    parent = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for key in sorted(hashes):
+        h, size = int(hashes[key]["phash"], 16), hashes[key]["size"]
+        parent[key] = key
+        for other, _ in index.query(h, size):
+            if not require_same_part or same_part(key, other):
+                parent[find(other)] = find(key)
+        index.add(key, h, size)
+    members = {}
+    for key in parent:
+        members.setdefault(find(key), []).append(key)
+    return sorted((sorted(x) for x in members.values() if len(x) > 1), key=lambda x: x[0])
+
+
+def select(keys, dup_groups, max_per_group=1):
+    """每个近重复组最多保留 max_per_group 张（按 key 顺序），返回保留的 key 集合"""
+    dropped = set()
+    for group in dup_groups:
+        dropped.update(group[max_per_group:])
+    return {k for k in keys if k not in dropped}
+
+
+def leakage(hashes, reference, radius=RADIUS, hash_size=HASH_SIZE, require_same_part=True):
+    """hashes 中与 reference（如训练集）近重复的条目 -> {key: [(参考 key, 距离), ...]}，require_same_part 同 groups"""
+    index = MultiIndexHash(hash_size * hash_size, radius)
+    for key, v in reference.items():
+        index.add(key, int(v["phash"], 16), v["size"])
+    result = {}
+    for key in sorted(hashes):
+        found = index.query(int(hashes[key]["phash"], 16), hashes[key]["size"])
+        if require_same_part:
+            found = [x for x in found if same_part(key, x[0])]
+        if found:
+            result[key] = found
+    return result
+
+
+def report(dup_groups, kept, leaks, n_total, path=None):
+    """打印去重 / 泄漏统计，path 不为空时写出明细 JSON"""
+    n_dup = sum(len(x) for x in dup_groups)
+    print(f"近重复: {len(dup_groups)} 组 {n_dup} 张，保留 {len(kept)}/{n_total} 张")
+    if leaks is not None:
+        print(f"与参考集重复（泄漏）: {len(leaks)}/{n_total} 张")
+        for key, found in list(leaks.items())[:10]:
+            print(f"  {os.path.basename(key)} ~ {os.path.basename(found[0][0])} (距离 {found[0][1]})")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "groups": dup_groups,
+                "dropped": sorted(k for g in dup_groups for k in g if k not in kept),
+                "leakage": leaks,
+            }, f, ensure_ascii=False, indent=2)
+
+
+def hash_dir(image_dir, hash_size=HASH_SIZE):
+    return {
+        os.path.join(image_dir, name): image_hash(os.path.join(image_dir, name), hash_size)
+        for name in sorted(os.listdir(image_dir))
+        if name.lower().endswith((".png", ".jpg", ".jpeg"))
+    }
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    # 待检查的图片目录（如测试集）与参考目录（如训练集，None 为不检查泄漏）
+    image_dir = "../test_img/train_data"
+    reference_dir = "../train_data"
+    radius = RADIUS
+    out_path = "dedup_report.json"
+    # ----------------------------
+    hashes = hash_dir(image_dir)
+    dup_groups = groups(hashes, radius)
+    kept = select(hashes, dup_groups)
+    leaks = leakage(hashes, hash_dir(reference_dir), radius) if reference_dir else None
+    report(dup_groups, kept, leaks, len(hashes), out_path)
@@ -0,0 +1,174 @@
+"""
+bbox 几何运算，统一在 (N,4) 的 [x1, y1, x2, y2] 数组上做向量化计算。
+图片尺寸由调用方每张图读一次（image_size）后传入，不再逐框打开图片
+"""
+import math
+import numpy as np
+from PIL import Image
+
+
+def image_size(path):
+    """只读图片头，返回 (width, height)"""
+    with Image.open(path) as img:
+        return img.size
+
+
+def as_boxes(boxes):
+    """list / 单个框 -> (N,4) float64 数组"""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def smart_resize(height, width, factor=32, min_pixels=2 * 2 * 32 * 32, max_pixels=32 * 32 * 4 * 2560):
+    """
+    Qwen-VL 的 smart_resize：宽高取 factor 的整数倍，像素总数落在 [min_pixels, max_pixels]，
+    返回 (new_height, new_width)
+    """
+    if max(height, width) / min(height, width) > 200:
+        raise ValueError(f"宽高比过大: {max(height, width) / min(height, width)}")
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+def shift(boxes, dx, dy):
+    """整体平移"""
+    return as_boxes(boxes) + np.array([dx, dy, dx, dy])
+
+
+def crop_offset(boxes, crop_box):
+    """整图坐标 -> 裁剪区域 crop_box=(x1, y1, x2, y2) 内的坐标"""
+    return shift(boxes, -crop_box[0], -crop_box[1])
+
+
+def inside(boxes, region):
+    """框是否完全落在 region=(x1, y1, x2, y2) 内，返回 (N,) bool"""
+    boxes = as_boxes(boxes)
+    return (
+        (boxes[:, 0] >= region[0]) & (boxes[:, 1] >= region[1])
+        & (boxes[:, 2] <= region[2]) & (boxes[:, 3] <= region[3])
+    )
+
+
+def rescale(boxes, orig_size, new_size, clip=True):
+    """像素坐标随图片从 orig_size=(w, h) 缩放到 new_size=(w, h)，取整并裁剪到图内"""
+    boxes = as_boxes(boxes)
+    scale = np.array([new_size[0] / orig_size[0], new_size[1] / orig_size[1]] * 2)
+    boxes = np.round(boxes * scale)
+    if clip:
+        boxes = np.clip(boxes, 0, [new_size[0] - 1, new_size[1] - 1] * 2)
+    return boxes.astype(np.int64)
+
+
+def to_norm1000(boxes, width, height):
+    """像素坐标 -> Qwen3-VL 0-1000 归一化整数坐标"""
+    boxes = as_boxes(boxes)
+    return np.round(boxes / np.array([width, height, width, height]) * 1000).astype(np.int64)
+
+
+def from_norm1000(boxes, width, height):
+    """Qwen3-VL 0-1000 归一化坐标 -> 像素整数坐标"""
+    boxes = as_boxes(boxes)
+    return np.round(boxes / 1000 * np.array([width, height, width, height])).astype(np.int64)
+
+
+def to_qwen3vl(boxes, orig_height, orig_width, factor=32, min_pixels=2 * 2 * 32 * 32, max_pixels=32 * 32 * 4 * 2560):
+    """原图像素坐标 -> smart_resize 后图片上的 0-1000 归一化坐标"""
+    new_height, new_width = smart_resize(orig_height, orig_width, factor, min_pixels, max_pixels)
+    boxes = rescale(boxes, (orig_width, orig_height), (new_width, new_height))
+    return to_norm1000(boxes, new_width, new_height)
+
+
+def rotate(boxes, width, height, angle):
+    """
+    图片 (width, height) 顺时针旋转 angle（90/180/270）度后的像素坐标，
+    与 PIL img.rotate(-angle, expand=True) 一致
+    """
+    boxes = as_boxes(boxes)
+    x1, y1, x2, y2 = boxes.T
+    if angle % 360 == 0:
+        return boxes.copy()
+    if angle % 360 == 90:
+        return np.stack([height - y2, x1, height - y1, x2], axis=1)
+    if angle % 360 == 180:
+        return np.stack([width - x2, height - y2, width - x1, height - y1], axis=1)
+    if angle % 360 == 270:
+        return np.stack([y1, width - x2, y2, width - x1], axis=1)
+    raise ValueError(f"只支持 90 度的整数倍旋转: {angle}")
+
+
+def rotated_size(width, height, angle):
+    """旋转 angle 度后的 (width, height)"""
+    return (height, width) if angle % 180 == 90 else (width, height)
+
+
+def rotate_norm1000(boxes, width, height, angle):
+    """0-1000 归一化坐标在图片顺时针旋转 angle 度后的归一化坐标（经像素坐标中转，与原逐框实现一致）"""
+    pixel = from_norm1000(boxes, width, height)
+    new_width, new_height = rotated_size(width, height, angle)
+    return to_norm1000(rotate(pixel, width, height, angle), new_width, new_height)
+
+
+def flip(boxes, width, height, horizontal=True):
+    """图片水平（左右）/ 垂直（上下）翻转后的像素坐标"""
+    boxes = as_boxes(boxes)
+    x1, y1, x2, y2 = boxes.T
+    if horizontal:
+        return np.stack([width - x2, y1, width - x1, y2], axis=1)
+    return np.stack([x1, height - y2, x2, height - y1], axis=1)
+
+
+def flip_norm1000(boxes, width, height, horizontal=True):
+    """0-1000 归一化坐标在图片翻转后的归一化坐标"""
+    pixel = from_norm1000(boxes, width, height)
+    return to_norm1000(flip(pixel, width, height, horizontal), width, height)
+
+
+def intersection(a, b):
+    """(N,4) 与 (M,4) 两组框的交集面积矩阵 (N,M)"""
+    a, b = as_boxes(a), as_boxes(b)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+
+def coverage(a, b):
+    """a 中每个框被 b 中每个框覆盖的面积比例 (N,M)"""
+    a = as_boxes(a)
+    return intersection(a, b) / np.maximum(area(a)[:, None], 1e-6)
+
+
+def iou(a, b):
+    """(N,4) 与 (M,4) 两组框的 IoU 矩阵 (N,M)"""
+    a, b = as_boxes(a), as_boxes(b)
+    inter = intersection(a, b)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def area(boxes):
+    """(N,) 框面积"""
+    boxes = as_boxes(boxes)
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def nms(boxes, iou_threshold, scores=None):
+    """贪心 NMS，返回保留框的下标。没有 scores 时按面积从大到小优先"""
+    boxes = as_boxes(boxes)
+    order = np.argsort(-(area(boxes) if scores is None else np.asarray(scores)), kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        order = order[1:][iou(boxes[i], boxes[order[1:]])[0] < iou_threshold]
+    return keep
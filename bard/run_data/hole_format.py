@@ -0,0 +1,211 @@
+import json
+import re
+
+# 类别顺序与训练数据中一致
+CATEGORIES = ["圆孔", "腰孔", "矩形孔", "螺纹孔"]
+# 紧凑格式中的类别短码
+CATEGORY_CODES = {"圆孔": "C", "腰孔": "S", "矩形孔": "R", "螺纹孔": "T"}
+CODE_CATEGORIES = {v: k for k, v in CATEGORY_CODES.items()}
+
+compact_prompts = """<image>
+任务：
+在输入图纸或零件图像中，定位并分类所有孔实例，输出紧凑 JSON 对象。
+
+1. 待检测类别（4 类）及短码
+  1.1 圆孔  (circle_hole) → C
+  1.2 腰孔  (slot_hole)   → S
+  1.3 螺纹孔(thread_hole) → T
+  1.4 矩形孔(rect_hole)   → R
+
+2. 几何定义与尺寸参数提取规则
+  2.1 圆孔
+      - 轮廓：闭合圆
+      - 尺寸参数 D：直径，单位 mm，例 18 → "18mm"
+  2.2 腰孔
+      - 轮廓：形似椭圆，两平行直边 + 两对称半圆弧
+      - 尺寸参数 W×L：直边间距 W，两圆弧中心距 L，单位 mm，例 14×30 → "14*30mm"
+  2.3 螺纹孔
+      - 轮廓：闭合圆（可见螺纹线且尺寸参数一定带有英文字母M）
+      - 尺寸参数 M：标称直径，单位 mm，例 M18 → "18mm"
+  2.4 矩形孔
+      - 轮廓：四边形（含正方形）
+      - 尺寸参数
+        ‑ 正方形：边长 A，单位 mm，例 18 → "18mm"
+        ‑ 长方形：长边x短边 LxW，单位 mm，例 20x14 → "20*14mm"
+
+3. 输出格式（单行 JSON 对象，键为类别短码，值为该类孔列表，无孔的类别不输出）
+  {"C":[[x_min,y_min,x_max,y_max,"<尺寸参数字符串>"],...],"T":[...]}
+  坐标为 0-1000 归一化整数。
+
+4. 补充规则
+  - 所有孔必须闭合可见。
+  - 图纸中孔尺寸参数可能记录为N x size,N 表示同类型尺寸的孔的个数，请注意区分。
+  - 无置信度阈值要求，但不得重复框。
+
+请按以上指令执行检测并直接返回 JSON，勿附加解释。"""
+
+
+def to_compact(holes):
+    """
+    [{"category","bbox_2d","size"}, ...] -> 紧凑格式字符串（单行，无空类别占位）
+    """
+    result = {}
+    for category in CATEGORIES:
+        rows = [list(x["bbox_2d"]) + [x["size"]] for x in holes if x["category"] == category and x["bbox_2d"]]
+        if rows:
+            result[CATEGORY_CODES[category]] = rows
+    return f"```json\n{json.dumps(result, ensure_ascii=False, separators=(',', ':'))}\n```"
+
+
+class HoleStreamParser:
+    """
+    增量解析模型输出（原格式 / 紧凑格式均可）：逐段 feed 文本，每个孔对象闭合时立即解析，
+    可通过 on_hole 回调拿到；JSON 闭合或遇到结尾 ``` 即 done。
+    重复框照常输出，累计达到 max_duplicates 次或连续 max_gap_chars 个字符没有新孔（复读/跑飞）时 aborted，
+    已解析出的孔保留。不使用 eval()
+    """
+    def __init__(self, compact=False, on_hole=None, max_duplicates=3, max_gap_chars=400):
+        self.compact = compact
+        self.on_hole = on_hole
+        self.max_duplicates = max_duplicates
+        self.max_gap_chars = max_gap_chars
+        self.holes = []
+        self.done = False
+        # 提前终止原因，正常结束为 None
+        self.aborted = None
+        self._seen = set()
+        self._duplicates = 0
+        self._head = ""
+        self._buf = ""
+        self._started = False
+        # [(括号, 起始下标, 所属 key)]
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key = None
+        self._last_progress = 0
+
+    def feed(self, text):
+        if self.done:
+            return self
+        if not self._started:
+            self._head += text
+            m = re.search(r'```json\s*', self._head)
+            if m:
+                text = self._head[m.end():]
+            elif "`" not in self._head and re.search(r'[\[{]', self._head):
+                text = self._head[re.search(r'[\[{]', self._head).start():]
+            else:
+                return self
+            self._started = True
+        start = len(self._buf)
+        self._buf += text
+        for i in range(start, len(self._buf)):
+            self._step(i, self._buf[i])
+            if self.done:
+                break
+            if i - self._last_progress > self.max_gap_chars:
+                self._abort("no_progress")
+                break
+        return self
+
+    def _step(self, i, c):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                if len(self._stack) == 1:
+                    self._key = self._buf[self._string_start + 1:i]
+            return
+        if c == '"':
+            self._in_string = True
+            self._string_start = i
+        elif c in "[{":
+            self._stack.append((c, i, self._key if len(self._stack) == 1 else None))
+        elif c in "]}":
+            if not self._stack:
+                self._abort("malformed")
+                return
+            opened, begin, key = self._stack.pop()
+            depth = len(self._stack)
+            if self.compact and opened == "[" and depth == 2:
+                self._progress(i, begin, self._stack[1][2])
+            elif not self.compact and opened == "{" and depth == 1:
+                self._progress(i, begin, None)
+            if depth == 0:
+                self.done = True
+        elif c == "`":
+            self.done = True
+
+    def _progress(self, i, begin, code):
+        self._last_progress = i
+        try:
+            item = json.loads(self._buf[begin:i + 1])
+            if self.compact:
+                hole = {"category": CODE_CATEGORIES[code], "bbox_2d": [int(v) for v in item[:4]], "size": item[4]}
+            else:
+                hole = {"category": item["category"], "bbox_2d": item.get("bbox_2d", []), "size": item.get("size", "")}
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._abort("malformed")
+            return
+        if hole["bbox_2d"]:
+            box = (hole["category"],) + tuple(hole["bbox_2d"])
+            if box in self._seen:
+                # 标注里也有合法的重复框，照常保留，只计数
+                self._duplicates += 1
+                if self._duplicates >= self.max_duplicates:
+                    self._abort("duplicate_boxes")
+                    return
+            self._seen.add(box)
+        self.holes.append(hole)
+        if self.on_hole is not None:
+            self.on_hole(hole)
+
+    def _abort(self, reason):
+        self.aborted = reason
+        self.done = True
+
+
+def parse_compact(text):
+    """
+    紧凑格式输出 -> 与原格式一致的 [{"category","bbox_2d","size"}, ...]
+    """
+    return HoleStreamParser(compact=True).feed(text).holes
+
+
+def token_report(view_path, tokenizer_path):
+    """
+    统计 view.json 中原格式与紧凑格式 assistant 输出的 token 数
+    """
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+    with open(view_path, "r", encoding="utf-8") as f:
+        view = json.load(f)
+    origin_total, compact_total = 0, 0
+    origin_max, compact_max = 0, 0
+    for sample in view:
+        target = sample["messages"][-1]["content"]
+        holes = json.loads(re.search(r'```json\s*([\s\S]*?)```', target).group(1))
+        origin = len(tokenizer(target)["input_ids"])
+        compact = len(tokenizer(to_compact(holes))["input_ids"])
+        origin_total += origin
+        compact_total += compact
+        origin_max = max(origin_max, origin)
+        compact_max = max(compact_max, compact)
+    n = len(view)
+    print(f"样本数: {n}")
+    print(f"原格式   平均 {origin_total / n:.1f} tokens，最大 {origin_max}")
+    print(f"紧凑格式 平均 {compact_total / n:.1f} tokens，最大 {compact_max}")
+    print(f"节省 {1 - compact_total / origin_total:.1%}")
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    view_path = "../view.json"
+    tokenizer_path = "/root/autodl-tmp/models/Qwen3-VL-4B-Instruct"
+    # ----------------------------
+    token_report(view_path, tokenizer_path)
@@ -0,0 +1,81 @@
+"""
+大 JSON 文件的流式读写：逐条读取顶层数组 / JSONL，逐条写出，内存占用与文件大小无关
+"""
+import json
+import re
+import textwrap
+
+_SKIP = re.compile(r'[\s,]*')
+
+
+def iter_json_array(path, chunk_size=1 << 20):
+    """逐条 yield 顶层 JSON 数组中的元素，内存中最多保留约两个 chunk"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+        started = False
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            # 剩余不足一个 chunk 时补读，并丢掉已解析的部分
+            if not eof and len(buf) - pos < chunk_size:
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = _SKIP.match(buf).end()
+            if pos >= len(buf):
+                raise ValueError(f"{path} JSON 数组未闭合")
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"{path} 不是 JSON 数组")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 单个元素超过 chunk，继续读
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield obj
+
+
+def iter_records(path):
+    """.jsonl 逐行读取，其余按顶层 JSON 数组流式读取"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(path)
+
+
+class JsonArrayWriter:
+    """逐条写出 JSON 数组，输出与 json.dump(items, f, ensure_ascii=False, indent=2) 一致"""
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def __enter__(self):
+        self.f = open(self.path, "w", encoding="utf-8")
+        self.f.write("[")
+        return self
+
+    def write(self, item):
+        self.f.write(",\n" if self.count else "\n")
+        self.f.write(textwrap.indent(json.dumps(item, ensure_ascii=False, indent=2), "  "))
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self.f.write("\n]" if self.count else "]")
+        self.f.close()
+
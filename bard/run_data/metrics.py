@@ -0,0 +1,114 @@
+"""
+检测指标：按类别统计多个 IoU 阈值下的 precision / recall / AP，以及匹配上的孔的尺寸字符串完全一致率。
+
+模型输出没有置信度，AP 的排序分数用预测在该图输出中的相对位置代替（先输出的排在前面）
+"""
+import numpy as np
+
+import geometry
+
+
+def match(gt_boxes, pred_boxes, iou_thresholds):
+    """
+    单张图、单个类别的一对一匹配：预测按顺序依次匹配 IoU 最大且尚未被占用的 GT，所有阈值同时计算。
+    返回 tp (T, P) bool 与对应的 GT 下标 (T, P)，未匹配为 -1
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    n_thr, n_pred, n_gt = len(thresholds), len(pred_boxes), len(gt_boxes)
+    tp = np.zeros((n_thr, n_pred), dtype=bool)
+    gt_index = np.full((n_thr, n_pred), -1, dtype=np.int64)
+    if not n_pred or not n_gt:
+        return tp, gt_index
+    ious = geometry.iou(pred_boxes, gt_boxes)
+    taken = np.zeros((n_thr, n_gt), dtype=bool)
+    rows = np.arange(n_thr)
+    for p in range(n_pred):
+        candidate = np.where(taken, -1.0, ious[p][None, :])
+        best = candidate.argmax(axis=1)
+        ok = candidate[rows, best] >= thresholds
+        tp[:, p] = ok
+        gt_index[ok, p] = best[ok]
+        taken[rows[ok], best[ok]] = True
+    return tp, gt_index
+
+
+def average_precision(tp, n_gt):
+    """按分数排好序的 tp (N,) -> AP（全点插值，同 VOC2010+），没有 GT 时为 None"""
+    if n_gt == 0:
+        return None
+    if not len(tp):
+        return 0.0
+    cum_tp = np.cumsum(tp)
+    precision = cum_tp / np.arange(1, len(tp) + 1)
+    recall = cum_tp / n_gt
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return float(np.sum(np.diff(recall, prepend=0.0) * precision))
+
+
+class DetectionMetrics:
+    """逐张图 add(gt, pred)（均为 [{"category","bbox_2d","size"}, ...]，同一坐标系），最后 summary()"""
+    def __init__(self, iou_thresholds=(0.5, 0.75)):
+        self.iou_thresholds = list(iou_thresholds)
+        self.stats = {}
+
+    def _stat(self, category):
+        return self.stats.setdefault(category, {"n_gt": 0, "tp": [], "score": [], "size_total": 0, "size_ok": 0})
+
+    def add(self, gt, pred):
+        gt = [x for x in gt if x["bbox_2d"]]
+        pred = [x for x in pred if x["bbox_2d"]]
+        for category in dict.fromkeys([x["category"] for x in gt + pred]):
+            g = [x for x in gt if x["category"] == category]
+            p = [x for x in pred if x["category"] == category]
+            tp, gt_index = match([x["bbox_2d"] for x in g], [x["bbox_2d"] for x in p], self.iou_thresholds)
+            stat = self._stat(category)
+            stat["n_gt"] += len(g)
+            stat["tp"].append(tp)
+            stat["score"].append(-np.arange(len(p)) / max(len(p), 1))
+            # 尺寸一致率按第一个 IoU 阈值的匹配统计
+            for k, j in enumerate(gt_index[0]):
+                if j >= 0:
+                    stat["size_total"] += 1
+                    stat["size_ok"] += p[k]["size"] == g[j]["size"]
+
+    def summary(self):
+        per_class = {}
+        total_gt = total_pred = size_total = size_ok = 0
+        total_tp = np.zeros(len(self.iou_thresholds), dtype=np.int64)
+        for category, stat in self.stats.items():
+            tp = np.concatenate(stat["tp"], axis=1)
+            order = np.argsort(-np.concatenate(stat["score"]), kind="stable")
+            tp = tp[:, order]
+            n_pred = tp.shape[1]
+            per_class[category] = {
+                "n_gt": stat["n_gt"],
+                "n_pred": n_pred,
+                "size_match": stat["size_ok"] / stat["size_total"] if stat["size_total"] else None,
+                "iou": {
+                    str(thr): {
+                        "precision": float(tp[t].sum() / n_pred) if n_pred else 0.0,
+                        "recall": float(tp[t].sum() / stat["n_gt"]) if stat["n_gt"] else None,
+                        "ap": average_precision(tp[t], stat["n_gt"]),
+                    }
+                    for t, thr in enumerate(self.iou_thresholds)
+                },
+            }
+            total_gt += stat["n_gt"]
+            total_pred += n_pred
+            total_tp += tp.sum(axis=1)
+            size_total += stat["size_total"]
+            size_ok += stat["size_ok"]
+        overall = {
+            "n_gt": total_gt,
+            "n_pred": total_pred,
+            "size_match": size_ok / size_total if size_total else None,
+            "iou": {},
+        }
+        for t, thr in enumerate(self.iou_thresholds):
+            aps = [x["iou"][str(thr)]["ap"] for x in per_class.values() if x["n_gt"]]
+            overall["iou"][str(thr)] = {
+                "precision": float(total_tp[t] / total_pred) if total_pred else 0.0,
+                "recall": float(total_tp[t] / total_gt) if total_gt else None,
+                "map": float(np.mean(aps)) if aps else None,
+            }
+        return {"per_class": per_class, "overall": overall}
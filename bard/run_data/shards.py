@@ -0,0 +1,125 @@
+"""
+把 view.jsonl 引用的零散图片打包成少量大分片 + 偏移索引，训练时按索引 mmap 读取，
+避免 gcsfuse 上逐文件 open/fetch 的延迟。
+
+分片内每张图可存 PNG（压缩）或 raw（解码后的 uint8 RGB，读取时免解码），可选打包前按 smart_resize 预缩放。
+索引 index.json: {"version": 1, "entries": {图片相对路径: [分片号, 偏移, 长度, 格式, 高, 宽]}}
+"""
+import io
+import json
+import mmap
+import os
+import numpy as np
+from PIL import Image
+
+import geometry
+from jsonstream import iter_records
+
+INDEX_NAME = "index.json"
+
+
+def shard_name(n):
+    return f"shard-{n:05d}.bin"
+
+
+def encode_image(img, fmt):
+    """PIL 图片 -> 分片中存储的字节"""
+    img = img.convert("RGB")
+    if fmt == "raw":
+        return np.asarray(img, dtype=np.uint8).tobytes()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def pack(jsonl_paths, root, out_dir, fmt="png", shard_bytes=1 << 30, max_pixels=None):
+    """
+    按 jsonl 中出现的顺序把图片写入分片（训练时基本是顺序读），同一图片只写一次。
+    max_pixels 不为空时按 smart_resize(factor=32) 预缩放，bbox 为 0-1000 归一化坐标，不受缩放影响
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    entries = {}
+    shard, f = 0, open(os.path.join(out_dir, shard_name(0)), "wb")
+    try:
+        for jsonl_path in jsonl_paths:
+            for record in iter_records(jsonl_path):
+                for key in record["images"]:
+                    key = key["path"] if isinstance(key, dict) else key
+                    if key in entries:
+                        continue
+                    img = Image.open(os.path.join(root, key))
+                    if max_pixels:
+                        new_h, new_w = geometry.smart_resize(img.height, img.width, factor=32, min_pixels=32 * 32, max_pixels=max_pixels)
+                        if (new_w, new_h) != img.size:
+                            img = img.resize((new_w, new_h))
+                    data = encode_image(img, fmt)
+                    if f.tell() and f.tell() + len(data) > shard_bytes:
+                        f.close()
+                        shard += 1
+                        f = open(os.path.join(out_dir, shard_name(shard)), "wb")
+                    entries[key] = [shard, f.tell(), len(data), fmt, img.height, img.width]
+                    f.write(data)
+    finally:
+        f.close()
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as fi:
+        json.dump({"version": 1, "entries": entries}, fi, ensure_ascii=False)
+    os.replace(index_path + ".tmp", index_path)
+    total = sum(x[2] for x in entries.values())
+    print(f"{len(entries)} 张图片 -> {shard + 1} 个分片，共 {total / (1 << 20):.1f} MB")
+    return entries
+
+
+class ShardStore:
+    """按 index.json 从分片中读取图片，分片在每个进程内首次访问时 mmap（兼容 dataloader 多进程 fork）"""
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+            self.entries = json.load(f)["entries"]
+        self._maps = {}
+        self._pid = os.getpid()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _map(self, shard):
+        if self._pid != os.getpid():
+            self._maps, self._pid = {}, os.getpid()
+        if shard not in self._maps:
+            with open(os.path.join(self.store_dir, shard_name(shard)), "rb") as f:
+                self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def get(self, key):
+        """图片相对路径 -> PIL RGB 图片"""
+        shard, offset, length, fmt, height, width = self.entries[key]
+        mm = self._map(shard)
+        if fmt == "raw":
+            pixels = np.frombuffer(mm, dtype=np.uint8, count=length, offset=offset)
+            return Image.fromarray(pixels.reshape(height, width, 3).copy())
+        return Image.open(io.BytesIO(mm[offset:offset + length])).convert("RGB")
+
+
+_stores = {}
+
+
+def open_store(store_dir):
+    """同一目录只加载一次索引"""
+    if store_dir not in _stores:
+        _stores[store_dir] = ShardStore(store_dir)
+    return _stores[store_dir]
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    jsonl_paths = ["../view.jsonl", "../view_ex.jsonl"]
+    # 图片相对路径的根目录
+    root = ".."
+    out_dir = "../shards"
+    # "png" 体积小；"raw" 读取免解码，体积约为 png 的数倍
+    fmt = "png"
+    shard_bytes = 1 << 30
+    # 预缩放上限，对应 IMAGE_MAX_TOKEN_NUM=1280；None 表示保持原尺寸
+    max_pixels = 1280 * 32 * 32
+    # ----------------------------
+    pack(jsonl_paths, root, out_dir, fmt, shard_bytes, max_pixels)
@@ -0,0 +1,348 @@
+"""
+进程内的对象存储下载（s3:// / gs:// / file://），替代逐个 URL 起 `aws s3 cp` 子进程。
+
+- 每种存储一个 client，连接池大小与并发数一致，TLS 连接复用；asyncio + Semaphore 限制同时下载数
+- 本地文件大小与远端一致，且 ETag 与上次 manifest 记录一致（无记录时比较 MD5）则跳过
+- 先写 <目标>.part，旁边 <目标>.part.json 记录远端 ETag；中断后 ETag 未变则用 Range 从断点续传
+- 下载时同时算 MD5，远端提供 MD5（S3 单段上传的 ETag / GCS md5Hash）时校验，不一致删掉重下
+- 失败按指数退避 + 抖动重试；每个 URL 的结果追加写入 manifest.jsonl
+
+上传（put）同样按块并行，并把 MD5 写进对象元数据，供 stat 判断文件是否变化（分段上传的 ETag 不是 MD5）。
+boto3 / google-cloud-storage 只在用到对应协议时 import
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+CHUNK = 8 << 20
+# 上传时超过该大小的文件分块并行
+PART_SIZE = 64 << 20
+MANIFEST = "manifest.jsonl"
+
+
+class FileBackend:
+    """file:// 与本地路径，用于测试；ETag 即文件 MD5"""
+    def __init__(self, max_connections):
+        pass
+
+    @staticmethod
+    def _path(url):
+        return urlparse(url).path if url.startswith("file://") else url
+
+    def stat(self, url):
+        path = self._path(url)
+        md5 = file_md5(path)
+        return {"size": os.path.getsize(path), "etag": md5, "md5": md5}
+
+    def read(self, url, offset, f):
+        with open(self._path(url), "rb") as src:
+            src.seek(offset)
+            for chunk in iter(lambda: src.read(CHUNK), b""):
+                f.write(chunk)
+
+    def list(self, url):
+        root = self._path(url)
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                yield "file://" + os.path.abspath(path), os.path.relpath(path, root)
+
+    def put(self, local_path, url, md5, workers=8):
+        """分块多线程 pwrite 到临时文件，完成后原子 rename"""
+        dest = self._path(url)
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        size = os.path.getsize(local_path)
+        tmp = f"{dest}.uploading"
+        src_fd = os.open(local_path, os.O_RDONLY)
+        dst_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(dst_fd, size)
+
+            def copy(offset):
+                end = min(offset + PART_SIZE, size)
+                while offset < end:
+                    data = os.pread(src_fd, min(CHUNK, end - offset), offset)
+                    if not data:
+                        raise IOError(f"{local_path} 在上传过程中被截断")
+                    os.pwrite(dst_fd, data, offset)
+                    offset += len(data)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for fut in as_completed([pool.submit(copy, x) for x in range(0, size, PART_SIZE)]):
+                    fut.result()
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+        os.replace(tmp, dest)
+
+    def delete(self, url):
+        os.remove(self._path(url))
+
+
+class S3Backend:
+    def __init__(self, max_connections):
+        import boto3
+        from botocore.config import Config
+        # 重试由 fetch 自己做（带断点），SDK 只做连接池
+        self.client = boto3.client("s3", config=Config(max_pool_connections=max_connections, retries={"max_attempts": 1}))
+
+    @staticmethod
+    def _split(url):
+        u = urlparse(url)
+        return u.netloc, u.path.lstrip("/")
+
+    def stat(self, url):
+        bucket, key = self._split(url)
+        head = self.client.head_object(Bucket=bucket, Key=key)
+        etag = head["ETag"].strip('"')
+        # 分段上传的 ETag 形如 "<hash>-<段数>"，不是文件 MD5，此时用 put 写入的元数据
+        md5 = head.get("Metadata", {}).get("md5") or (None if "-" in etag else etag)
+        return {"size": head["ContentLength"], "etag": etag, "md5": md5}
+
+    def read(self, url, offset, f):
+        bucket, key = self._split(url)
+        kwargs = {"Range": f"bytes={offset}-"} if offset else {}
+        body = self.client.get_object(Bucket=bucket, Key=key, **kwargs)["Body"]
+        for chunk in body.iter_chunks(CHUNK):
+            f.write(chunk)
+
+    def list(self, url):
+        bucket, prefix = self._split(url)
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith("/"):
+                    yield f"s3://{bucket}/{obj['Key']}", obj["Key"][len(prefix):].lstrip("/")
+
+    def put(self, local_path, url, md5, workers=8):
+        from boto3.s3.transfer import TransferConfig
+        bucket, key = self._split(url)
+        config = TransferConfig(multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE, max_concurrency=workers)
+        self.client.upload_file(local_path, bucket, key, ExtraArgs={"Metadata": {"md5": md5}}, Config=config)
+
+    def delete(self, url):
+        bucket, key = self._split(url)
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+
+class GCSBackend:
+    def __init__(self, max_connections):
+        import requests
+        from google.cloud import storage
+        self.client = storage.Client()
+        # 默认连接池只有 10 个连接，按并发数放大
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.client._http.mount("https://", adapter)
+
+    def _blob(self, url):
+        u = urlparse(url)
+        return self.client.bucket(u.netloc).blob(u.path.lstrip("/"))
+
+    def stat(self, url):
+        blob = self._blob(url)
+        blob.reload()
+        # 分块上传（XML multipart）的对象没有 md5Hash，此时用 put 写入的元数据
+        md5 = (blob.metadata or {}).get("md5") or (base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None)
+        return {"size": blob.size, "etag": blob.etag, "md5": md5}
+
+    def read(self, url, offset, f):
+        self._blob(url).download_to_file(f, start=offset or None, raw_download=True)
+
+    def list(self, url):
+        u = urlparse(url)
+        prefix = u.path.lstrip("/")
+        for blob in self.client.list_blobs(u.netloc, prefix=prefix):
+            if not blob.name.endswith("/"):
+                yield f"gs://{u.netloc}/{blob.name}", blob.name[len(prefix):].lstrip("/")
+
+    def put(self, local_path, url, md5, workers=8):
+        from google.cloud.storage import transfer_manager
+        blob = self._blob(url)
+        blob.metadata = {"md5": md5}
+        if os.path.getsize(local_path) <= PART_SIZE:
+            blob.upload_from_filename(local_path)
+        else:
+            transfer_manager.upload_chunks_concurrently(
+                local_path, blob, chunk_size=PART_SIZE, max_workers=workers, worker_type=transfer_manager.THREAD)
+
+    def delete(self, url):
+        self._blob(url).delete()
+
+
+BACKENDS = {"s3": S3Backend, "gs": GCSBackend, "file": FileBackend, "": FileBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def backend(url, max_connections=32):
+    """按协议取（并缓存）backend，同一协议共享一个 client / 连接池"""
+    scheme = urlparse(url).scheme
+    with _backends_lock:
+        if scheme not in _backends:
+            _backends[scheme] = BACKENDS[scheme](max_connections)
+        return _backends[scheme]
+
+
+def file_md5(path, h=None):
+    h = h or hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashingWriter:
+    """写文件的同时累计 MD5 与字节数"""
+    def __init__(self, f, h):
+        self.f = f
+        self.h = h
+        self.n = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.h.update(data)
+        self.n += len(data)
+
+
+def load_manifest(path):
+    """url -> 最近一次成功（ok / skipped）的记录"""
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["status"] != "failed":
+                    done[record["url"]] = record
+    return done
+
+
+def download(url, dest, previous=None, max_connections=32):
+    """
+    单个 URL 下载到 dest（同步，在线程池中执行）。
+    返回 {"status": "ok" / "skipped", "size", "etag", "md5", "bytes": 本次实际传输字节数}
+    """
+    store = backend(url, max_connections)
+    remote = store.stat(url)
+    result = {"size": remote["size"], "etag": remote["etag"], "md5": remote["md5"], "bytes": 0}
+    if os.path.exists(dest) and os.path.getsize(dest) == remote["size"]:
+        if previous and previous.get("path") == dest and previous.get("etag") == remote["etag"]:
+            return dict(result, status="skipped")
+        if remote["md5"] and file_md5(dest) == remote["md5"]:
+            return dict(result, status="skipped")
+
+    part, part_meta = dest + ".part", dest + ".part.json"
+    h = hashlib.md5()
+    offset = 0
+    if os.path.exists(part) and os.path.exists(part_meta):
+        with open(part_meta, "r", encoding="utf-8") as f:
+            if json.load(f).get("etag") == remote["etag"]:
+                offset = os.path.getsize(part)
+    if offset > remote["size"]:
+        offset = 0
+    if offset:
+        file_md5(part, h)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        with open(part_meta, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "etag": remote["etag"]}, f)
+    with open(part, "ab" if offset else "wb") as f:
+        writer = HashingWriter(f, h)
+        if offset < remote["size"]:
+            store.read(url, offset, writer)
+    result["bytes"] = writer.n
+    size = os.path.getsize(part)
+    md5 = h.hexdigest()
+    if size != remote["size"] or (remote["md5"] and md5 != remote["md5"]):
+        # 续传的前半段可能已损坏，整个丢掉重下
+        os.remove(part)
+        raise IOError(f"校验失败: 大小 {size}/{remote['size']}，md5 {md5}/{remote['md5']}")
+    os.replace(part, dest)
+    os.remove(part_meta)
+    return dict(result, md5=md5, status="ok")
+
+
+def download_retry(url, dest, retry=5, backoff=1.0, max_backoff=60.0, max_connections=32):
+    """同步版带退避重试的 download，供调用方在自己的线程池中使用"""
+    for attempt in range(1, retry + 1):
+        try:
+            return download(url, dest, max_connections=max_connections)
+        except Exception:
+            if attempt == retry:
+                raise
+            time.sleep(min(backoff * 2 ** (attempt - 1), max_backoff) * random.uniform(0.5, 1.5))
+
+
+def expand(urls, out_dir, max_connections=32):
+    """
+    URL -> [(url, 本地路径)]：以 / 结尾的视为前缀，列出其下所有对象并保留相对路径，
+    其余按文件名放在 out_dir 下（与 aws s3 cp <url> <目录> 一致）
+    """
+    pairs = []
+    for url in urls:
+        if url.endswith("/"):
+            pairs += [(u, os.path.join(out_dir, rel)) for u, rel in backend(url, max_connections).list(url)]
+        else:
+            pairs.append((url, os.path.join(out_dir, os.path.basename(urlparse(url).path))))
+    return pairs
+
+
+async def fetch_all_async(urls, out_dir, concurrency=32, retry=5, backoff=1.0, max_backoff=60.0, manifest_path=None):
+    manifest_path = manifest_path or os.path.join(out_dir, MANIFEST)
+    os.makedirs(out_dir, exist_ok=True)
+    previous = load_manifest(manifest_path)
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    sem = asyncio.Semaphore(concurrency)
+    counts = {"ok": 0, "skipped": 0, "failed": 0}
+    transferred = 0
+    t0 = time.perf_counter()
+    pairs = await loop.run_in_executor(pool, expand, urls, out_dir, concurrency)
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        async def one(url, dest):
+            nonlocal transferred
+            async with sem:
+                t1 = time.perf_counter()
+                record = {"url": url, "path": dest}
+                for attempt in range(1, retry + 1):
+                    try:
+                        record.update(await loop.run_in_executor(pool, download, url, dest, previous.get(url), concurrency))
+                        break
+                    except Exception as e:
+                        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+                        if attempt < retry:
+                            await asyncio.sleep(min(backoff * 2 ** (attempt - 1), max_backoff) * random.uniform(0.5, 1.5))
+                record.update(attempts=attempt, seconds=round(time.perf_counter() - t1, 3))
+                if record["status"] != "failed":
+                    record.pop("error", None)
+                counts[record["status"]] += 1
+                transferred += record.get("bytes", 0)
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                manifest.flush()
+                if record["status"] == "failed":
+                    print(f"[FAIL] {url} {record['error']}")
+                done = sum(counts.values())
+                if done % 100 == 0 or done == len(pairs):
+                    elapsed = time.perf_counter() - t0
+                    print(f"{done}/{len(pairs)}  下载 {counts['ok']} 跳过 {counts['skipped']} 失败 {counts['failed']}  "
+                          f"{transferred / (1 << 20) / max(elapsed, 1e-6):.1f} MB/s")
+                return record
+
+        records = await asyncio.gather(*(one(url, dest) for url, dest in pairs))
+    pool.shutdown()
+    return records
+
+
+def fetch_all(urls, out_dir, concurrency=32, retry=5, **kwargs):
+    """同步入口，返回每个 URL 的记录（同 manifest.jsonl 中的一行）"""
+    return asyncio.run(fetch_all_async(urls, out_dir, concurrency, retry, **kwargs))
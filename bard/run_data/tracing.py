@@ -0,0 +1,196 @@
+"""
+轻量的分阶段计时 / 内存埋点，推理（eval.py）和数据处理（dataprocess.py）共用。
+
+with span("prefill"): ... 记录该阶段耗时，按阶段名汇总成直方图；
+设置环境变量 TRACE_PATH 时每个 span 追加一行 JSON（多进程各自追加同一文件），
+最外层 span 附带进程峰值 RSS 与 GPU 峰值显存；serve_metrics(port) 以 Prometheus 文本格式暴露汇总结果。
+每条记录带 run（同一次运行的子进程继承），report() 按 run 汇总，便于对比两次运行
+"""
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 直方图桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_local = threading.local()
+_histograms = {}
+_counters = {}
+_file = None
+_file_pid = None
+# 本次运行的标识，子进程通过环境变量继承
+RUN_ID = os.environ.setdefault("TRACE_RUN", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+
+def memory():
+    """进程峰值 RSS、GPU 峰值显存（字节，未 import torch 或无 GPU 时不含）"""
+    result = {"cpu_peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        result["gpu_peak_allocated"] = torch.cuda.max_memory_allocated()
+    return result
+
+
+def _write(record):
+    global _file, _file_pid
+    path = os.environ.get("TRACE_PATH")
+    if not path:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        # fork 出的子进程重新打开，避免共用父进程的缓冲区
+        if _file is None or _file_pid != os.getpid():
+            _file = open(path, "a", encoding="utf-8", buffering=1)
+            _file_pid = os.getpid()
+        _file.write(line)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def count(name, value=1):
+    """累加计数器（如生成 token 数）"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counter(name):
+    """计数器当前值，未计数时为 0"""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name, seconds, **attrs):
+    """记录一段已测得的耗时（如从 streamer 时间戳推出的 prefill / decode）"""
+    with _lock:
+        h = _histograms.setdefault(name, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h["buckets"][i] += 1
+        h["sum"] += seconds
+        h["count"] += 1
+    stack = _stack()
+    record = {
+        "span": name,
+        "run": RUN_ID,
+        "ts": time.time() - seconds,
+        "ms": seconds * 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "parent": stack[-1] if stack else None,
+        **attrs,
+    }
+    if not stack:
+        record.update(memory())
+    _write(record)
+
+
+@contextlib.contextmanager
+def span(name, sync=None, **attrs):
+    """
+    计时一个阶段。yield 出的 dict 可在块内补充字段（如 token 数），一并写入 trace。
+    sync 在计时结束前调用（GPU 上传 torch.cuda.synchronize，否则只统计到 kernel 提交）
+    """
+    stack = _stack()
+    stack.append(name)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        if sync is not None:
+            sync()
+        seconds = time.perf_counter() - t0
+        stack.pop()
+        observe(name, seconds, **attrs)
+
+
+def summary():
+    """按阶段打印次数、总耗时、平均耗时"""
+    with _lock:
+        items = sorted(_histograms.items(), key=lambda x: -x[1]["sum"])
+        counters = dict(_counters)
+    for name, h in items:
+        print(f"  {name:<16} {h['count']:>6} 次  共 {h['sum']:.2f}s  平均 {h['sum'] / h['count'] * 1000:.1f}ms")
+    for name, value in counters.items():
+        print(f"  {name:<16} {value}")
+    mem = memory()
+    print(f"  峰值 RSS {mem['cpu_peak_rss'] / (1 << 30):.2f} GB" + (
+        f"，峰值显存 {mem['gpu_peak_allocated'] / (1 << 30):.2f} GB" if "gpu_peak_allocated" in mem else ""))
+
+
+def report(path, run=None):
+    """汇总 trace 文件中某次运行（默认最后一次）各阶段的次数、总耗时与 p50 / p95"""
+    spans = {}
+    runs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            runs[record.get("run")] = True
+            spans.setdefault(record.get("run"), {}).setdefault(record["span"], []).append(record["ms"])
+    run = run or list(runs)[-1]
+    print(f"{path} run={run}")
+    for name, values in sorted(spans.get(run, {}).items(), key=lambda x: -sum(x[1])):
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(int(len(values) * 0.95), len(values) - 1)]
+        print(f"  {name:<16} {len(values):>6} 次  共 {sum(values) / 1000:.2f}s  p50 {p50:.1f}ms  p95 {p95:.1f}ms")
+
+
+def prometheus_text(prefix="hole"):
+    """Prometheus 文本格式（0.0.4）"""
+    lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+    with _lock:
+        for name, h in _histograms.items():
+            for bound, n in zip(BUCKETS, h["buckets"]):
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {h["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {h["count"]}')
+        for name, value in _counters.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in memory().items():
+        lines.append(f"# TYPE {prefix}_{name}_bytes gauge")
+        lines.append(f"{prefix}_{name}_bytes {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """后台线程提供 GET /metrics（Prometheus 格式）；默认只监听本机，需要远端抓取时由调用方传 host 为 0.0.0.0"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # ---------- 参数区 ----------
+    trace_path = "trace.jsonl"
+    # None 为最后一次运行
+    run = None
+    # ----------------------------
+    report(trace_path, run)
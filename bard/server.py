@@ -0,0 +1,317 @@
+"""
+常驻 HTTP 推理服务：模型只在启动时加载一次（import eval），复用 eval.py 的 prepare_batch / generate_batch。
+
+请求先进有界队列，满了直接返回 503（背压，调用方按 Retry-After 重试）；
+组批线程取到第一个请求后最多再等 MAX_WAIT_MS 凑满 MAX_BATCH，做 CPU 预处理后交给 GPU 线程，
+预处理与 GPU 解码重叠；解析和坐标换算在各自的请求线程里做。
+
+POST /detect   body 为 {"image": "<base64>", "adapter": "..."}，或 {"image_path": "...", "adapter": "..."}
+               （仅在配置了 IMAGE_ROOT 时可用，只能读 IMAGE_ROOT 下的文件），
+               也可以直接 POST 图片字节（adapter 放在 X-Adapter 头里）；adapter 省略时用默认 adapter
+    -> {"width", "height", "holes": [{"category", "bbox": [x1, y1, x2, y2]（原图像素）, "size"}], "adapter", "queue_ms", "latency_ms"}
+GET  /health   -> {"status": "ok", "queue": 排队数}
+GET  /metrics  -> 请求数、拒绝数、失败数、batch 大小、延迟分位数
+GET  /metrics/prometheus -> 各推理阶段耗时直方图、生成 token 数、峰值内存（Prometheus 文本格式，见 run_data/tracing.py）
+GET  /adapters -> {"adapters": [...], "default": ...}
+POST /adapters {"name": "..."} 按名字挂载或热更新 eval.ADAPTER_DIR 下的 checkpoint（只接受扫描到的名字，不接受路径）
+POST /adapters/reload 重新扫描 eval.ADAPTER_DIR：挂载新 checkpoint、热更新变化的、卸载已删除的
+DELETE /adapters/<name> 卸载 adapter
+同一 batch 只包含同一 adapter 的请求。
+服务没有鉴权，默认只监听 127.0.0.1，对外提供时放在带鉴权的反向代理后面
+"""
+import base64
+import collections
+import copy
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+
+import eval as ev
+from adapters import BASE
+from run_data import geometry, tracing
+from run_data.hole_format import compact_prompts
+
+# ---------- 参数区 ----------
+HOST = "127.0.0.1"
+PORT = 8000
+# 每批最多图片数、凑批最长等待（毫秒）
+MAX_BATCH = 8
+MAX_WAIT_MS = 20
+# 排队上限，超过后新请求直接返回 503
+MAX_QUEUE = 64
+# 单个请求从入队到出结果的超时（秒）
+REQUEST_TIMEOUT = 300
+# 延迟分位数统计最近多少个请求
+LATENCY_WINDOW = 1000
+# 允许以 image_path 读取的图片根目录（None 为不允许按路径读图，只接受图片内容）
+IMAGE_ROOT = None
+# ----------------------------
+
+
+class Job:
+    def __init__(self, image, adapter=None):
+        self.image = image
+        self.adapter = adapter
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+        self.started = None
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.batches = 0
+        self.batched_images = 0
+        self.latency = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, latency):
+        with self.lock:
+            self.latency.append(latency)
+
+    def snapshot(self, queue_size):
+        with self.lock:
+            latency = np.array(self.latency) if self.latency else np.zeros(1)
+            return {
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "queue": queue_size,
+                "batches": self.batches,
+                "avg_batch_size": self.batched_images / max(self.batches, 1),
+                "latency_ms": {
+                    f"p{p}": float(np.percentile(latency, p) * 1000) for p in (50, 95, 99)
+                },
+            }
+
+
+class Detector:
+    """组批线程（CPU 预处理）+ GPU 线程，两段之间用长度为 1 的队列衔接"""
+    def __init__(self, prompts):
+        self.prompts = prompts
+        self.jobs = queue.Queue(maxsize=MAX_QUEUE)
+        self.ready = queue.Queue(maxsize=1)
+        self.metrics = Metrics()
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        threading.Thread(target=self._gpu_loop, daemon=True).start()
+
+    def submit(self, image, adapter=None):
+        """入队，队列满时抛 queue.Full"""
+        job = Job(image, adapter)
+        with self.metrics.lock:
+            self.metrics.requests += 1
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.metrics.lock:
+                self.metrics.rejected += 1
+            raise
+        return job
+
+    def _collect(self):
+        batch = [self.jobs.get()]
+        deadline = time.perf_counter() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.jobs.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        local_processor = copy.deepcopy(ev.processor)
+        while True:
+            groups = {}
+            for job in self._collect():
+                groups.setdefault(job.adapter, []).append(job)
+            for adapter, batch in groups.items():
+                try:
+                    inputs = ev.prepare_batch([job.image for job in batch], self.prompts, local_processor)
+                except Exception:
+                    # 整批预处理失败（如某张图损坏）时逐张重试，只让出错的请求失败
+                    for job in batch:
+                        try:
+                            inputs = ev.prepare_batch([job.image], self.prompts, local_processor)
+                        except Exception as e:
+                            job.future.set_exception(e)
+                            continue
+                        self.ready.put(([job], inputs, adapter))
+                    continue
+                self.ready.put((batch, inputs, adapter))
+
+    def _gpu_loop(self):
+        while True:
+            batch, inputs, adapter = self.ready.get()
+            started = time.perf_counter()
+            for job in batch:
+                job.started = started
+            with self.metrics.lock:
+                self.metrics.batches += 1
+                self.metrics.batched_images += len(batch)
+            try:
+                resps = ev.generate_batch(inputs, adapter=adapter)
+            except Exception as e:
+                for job in batch:
+                    job.future.set_exception(e)
+                continue
+            for job, resp in zip(batch, resps):
+                job.future.set_result(resp)
+
+    def detect(self, image, adapter=None):
+        """阻塞直到出结果，返回 JSON 可序列化的 dict"""
+        job = self.submit(image, adapter)
+        resp = job.future.result(timeout=REQUEST_TIMEOUT)
+        width, height = geometry.image_size(image) if isinstance(image, str) else image.size
+        holes = ev.page_holes(ev.parse_output(resp), width, height)
+        latency = time.perf_counter() - job.enqueued
+        self.metrics.observe(latency)
+        return {
+            "width": width,
+            "height": height,
+            "holes": holes,
+            "adapter": adapter,
+            "queue_ms": (job.started - job.enqueued) * 1000,
+            "latency_ms": latency * 1000,
+        }
+
+
+def read_body(handler):
+    return handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+
+
+def image_root_path(path):
+    """image_path -> IMAGE_ROOT 下的真实路径（相对路径相对 IMAGE_ROOT），越出 IMAGE_ROOT 时报错"""
+    if IMAGE_ROOT is None:
+        raise ValueError("未配置 IMAGE_ROOT，不支持 image_path，请直接上传图片")
+    root = os.path.realpath(IMAGE_ROOT)
+    real = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, real]) != root:
+        raise ValueError(f"image_path 不在 IMAGE_ROOT 下: {path}")
+    return real
+
+
+def read_image(handler):
+    """请求体 -> (图片路径或 PIL 图片, adapter 名)"""
+    body = read_body(handler)
+    adapter = handler.headers.get("X-Adapter")
+    if handler.headers.get("Content-Type", "").startswith("application/json"):
+        payload = json.loads(body)
+        adapter = payload.get("adapter", adapter)
+        if "image_path" in payload:
+            return image_root_path(payload["image_path"]), adapter
+        body = base64.b64decode(payload["image"])
+    return Image.open(io.BytesIO(body)).convert("RGB"), adapter
+
+
+def make_handler(detector):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, code, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok", "queue": detector.jobs.qsize()})
+            elif self.path == "/metrics":
+                self.send_json(200, detector.metrics.snapshot(detector.jobs.qsize()))
+            elif self.path == "/metrics/prometheus":
+                body = tracing.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == "/adapters":
+                self.send_json(200, {"adapters": ev.adapters.names(), "default": ev.adapters.default})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_DELETE(self):
+            if not self.path.startswith("/adapters/"):
+                self.send_json(404, {"error": "not found"})
+                return
+            try:
+                ev.adapters.unload(self.path[len("/adapters/"):])
+            except KeyError as e:
+                self.send_json(404, {"error": str(e)})
+                return
+            self.send_json(200, {"adapters": ev.adapters.names(), "default": ev.adapters.default})
+
+        def load_adapter(self):
+            try:
+                payload = json.loads(read_body(self))
+                ev.adapters.load_discovered(payload["name"])
+            except Exception as e:
+                self.send_json(400, {"error": f"加载 adapter 失败: {e}"})
+                return
+            self.send_json(200, {"adapters": ev.adapters.names(), "default": ev.adapters.default})
+
+        def reload_adapters(self):
+            try:
+                changed = ev.adapters.sync()
+            except Exception as e:
+                self.send_json(400, {"error": f"重新扫描 adapter 失败: {e}"})
+                return
+            self.send_json(200, {**changed, "adapters": ev.adapters.names(), "default": ev.adapters.default})
+
+        def do_POST(self):
+            if self.path == "/adapters":
+                self.load_adapter()
+                return
+            if self.path == "/adapters/reload":
+                self.reload_adapters()
+                return
+            if self.path != "/detect":
+                self.send_json(404, {"error": "not found"})
+                return
+            try:
+                image, adapter = read_image(self)
+            except Exception as e:
+                self.send_json(400, {"error": f"无法读取图片: {e}"})
+                return
+            adapter = adapter or ev.adapters.default
+            if adapter not in (None, BASE) and adapter not in ev.adapters.paths:
+                self.send_json(400, {"error": f"adapter 未加载: {adapter}"})
+                return
+            try:
+                self.send_json(200, detector.detect(image, adapter))
+            except queue.Full:
+                self.send_json(503, {"error": "队列已满"}, {"Retry-After": "1"})
+            except FutureTimeout:
+                with detector.metrics.lock:
+                    detector.metrics.failed += 1
+                self.send_json(504, {"error": "推理超时"})
+            except Exception as e:
+                with detector.metrics.lock:
+                    detector.metrics.failed += 1
+                self.send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    detector = Detector(compact_prompts if ev.COMPACT else ev.prompts)
+    server = ThreadingHTTPServer((HOST, PORT), make_handler(detector))
+    print(f"listening on {HOST}:{PORT}")
+    server.serve_forever()
@@ -0,0 +1,71 @@
+"""
+swift sft 的自定义数据集：--custom_register_path swift_augment.py --dataset view_aug
+
+在 view.jsonl 的基础上按 AUGMENT_TRANSFORMS（逗号分隔，见 run_data/augment.py 的 TRANSFORMS）
+把每条样本展开成多条，bbox_2d 在数据集预处理时变换，图片在 template 加载时才旋转/翻转，
+不需要 train_data_ex 这类预先落盘的增强图片。
+设置 SHARD_STORE 时图片从 run_data/shards.py 打包的分片中 mmap 读取
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_data"))
+
+from swift.llm import DatasetMeta, RowPreprocessor, register_dataset
+from swift.llm.template import base as template_base
+from swift.llm.template import vision_utils
+
+from PIL import Image
+
+from augment import augment_sample, load_augmented, split_augmented_path
+from shards import open_store
+
+AUGMENT_DATASET = os.environ.get("AUGMENT_DATASET", "view.jsonl")
+AUGMENT_TRANSFORMS = os.environ.get("AUGMENT_TRANSFORMS", "identity,rot90").split(",")
+SHARD_STORE = os.environ.get("SHARD_STORE")
+
+store = open_store(SHARD_STORE) if SHARD_STORE else None
+
+
+def open_image(path):
+    if store is not None and path in store:
+        return store.get(path)
+    return Image.open(path).convert("RGB")
+
+
+def image_size(path):
+    """分片中的图片可能已预缩放，尺寸以索引为准"""
+    if store is not None and path in store:
+        height, width = store.entries[path][4:6]
+        return width, height
+    with Image.open(path) as img:
+        return img.size
+
+
+class AugmentPreprocessor(RowPreprocessor):
+    """一条样本 -> 每个变换一条样本"""
+    def preprocess(self, row):
+        return augment_sample(row, AUGMENT_TRANSFORMS, image_size=image_size)
+
+
+_load_image = vision_utils.load_image
+
+
+def load_image(image, *args, **kwargs):
+    """识别 "<路径>#<变换名>" 和分片中的图片，读取原图后做变换，其余情况交给 swift 原实现"""
+    if isinstance(image, str):
+        base, name = split_augmented_path(image)
+        if name != "identity" or (store is not None and base in store):
+            image = load_augmented(image, open_image)
+    return _load_image(image, *args, **kwargs)
+
+
+vision_utils.load_image = load_image
+template_base.load_image = load_image
+
+register_dataset(
+    DatasetMeta(
+        dataset_name="view_aug",
+        dataset_path=os.path.abspath(AUGMENT_DATASET),
+        preprocess_func=AugmentPreprocessor(),
+    ))
@@ -25,10 +25,9 @@ ACCELERATOR_COUNT=2
 GCS_OUTPUT_PATH="gs://${PROJECT_ID}-outputs/swift-training/$(date +%Y%m%d-%H%M%S)"
 
 # 注意：
-# - 模型已打包在镜像中（/app/models/models--Qwen--Qwen3-VL-4B-Instruct）
-# - 镜像大小约 20GB+，首次构建和推送较慢（30-60分钟）
-# - 训练启动快（无需下载模型）
-# - 训练完成后自动上传输出到 GCS
+# - 模型不打包在镜像中，启动时从 gs://im-drawing-462011-models/models--Qwen--Qwen3-VL-4B-Instruct
+#   并行下载到本地缓存（bard/model_cache.py），可通过容器环境变量 MODEL_PATH 指定其他模型
+# - 训练过程中 checkpoint 在后台增量上传到 GCS（bard/ckpt_upload.py）
 
 # Service Account（使用默认的 GCS Service Account）
 SERVICE_ACCOUNT="service-1003882345878@gs-project-accounts.iam.gserviceaccount.com"
@@ -10,12 +10,26 @@ echo "Swift 训练启动 - Vertex AI"
 echo "=========================================="
 
 # 配置参数（可通过环境变量覆盖）
-# 模型已打包在镜像中
-MODEL_PATH="${MODEL_PATH:-/app/models/models--Qwen--Qwen3-VL-4B-Instruct}"
+# 模型不再打包在镜像中：gs:// / s3:// 上的 HF cache 目录或模型目录，由 bard/model_cache.py 并行拉取到本地缓存；
+# 也可以是本地路径（HF cache 目录自动解析 snapshots/）
+MODEL_PATH="${MODEL_PATH:-gs://im-drawing-462011-models/models--Qwen--Qwen3-VL-4B-Instruct}"
+# 本地 SSD 上的模型缓存，按 revision 区分，已完整下载的直接复用
+MODEL_CACHE_DIR="${MODEL_CACHE_DIR:-/tmp/model_cache}"
+# HF cache 的 refs 名或 commit，默认 main
+MODEL_REVISION="${MODEL_REVISION:-}"
 GCS_OUTPUT_PATH="${GCS_OUTPUT_PATH:-gs://im-drawing-462011-outputs}"
 OUTPUT_DIR="${OUTPUT_DIR:-/app/output}"
 TRAIN_DATASET="${TRAIN_DATASET:-view.jsonl}"
 TRAIN_DATASET_EX="${TRAIN_DATASET_EX:-view_ex.jsonl}"
+# 训练时按需旋转/翻转增强（bard/swift_augment.py），逗号分隔，如 "identity,rot90,rot180,rot270"
+# 设置后不再使用 TRAIN_DATASET_EX，也不需要 train_data_ex 图片
+AUGMENT_TRANSFORMS="${AUGMENT_TRANSFORMS:-}"
+# 图片分片目录（bard/run_data/shards.py 打包），设置后图片从分片 mmap 读取
+SHARD_STORE="${SHARD_STORE:-}"
+if [ -n "$SHARD_STORE" ] && [ -z "$AUGMENT_TRANSFORMS" ]; then
+    # 与 view.jsonl + view_ex.jsonl 等价
+    AUGMENT_TRANSFORMS="identity,rot90"
+fi
 
 # 训练超参数
 NUM_EPOCHS="${NUM_EPOCHS:-2}"
@@ -25,6 +39,9 @@ LORA_RANK="${LORA_RANK:-8}"
 LORA_ALPHA="${LORA_ALPHA:-32}"
 MAX_LENGTH="${MAX_LENGTH:-3000}"
 NPROC_PER_NODE="${NPROC_PER_NODE:-1}"
+SAVE_TOTAL_LIMIT="${SAVE_TOTAL_LIMIT:-2}"
+# 从 GCS_OUTPUT_PATH 中最新的已上传 checkpoint 恢复训练（被抢占后重新提交任务时使用）
+RESUME_FROM_UPLOAD="${RESUME_FROM_UPLOAD:-true}"
 
 echo "训练配置:"
 echo "  模型路径: $MODEL_PATH"
@@ -44,44 +61,14 @@ else
     echo "警告: 未检测到活动认证，使用元数据服务器自动认证..."
 fi
 
-# 模型已打包在镜像中，直接验证
+# 后台拉取模型（与下面的数据集 / GPU / Swift 检查并行），开始训练前等待完成
 echo "=========================================="
-echo "使用镜像内置模型: $MODEL_PATH"
+echo "准备模型: $MODEL_PATH"
 echo "=========================================="
-
-if [ ! -d "$MODEL_PATH" ]; then
-    echo "✗ 模型路径不存在: $MODEL_PATH"
-    echo "请确保模型已打包在镜像中！"
-    exit 1
-fi
-
-# 修复 HuggingFace cache 路径结构
-# HF cache 格式：models--Qwen--Qwen3-VL-4B-Instruct/snapshots/xxxxx/
-if [ -d "$MODEL_PATH/snapshots" ]; then
-    echo "检测到 HuggingFace cache 格式，查找实际模型目录..."
-    SNAPSHOT_DIR=$(find "$MODEL_PATH/snapshots" -mindepth 1 -maxdepth 1 -type d | head -1)
-    if [ -n "$SNAPSHOT_DIR" ] && [ -f "$SNAPSHOT_DIR/config.json" ]; then
-        echo "✓ 找到模型快照: $SNAPSHOT_DIR"
-        MODEL_PATH="$SNAPSHOT_DIR"
-    else
-        echo "✗ 无法找到有效的模型快照"
-        exit 1
-    fi
-fi
-
-echo "✓ 模型路径验证成功: $MODEL_PATH"
-echo "检查关键文件:"
-if [ -f "$MODEL_PATH/config.json" ]; then
-    echo "  ✓ config.json"
-    # 显示 model_type
-    MODEL_TYPE_IN_CONFIG=$(python -c "import json; print(json.load(open('$MODEL_PATH/config.json')).get('model_type', 'NOT_FOUND'))" 2>/dev/null || echo "unknown")
-    echo "  ✓ model_type in config: $MODEL_TYPE_IN_CONFIG"
-else
-    echo "  ✗ config.json 未找到"
-    exit 1
-fi
-
-ls -lh "$MODEL_PATH" | head -10
+export MODEL_CACHE_DIR
+MODEL_PATH_FILE=$(mktemp)
+MODEL_SOURCE="$MODEL_PATH" MODEL_REVISION="$MODEL_REVISION" python model_cache.py > "$MODEL_PATH_FILE" &
+MODEL_FETCH_PID=$!
 
 # 创建输出目录
 mkdir -p "$OUTPUT_DIR"
@@ -92,7 +79,10 @@ if [ ! -f "$TRAIN_DATASET" ]; then
     exit 1
 fi
 
-if [ ! -f "$TRAIN_DATASET_EX" ]; then
+if [ -n "$AUGMENT_TRANSFORMS" ]; then
+    echo "✓ 训练时按需增强: $AUGMENT_TRANSFORMS，不使用扩展数据集"
+    TRAIN_DATASET_EX=""
+elif [ ! -f "$TRAIN_DATASET_EX" ]; then
     echo "警告: 扩展数据集不存在: $TRAIN_DATASET_EX，将只使用主数据集"
     TRAIN_DATASET_EX=""
 fi
@@ -190,14 +180,66 @@ echo "=========================================="
 echo "开始训练..."
 echo "=========================================="
 
+# 训练期间后台增量上传 checkpoint（bard/ckpt_upload.py），训练结束后补传其余输出
+UPLOADER_PID=""
+CKPT_UPLOAD_STOP="$OUTPUT_DIR/.training_done"
+RESUME_CKPT=""
+if [ -n "$GCS_OUTPUT_PATH" ]; then
+    export OUTPUT_DIR GCS_OUTPUT_PATH SAVE_TOTAL_LIMIT CKPT_UPLOAD_STOP
+    rm -f "$CKPT_UPLOAD_STOP"
+    if [ "$RESUME_FROM_UPLOAD" = true ]; then
+        echo "查找已上传的 checkpoint..."
+        RESUME_CKPT=$(python ckpt_upload.py restore) || RESUME_CKPT=""
+    fi
+    python ckpt_upload.py watch &
+    UPLOADER_PID=$!
+    echo "✓ 后台上传 checkpoint 到 $GCS_OUTPUT_PATH（PID $UPLOADER_PID）"
+else
+    echo "⚠️  未配置 GCS_OUTPUT_PATH，输出不会上传"
+fi
+
+# 等待模型就绪
+echo "等待模型下载完成..."
+if ! wait $MODEL_FETCH_PID; then
+    echo "✗ 模型准备失败: $MODEL_PATH"
+    exit 1
+fi
+MODEL_PATH=$(cat "$MODEL_PATH_FILE")
+rm -f "$MODEL_PATH_FILE"
+
+echo "✓ 模型路径: $MODEL_PATH"
+echo "检查关键文件:"
+if [ -f "$MODEL_PATH/config.json" ]; then
+    echo "  ✓ config.json"
+    # 显示 model_type
+    MODEL_TYPE_IN_CONFIG=$(python -c "import json; print(json.load(open('$MODEL_PATH/config.json')).get('model_type', 'NOT_FOUND'))" 2>/dev/null || echo "unknown")
+    echo "  ✓ model_type in config: $MODEL_TYPE_IN_CONFIG"
+else
+    echo "  ✗ config.json 未找到"
+    exit 1
+fi
+
+ls -lh "$MODEL_PATH" | head -10
+
 # 构建训练命令
 # 使用动态检测的模型类型
 echo "使用模型路径: $MODEL_PATH"
 echo "使用模型类型: $QWEN_MODEL_TYPE"
 TRAIN_CMD="NPROC_PER_NODE=$NPROC_PER_NODE swift sft \
     --model $MODEL_PATH \
-    --model_type $QWEN_MODEL_TYPE \
+    --model_type $QWEN_MODEL_TYPE"
+
+if [ -n "$AUGMENT_TRANSFORMS" ]; then
+    export AUGMENT_TRANSFORMS
+    export AUGMENT_DATASET="$TRAIN_DATASET"
+    export SHARD_STORE
+    TRAIN_CMD="$TRAIN_CMD \
+    --custom_register_path swift_augment.py \
+    --dataset view_aug"
+else
+    TRAIN_CMD="$TRAIN_CMD \
     --dataset '$TRAIN_DATASET'"
+fi
 
 # 添加扩展数据集（如果存在）
 if [ -n "$TRAIN_DATASET_EX" ]; then
@@ -228,7 +270,7 @@ TRAIN_CMD="$TRAIN_CMD \
     --gradient_accumulation_steps 2 \
     --eval_steps 100 \
     --save_steps 100 \
-    --save_total_limit 2 \
+    --save_total_limit $SAVE_TOTAL_LIMIT \
     --logging_steps 5 \
     --max_length $MAX_LENGTH \
     --output_dir $OUTPUT_DIR \
@@ -241,10 +283,21 @@ if [ "$USE_DEEPSPEED" = true ]; then
     TRAIN_CMD="$TRAIN_CMD --deepspeed zero3"
 fi
 
-# 执行训练
-eval $TRAIN_CMD
+if [ -n "$RESUME_CKPT" ]; then
+    echo "✓ 从 checkpoint 恢复训练: $RESUME_CKPT"
+    TRAIN_CMD="$TRAIN_CMD --resume_from_checkpoint $RESUME_CKPT"
+fi
 
-EXIT_CODE=$?
+# 执行训练（set -e 下失败也要等上传结束）
+EXIT_CODE=0
+eval $TRAIN_CMD || EXIT_CODE=$?
+
+if [ -n "$UPLOADER_PID" ]; then
+    echo "等待 checkpoint 上传完成..."
+    touch "$CKPT_UPLOAD_STOP"
+    UPLOAD_EXIT=0
+    wait $UPLOADER_PID || UPLOAD_EXIT=$?
+fi
 
 if [ $EXIT_CODE -eq 0 ]; then
     echo ""
@@ -257,17 +310,10 @@ if [ $EXIT_CODE -eq 0 ]; then
     echo "输出文件列表:"
     ls -lh "$OUTPUT_DIR"
     
-    # 如果配置了 GCS 输出路径，上传结果
-    if [ -n "$GCS_OUTPUT_PATH" ]; then
-        echo ""
-        echo "=========================================="
-        echo "上传训练结果到 GCS: $GCS_OUTPUT_PATH"
-        echo "=========================================="
-        
-        gsutil -m cp -r "$OUTPUT_DIR"/* "$GCS_OUTPUT_PATH"/
-        
-        if [ $? -eq 0 ]; then
-            echo "✓ 上传成功"
+    # 训练结果已由后台上传进程同步到 GCS
+    if [ -n "$UPLOADER_PID" ]; then
+        if [ $UPLOAD_EXIT -eq 0 ]; then
+            echo "✓ 已上传到 $GCS_OUTPUT_PATH"
         else
             echo "✗ 上传失败"
             echo "请检查 Service Account 是否有写入权限"